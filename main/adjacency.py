@@ -0,0 +1,189 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Contiguity of the units of submitted communities.
+
+The build_unit_graphs command stores which units of a state share a boundary
+as a UnitGraph: compressed sparse row (CSR) arrays, plus which units are on
+the outline of the state. Each process reads the graphs it uses once, and
+the shape of a set of units is then two connected components passes over
+sparse matrices, linear in the size of the graph:
+ - components: the separate pieces of the community
+ - holes: the groups of other units that the community encloses, i.e. the
+   pieces of the rest of the state that do not reach its outline
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from .models import UnitGraph
+from .units import units_generation
+
+# the share of the perimeter of a unit that is not shared with the other
+# units of the state, above which the unit is on the outline of the state
+EXTERIOR_TOLERANCE = 1e-6
+
+Graph = namedtuple("Graph", ["census_ids", "matrix", "exterior"])
+
+
+def _unit_rows(model, fips, year):
+    table = connection.ops.quote_name(model._meta.db_table)
+    params = [year, fips + "%"]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT census_id, ST_Perimeter(geometry) FROM %s "
+            "WHERE year = %%s AND census_id LIKE %%s "
+            "AND geometry IS NOT NULL" % table,
+            params,
+        )
+        units = cursor.fetchall()
+        # units that only touch at a corner are not neighbors
+        cursor.execute(
+            "SELECT * FROM ("
+            "SELECT a.census_id, b.census_id, ST_Length(ST_Intersection("
+            "ST_Boundary(a.geometry), ST_Boundary(b.geometry))) AS length "
+            "FROM {0} a JOIN {0} b ON a.geometry && b.geometry "
+            "AND a.census_id < b.census_id "
+            "WHERE a.year = %s AND a.census_id LIKE %s "
+            "AND b.year = a.year AND b.census_id LIKE %s "
+            "AND ST_Touches(a.geometry, b.geometry)"
+            ") edges WHERE length > 0".format(table),
+            params + params[1:],
+        )
+        edges = cursor.fetchall()
+    return units, edges
+
+
+def build_unit_graph(model, fips, year):
+    """
+    Builds and stores the UnitGraph of the BlockGroup or CensusBlock rows of
+    a state (by FIPS code) and year that have a geometry. Returns the number
+    of units of the graph.
+    """
+    units, edges = _unit_rows(model, fips, year)
+    if not units:
+        return 0
+    census_ids = np.array([int(c) for c, _ in units], dtype=np.int64)
+    perimeters = np.array([p for _, p in units], dtype=np.float64)
+    order = np.argsort(census_ids)
+    census_ids, perimeters = census_ids[order], perimeters[order]
+    n = len(census_ids)
+
+    a = np.searchsorted(census_ids, [int(e[0]) for e in edges])
+    b = np.searchsorted(census_ids, [int(e[1]) for e in edges])
+    lengths = np.array([e[2] for e in edges], dtype=np.float64)
+    # each edge is stored in both directions
+    rows = np.concatenate([a, b]).astype(np.int64)
+    cols = np.concatenate([b, a]).astype(np.int32)
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(n + 1, dtype=np.int32)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    shared = np.bincount(rows, weights=np.tile(lengths, 2), minlength=n)
+    exterior = perimeters - shared > perimeters * EXTERIOR_TOLERANCE
+
+    UnitGraph.objects.update_or_create(
+        unit=model._meta.model_name,
+        fips=fips,
+        year=year,
+        defaults={
+            "census_ids": census_ids.tobytes(),
+            "indptr": indptr.tobytes(),
+            "indices": cols[order].tobytes(),
+            "exterior": exterior.tobytes(),
+        },
+    )
+    return n
+
+
+@lru_cache(maxsize=getattr(settings, "UNIT_GRAPH_CACHE_SIZE", 4))
+def unit_graph(unit, fips, year, generation):
+    """
+    The Graph of the units of a state (by FIPS code) and year, or None if
+    it was not built. generation is only part of the cache key.
+    """
+    row = UnitGraph.objects.filter(unit=unit, fips=fips, year=year).first()
+    if row is None:
+        return None
+    census_ids = np.frombuffer(bytes(row.census_ids), dtype=np.int64)
+    indices = np.frombuffer(bytes(row.indices), dtype=np.int32)
+    n = len(census_ids)
+    matrix = csr_matrix(
+        (
+            np.ones(len(indices), dtype=np.int8),
+            indices,
+            np.frombuffer(bytes(row.indptr), dtype=np.int32),
+        ),
+        shape=(n, n),
+    )
+    exterior = np.frombuffer(bytes(row.exterior), dtype=bool)
+    return Graph(census_ids, matrix, exterior)
+
+
+def _shape(graph, selected):
+    inside = graph.matrix[selected][:, selected]
+    components = connected_components(
+        inside, directed=False, return_labels=False
+    )
+    outside = ~selected
+    count, labels = connected_components(
+        graph.matrix[outside][:, outside], directed=False
+    )
+    # the pieces of the rest of the state that reach its outline
+    open_pieces = np.unique(labels[graph.exterior[outside]])
+    return components, count - len(open_pieces)
+
+
+def analyze_units(model, census_ids, year):
+    """
+    Returns the (components, holes) of a set of BlockGroup or CensusBlock
+    census ids, or None if a unit is not in the graph of its state or the
+    graph was not built.
+    """
+    groups = {}
+    for census_id in dict.fromkeys(census_ids):
+        if census_id.isdigit():
+            groups.setdefault(census_id[:2], []).append(int(census_id))
+        elif census_id:
+            return None
+    if not groups:
+        return None
+    components = holes = 0
+    generation = units_generation()
+    for fips, ids in groups.items():
+        graph = unit_graph(model._meta.model_name, fips, year, generation)
+        if graph is None or not len(graph.census_ids):
+            return None
+        query = np.array(ids, dtype=np.int64)
+        index = np.searchsorted(graph.census_ids, query).clip(
+            0, len(graph.census_ids) - 1
+        )
+        if not (graph.census_ids[index] == query).all():
+            return None
+        selected = np.zeros(len(graph.census_ids), dtype=bool)
+        selected[index] = True
+        state_components, state_holes = _shape(graph, selected)
+        components += state_components
+        holes += state_holes
+    return components, holes
@@ -27,17 +27,23 @@ from main.models import CommunityEntry, Report
 from .models import User
 from django.urls import reverse
 from django.utils.html import format_html
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 
 from django import forms
 from ckeditor.widgets import CKEditorWidget
-import pandas as pd
 
 import csv
 import geojson
 from geojson_rewind import rewind
 
-from .models import State, Drive, Organization, Address
+from .models import State, Drive, Organization, Address, ExportJob, Task
+from .export_jobs import BUILD_EXPORT, start_export
+from .exports import BULK_FORMATS, block_equivalency, bulk_export
+from .tasks import enqueue
+from .review import APPROVE, UNAPPROVE, moderate
 
 # ********************************************************************* #
 
@@ -64,11 +70,11 @@ def make_geojson_for_state_map_page(request, entry):
     # iterate over block_groups or census_blocks in order to get array of IDs
     if user_map.block_groups.exists():
         gj["features"][0]["properties"]["block_group_ids"] = [
-            bg.census_id for bg in user_map.block_groups.all()
+            bg.census_id for bg in user_map.block_groups.only("census_id")
         ]
     elif user_map.census_blocks.exists():
         gj["features"][0]["properties"]["census_block_ids"] = [
-            block.census_id for block in user_map.census_blocks.all()
+            block.census_id for block in user_map.census_blocks.only("census_id")
         ]
     # include organization and drive submitted to, if so
     if user_map.organization:
@@ -153,16 +159,21 @@ class ReportAdmin(admin.ModelAdmin):
         return obj.community.admin_approved
 
     def unapprove_resolve(self, request, queryset):
-        for rep in queryset:
-            rep.unapprove()
-            rep.resolved = True
-            rep.save()
+        self.moderate_and_resolve(request, queryset, UNAPPROVE)
 
     def approve_resolve(self, request, queryset):
-        for rep in queryset:
-            rep.approve()
-            rep.resolved = True
-            rep.save()
+        self.moderate_and_resolve(request, queryset, APPROVE)
+
+    def moderate_and_resolve(self, request, queryset, action):
+        with transaction.atomic():
+            count = moderate(
+                CommunityEntry.objects.filter(
+                    pk__in=queryset.values("community")
+                ),
+                action,
+            )
+            queryset.update(resolved=True)
+        self.message_user(request, "%d communities %sd" % (count, action))
 
     unapprove_resolve.short_description = (
         "Unapprove the community and mark as resolved"
@@ -243,6 +254,8 @@ class CommunityAdmin(ImportExportModelAdmin):
         "drive",
         "state",
         "admin_approved",
+        "unit_components",
+        "unit_holes",
         'get_services_length',
         'get_economic_length',
         'get_cultural_length',
@@ -270,25 +283,48 @@ class CommunityAdmin(ImportExportModelAdmin):
         return response
 
     def export_cois_block_equiv(self, request, queryset):
+        return StreamingHttpResponse(
+            block_equivalency(queryset), content_type="text/csv"
+        )
 
-        df = pd.DataFrame()
-        i = 0
-        for obj in queryset:
-            i += 1
-            # iterate over block_groups or census_blocks in order to get array of IDs
-            row_data = dict()
-            if obj.block_groups.exists():
-                row_data['BLOCKID'] = [bg.census_id for bg in obj.block_groups.all()]
-            elif obj.census_blocks.exists():
-                row_data['BLOCKID'] = [block.census_id for block in obj.census_blocks.all()]
-            else:
-                break
-            row_data['DISTRICT'] = [i] * len(row_data['BLOCKID'])
-            df = df.append(pd.DataFrame(row_data))
-
-        return HttpResponse(df.to_csv(index=False), content_type="text/csv")
+    def export_cois_geoparquet(self, request, queryset):
+        return self.export_bulk("parquet", queryset)
+
+    def export_cois_flatgeobuf(self, request, queryset):
+        return self.export_bulk("fgb", queryset)
+
+    def export_bulk(self, export_type, queryset):
+        _, extension, content_type = BULK_FORMATS[export_type]
+        response = StreamingHttpResponse(
+            bulk_export(export_type, queryset, everyone=True),
+            content_type=content_type,
+        )
+        response["Content-Disposition"] = (
+            'attachment; filename="communities.%s"' % extension
+        )
+        return response
 
     def export_cois_geojson(self, request, queryset):
+        if queryset.count() > settings.EXPORT_JOB_THRESHOLD:
+            # too many to export within the request
+            job = start_export(
+                request.user,
+                queryset,
+                ExportJob.GEOJSON,
+                "communities",
+                admin=True,
+            )
+            self.message_user(
+                request,
+                format_html(
+                    "The export of {} communities was started. It will be "
+                    '<a href="{}">here</a> once it is ready, and you will be '
+                    "emailed a link.",
+                    job.total,
+                    reverse("main:export_job", args=[job.pk]),
+                ),
+            )
+            return None
 
         all_gj = []
         for entry in queryset:
@@ -327,8 +363,21 @@ class CommunityAdmin(ImportExportModelAdmin):
     export_emails_as_csv.short_description = "Export Selected Emails"
     export_cois_block_equiv.short_description = "Export as block equivalency"
     export_cois_geojson.short_description = "Export as geojson"
+    export_cois_geoparquet.short_description = "Export as GeoParquet"
+    export_cois_flatgeobuf.short_description = "Export as FlatGeobuf"
     export_cois_testimony.short_description = "Export csv of testimony"
-    actions = ["export_emails_as_csv", "export_cois_block_equiv", "export_cois_geojson", "export_cois_testimony"]
+
+    def approve_selected(self, request, queryset):
+        count = moderate(queryset, APPROVE)
+        self.message_user(request, "%d communities approved" % count)
+
+    def unapprove_selected(self, request, queryset):
+        count = moderate(queryset, UNAPPROVE)
+        self.message_user(request, "%d communities unapproved" % count)
+
+    approve_selected.short_description = "Approve selected communities"
+    unapprove_selected.short_description = "Unapprove selected communities"
+    actions = ["export_emails_as_csv", "export_cois_block_equiv", "export_cois_geojson", "export_cois_geoparquet", "export_cois_flatgeobuf", "export_cois_testimony", "approve_selected", "unapprove_selected"]
 
     def get_user_email(self, obj):
         return obj.user.email
@@ -429,3 +478,56 @@ class DriveAdmin(admin.ModelAdmin, ExportCsvMixin):
     actions = ["export_as_csv"]
 
 admin.site.register(Drive, DriveAdmin)
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ("name", "status", "attempts", "run_at", "created_at")
+    list_filter = ("status", "name")
+    readonly_fields = ("attempts", "last_error", "created_at", "updated_at")
+    actions = ["retry"]
+
+    def retry(self, request, queryset):
+        """
+        Queues the selected tasks again, with a fresh set of attempts.
+        """
+        count = queryset.update(
+            status=Task.PENDING, attempts=0, run_at=timezone.now()
+        )
+        self.message_user(request, "%d tasks queued" % count)
+
+    retry.short_description = "Retry selected tasks"
+
+
+admin.site.register(Task, TaskAdmin)
+
+
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ("name", "format", "user", "status", "done", "created_at")
+    list_filter = ("status", "format")
+    readonly_fields = (
+        "entry_ids",
+        "done",
+        "size",
+        "created_at",
+        "updated_at",
+        "finished_at",
+    )
+    actions = ["resume"]
+
+    def resume(self, request, queryset):
+        """
+        Queues the failed jobs again, from where they stopped.
+        """
+        count = 0
+        for job in queryset.filter(status=ExportJob.FAILED):
+            job.status = ExportJob.QUEUED
+            job.finished_at = None
+            job.save()
+            enqueue(BUILD_EXPORT, job_id=job.pk)
+            count += 1
+        self.message_user(request, "%d export jobs queued" % count)
+
+    resume.short_description = "Resume selected failed jobs"
+
+
+admin.site.register(ExportJob, ExportJobAdmin)
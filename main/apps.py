@@ -22,3 +22,8 @@ from django.apps import AppConfig
 
 class MainConfig(AppConfig):
     name = "main"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import pipeline  # noqa: F401
+        from . import export_jobs  # noqa: F401
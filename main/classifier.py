@@ -0,0 +1,106 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+A character n-gram naive Bayes text classifier, the local first pass of the
+moderation (see moderation.py).
+
+Texts are lowercased, their character n-grams are hashed into a fixed number
+of buckets, and the model is the log-likelihood ratio of each bucket between
+the toxic and the clean training texts, plus the log ratio of their priors.
+Character n-grams still match misspelled or decorated words. Scoring a text
+is one hash per n-gram and one NumPy sum, in process.
+"""
+import math
+import re
+import zlib
+
+import numpy as np
+
+NGRAM_SIZES = (3, 4, 5)
+
+# the number of hash buckets of the n-grams
+BUCKETS = 2 ** 18
+
+_spaces = re.compile(r"\s+")
+
+
+def ngrams(text, sizes=NGRAM_SIZES):
+    text = " %s " % _spaces.sub(" ", text.lower()).strip()
+    for n in sizes:
+        for i in range(len(text) - n + 1):
+            yield text[i : i + n]
+
+
+def hash_ngrams(text, buckets=BUCKETS):
+    return np.fromiter(
+        (zlib.crc32(gram.encode("utf-8")) % buckets for gram in ngrams(text)),
+        dtype=np.int64,
+    )
+
+
+class NgramModel:
+    """
+    A trained classifier: weights[bucket] is the log-likelihood ratio of an
+    n-gram of the bucket, bias the log prior ratio.
+    """
+
+    def __init__(self, weights, bias):
+        self.weights = weights
+        self.bias = bias
+
+    @classmethod
+    def train(cls, texts, labels, buckets=BUCKETS, alpha=1.0):
+        """
+        Trains a model from texts and their labels (true for toxic), with
+        additive smoothing alpha.
+        """
+        counts = np.zeros((2, buckets))
+        documents = np.zeros(2)
+        for text, label in zip(texts, labels):
+            label = int(bool(label))
+            np.add.at(counts[label], hash_ngrams(text, buckets), 1)
+            documents[label] += 1
+        if not documents.all():
+            raise ValueError("training needs both toxic and clean texts")
+        likelihoods = np.log(counts + alpha) - np.log(
+            counts.sum(axis=1, keepdims=True) + alpha * buckets
+        )
+        return cls(
+            (likelihoods[1] - likelihoods[0]).astype(np.float32),
+            float(math.log(documents[1] / documents[0])),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["weights"], float(data["bias"]))
+
+    def save(self, path):
+        # np.savez adds .npz to names without it
+        with open(path, "wb") as f:
+            np.savez_compressed(f, weights=self.weights, bias=self.bias)
+
+    def probability(self, text):
+        """
+        The probability that a text is toxic.
+        """
+        grams = hash_ngrams(text, len(self.weights))
+        score = self.bias + float(self.weights[grams].sum())
+        return 1 / (1 + math.exp(-min(max(score, -50), 50)))
@@ -0,0 +1,111 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Simplified copies of community polygons, used for display only.
+
+A community drawn from census blocks can have tens of thousands of vertices,
+far more than a map can show below street level. Every CommunityEntry keeps
+one topology-preserving simplification per zoom band next to its full
+polygon; the full polygon is still what gets exported and audited.
+"""
+
+# (field, lowest zoom the level is used at, tolerance in degrees)
+DISPLAY_LEVELS = (
+    ("display_polygon_low", 0, 0.005),
+    ("display_polygon_mid", 8, 0.001),
+    ("display_polygon_high", 11, 0.0001),
+)
+
+DISPLAY_FIELDS = tuple(field for field, _, _ in DISPLAY_LEVELS)
+
+# every column CommunityEntry computes from its drawn polygon on save; the
+# planar copy backs the bounding box queries (see views.main.CommunityBounds)
+DERIVED_FIELDS = DISPLAY_FIELDS + ("planar_polygon",)
+
+# the zoom most of the geometries of a page are looked at: maps showing many
+# communities at once, and pages about a single community
+MAP_ZOOM = 8
+DETAIL_ZOOM = 11
+
+
+def display_field(zoom):
+    """
+    Returns the display polygon field to draw at the given zoom.
+    """
+    field = DISPLAY_FIELDS[0]
+    for name, min_zoom, _ in DISPLAY_LEVELS:
+        if zoom >= min_zoom:
+            field = name
+    return field
+
+
+def simplify_for_display(geometry):
+    """
+    Returns {field: simplified geometry} for every display level of a
+    community polygon, or None values if there is no polygon.
+    """
+    if geometry is None:
+        return dict.fromkeys(DISPLAY_FIELDS)
+    levels = {}
+    for field, _, tolerance in DISPLAY_LEVELS:
+        simplified = geometry.simplify(tolerance, preserve_topology=True)
+        # tiny communities may collapse at the coarser levels
+        levels[field] = geometry if simplified.empty else simplified
+        levels[field].srid = 4326
+    return levels
+
+
+def derive_polygons(geometry):
+    """
+    Returns {field: value} for every DERIVED_FIELDS column of a community
+    drawn as the given polygon.
+    """
+    derived = simplify_for_display(geometry)
+    derived["planar_polygon"] = None if geometry is None else geometry.clone()
+    return derived
+
+
+def display_geojson(entry, zoom):
+    """
+    Returns the GeoJSON geometry string to draw a community with at the given
+    zoom, falling back to the full polygon until the entry is backfilled.
+    """
+    geometry = getattr(entry, display_field(zoom))
+    if geometry is None:
+        geometry = entry.census_blocks_polygon
+    if geometry is None:
+        geometry = entry.user_polygon
+    if geometry is None:
+        return None
+    return geometry.geojson
+
+
+def defer_full_polygons(queryset, zoom):
+    """
+    Skips loading the polygons that display_geojson() won't need.
+    """
+    field = display_field(zoom)
+    return queryset.defer(
+        "census_blocks_polygon_array",
+        "census_blocks_polygon",
+        "user_polygon",
+        "planar_polygon",
+        *[name for name in DISPLAY_FIELDS if name != field]
+    )
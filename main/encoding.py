@@ -0,0 +1,142 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Compact encoding of the community coordinates embedded in map pages.
+
+Each ring of a GeoJSON Polygon or MultiPolygon is quantized to a fixed grid
+(10^-precision degrees), delta encoded point to point, and written as an
+encoded polyline string (the algorithm of Google's polyline format, keeping
+the GeoJSON lng,lat order). The nesting of the rings is kept as is, so
+"polyline6" turns [[[lng, lat], ...]] into ["<encoded ring>", ...].
+
+The matching decoder is static/main/js/polyline.js.
+"""
+from django.conf import settings
+
+POLYLINE = "polyline"
+
+
+def parse_encoding(encoding):
+    """
+    Returns the precision of an encoding name such as "polyline6", or None
+    for no encoding (""). Raises ValueError for unknown encodings.
+    """
+    if not encoding:
+        return None
+    if not encoding.startswith(POLYLINE):
+        raise ValueError("unknown geometry encoding %r" % encoding)
+    precision = int(encoding[len(POLYLINE):])
+    # the decoder works on 32 bit integers: 180 * 10^6, zigzagged, still fits
+    if not 0 <= precision <= 6:
+        raise ValueError("unsupported polyline precision %d" % precision)
+    return precision
+
+
+def page_encoding():
+    """
+    The encoding of the coordinates embedded in map pages ("" to embed plain
+    coordinate arrays).
+    """
+    return getattr(settings, "MAP_GEOMETRY_ENCODING", "")
+
+
+def _encode_value(value, out):
+    # zigzag the sign into the lowest bit, then emit 5 bits per character
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode_ring(ring, precision):
+    factor = 10 ** precision
+    out = []
+    prev_x = prev_y = 0
+    for point in ring:
+        x = round(point[0] * factor)
+        y = round(point[1] * factor)
+        _encode_value(x - prev_x, out)
+        _encode_value(y - prev_y, out)
+        prev_x, prev_y = x, y
+    return "".join(out)
+
+
+def decode_ring(encoded, precision):
+    factor = 10 ** precision
+    values = []
+    value = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        value |= (byte & 0x1F) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    ring = []
+    x = y = 0
+    for dx, dy in zip(values[::2], values[1::2]):
+        x += dx
+        y += dy
+        ring.append([x / factor, y / factor])
+    return ring
+
+
+def encode_coordinates(coordinates, precision):
+    """
+    Encodes every ring of a GeoJSON coordinates array, at any nesting depth.
+    """
+    if not coordinates:
+        return coordinates
+    if isinstance(coordinates[0][0], (int, float)):
+        return encode_ring(coordinates, precision)
+    return [encode_coordinates(part, precision) for part in coordinates]
+
+
+def decode_coordinates(encoded, precision):
+    if isinstance(encoded, str):
+        return decode_ring(encoded, precision)
+    return [decode_coordinates(part, precision) for part in encoded]
+
+
+def encode_entries(entries, encoding):
+    """
+    Encodes a {entry_ID: coordinates} dict as embedded in the map pages.
+    """
+    precision = parse_encoding(encoding)
+    if precision is None:
+        return entries
+    return {
+        entry_id: encode_coordinates(coordinates, precision)
+        for entry_id, coordinates in entries.items()
+    }
+
+
+def encode_records(records, encoding):
+    """
+    Encodes the "coordinates" of map snapshot records, in place.
+    """
+    precision = parse_encoding(encoding)
+    if precision is not None:
+        for record in records:
+            record["coordinates"] = encode_coordinates(
+                record["coordinates"], precision
+            )
+    return records
@@ -0,0 +1,318 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Exports built in the background, for exports too large for a request.
+
+start_export() records the communities to export as an ExportJob and queues
+its first chunk on the task queue (see tasks.py). Each build_export task
+writes the next EXPORT_JOB_CHUNK_SIZE communities to a part file of the job,
+commits its progress and queues the next chunk, so users can follow the
+progress of their job, and a worker that stops in the middle of a chunk
+leaves a task that writes its part again. At most EXPORT_JOB_CONCURRENCY
+jobs run at a time; the others wait in the queue. The last task joins the
+parts into the file of the job, and the user is emailed a download link.
+
+The files are kept in the default file storage, under EXPORT_JOB_FOLDER, so
+that the workers and the web processes that serve the downloads share them
+whatever machine they run on. They are deleted with their job, which
+expires EXPORT_JOB_EXPIRY_DAYS after it finished.
+"""
+import shutil
+import tempfile
+from datetime import timedelta
+
+import geojson
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.mail import send_mail
+from django.db import connection, transaction
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from .exports import (
+    COLLECTION_END,
+    COLLECTION_START,
+    TESTIMONY_COLUMNS,
+    block_equivalency,
+    state_map_feature,
+)
+from .models import CommunityEntry, ExportJob
+from .tasks import enqueue, task
+
+BUILD_EXPORT = "build_export"
+EXPIRE_EXPORT = "expire_export"
+
+# seconds before a queued job checks again whether it may start
+EXPORT_JOB_WAIT = 30
+
+# the key of the lock held to count the running jobs
+_ADMISSION_LOCK = 7341
+
+EXTENSIONS = {ExportJob.GEOJSON: "geojson", ExportJob.CSV: "csv"}
+CONTENT_TYPES = {
+    ExportJob.GEOJSON: "application/json",
+    ExportJob.CSV: "text/csv",
+}
+
+
+def _job_folder(job_id):
+    folder = getattr(settings, "EXPORT_JOB_FOLDER", "export_jobs")
+    return "%s/%d" % (folder, job_id)
+
+
+def job_path(job):
+    """
+    The name of the file of an export job in the default file storage,
+    written once the job is done.
+    """
+    return "%s/%s" % (_job_folder(job.pk), job_filename(job))
+
+
+def part_path(job, start):
+    """
+    The name of the part of an export job that starts at its start-th
+    community.
+    """
+    return "%s/%d.part" % (_job_folder(job.pk), start)
+
+
+def job_filename(job):
+    return "%s.%s" % (job.name, EXTENSIONS[job.format])
+
+
+def job_status(job):
+    """
+    The progress of an export job, as polled by its user.
+    """
+    status = {
+        "id": job.pk,
+        "status": job.status,
+        "done": job.done,
+        "total": job.total,
+        "url": reverse("main:export_job", args=[job.pk]),
+    }
+    if job.status == ExportJob.DONE:
+        status["download_url"] = reverse(
+            "main:export_job_download", args=[job.pk]
+        )
+    return status
+
+
+def start_export(user, queryset, format, name, admin=False):
+    """
+    Creates the ExportJob of the communities of a queryset and queues its
+    first chunk, once the current transaction commits.
+    """
+    job = ExportJob.objects.create(
+        user=user,
+        format=format,
+        name=name,
+        admin=admin,
+        entry_ids=list(
+            queryset.order_by("pk").values_list("pk", flat=True).distinct()
+        ),
+    )
+    enqueue(BUILD_EXPORT, job_id=job.pk)
+    return job
+
+
+def _may_start():
+    # one job at a time counts the running jobs, so that two workers never
+    # both take the last free slot
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", [_ADMISSION_LOCK])
+    running = ExportJob.objects.filter(status=ExportJob.RUNNING).count()
+    return running < getattr(settings, "EXPORT_JOB_CONCURRENCY", 2)
+
+
+def _chunks(job, entry_ids):
+    # the encoded chunks of the next communities of a job
+    entries = CommunityEntry.objects.filter(pk__in=entry_ids).order_by("pk")
+    if job.format == ExportJob.CSV:
+        yield from block_equivalency(
+            entries,
+            list(TESTIMONY_COLUMNS),
+            viewer=job.user,
+            start=job.done,
+            header=not job.done,
+        )
+        return
+    if not job.done:
+        yield COLLECTION_START
+    # no separator before the first feature of the file
+    first = job.size <= len(COLLECTION_START)
+    entries = entries.defer(
+        "census_blocks_polygon_array", "user_polygon"
+    ).select_related("organization", "drive", "user")
+    for entry in entries:
+        feature = state_map_feature(
+            entry, job.user, private=True if job.admin else None
+        )
+        yield (b"" if first else b", ") + geojson.dumps(feature).encode()
+        first = False
+
+
+def _save(name, f):
+    # the file system storage would save under another name, and S3
+    # replaces the object
+    default_storage.delete(name)
+    default_storage.save(name, File(f))
+
+
+def _parts(job):
+    # each attempt at a chunk writes the part of the same start
+    _, files = default_storage.listdir(_job_folder(job.pk))
+    starts = sorted(
+        int(name[: -len(".part")]) for name in files if name.endswith(".part")
+    )
+    return [part_path(job, start) for start in starts]
+
+
+def _delete(names):
+    for name in names:
+        default_storage.delete(name)
+
+
+def _join_parts(job):
+    parts = _parts(job)
+    with tempfile.TemporaryFile() as f:
+        for name in parts:
+            with default_storage.open(name, "rb") as part:
+                shutil.copyfileobj(part, f)
+        f.seek(0)
+        _save(job_path(job), f)
+    # kept until the job is committed as done, for the next attempt
+    transaction.on_commit(lambda: _delete(parts))
+
+
+def delete_job_files(job_id):
+    """
+    Deletes the file and the parts of an export job.
+    """
+    try:
+        _, files = default_storage.listdir(_job_folder(job_id))
+    except FileNotFoundError:
+        return
+    _delete("%s/%s" % (_job_folder(job_id), name) for name in files)
+
+
+def _expire_later(job):
+    days = getattr(settings, "EXPORT_JOB_EXPIRY_DAYS", 7)
+    enqueue(
+        EXPIRE_EXPORT,
+        run_at=job.finished_at + timedelta(days=days),
+        job_id=job.pk,
+    )
+
+
+def _finish(job):
+    job.status = ExportJob.DONE
+    job.finished_at = timezone.now()
+    _expire_later(job)
+    if not job.user.email:
+        return
+    context = {
+        "job": job,
+        "expiry_days": getattr(settings, "EXPORT_JOB_EXPIRY_DAYS", 7),
+        "url": "https://%s%s"
+        % (
+            Site.objects.get_current().domain,
+            reverse("main:export_job_download", args=[job.pk]),
+        ),
+    }
+    subject = render_to_string("main/emails/export_subject.txt", context)
+    send_mail(
+        subject.strip(),
+        render_to_string("main/emails/export_message.txt", context),
+        settings.DEFAULT_FROM_EMAIL,
+        [job.user.email],
+    )
+
+
+def export_failed(job_id):
+    job = ExportJob.objects.filter(pk=job_id).first()
+    if job is not None:
+        job.status = ExportJob.FAILED
+        job.finished_at = timezone.now()
+        job.save()
+        _expire_later(job)
+
+
+@task(EXPIRE_EXPORT)
+def expire_export(job_id):
+    """
+    Deletes an export job that finished EXPORT_JOB_EXPIRY_DAYS ago, and so
+    its files (see signals.py). Failed jobs resumed since then expire later.
+    """
+    days = getattr(settings, "EXPORT_JOB_EXPIRY_DAYS", 7)
+    ExportJob.objects.filter(
+        pk=job_id,
+        status__in=(ExportJob.DONE, ExportJob.FAILED),
+        finished_at__lte=timezone.now() - timedelta(days=days),
+    ).delete()
+
+
+@task(BUILD_EXPORT, on_failure=export_failed)
+def build_export(job_id):
+    """
+    Writes the next chunk of an export job, then queues the one after it,
+    or completes the job.
+    """
+    job = (
+        ExportJob.objects.select_for_update(of=("self",))
+        .select_related("user")
+        .filter(pk=job_id)
+        .first()
+    )
+    if job is None or job.status in (ExportJob.DONE, ExportJob.FAILED):
+        return
+    if job.status == ExportJob.QUEUED:
+        if not _may_start():
+            enqueue(
+                BUILD_EXPORT,
+                run_at=timezone.now() + timedelta(seconds=EXPORT_JOB_WAIT),
+                job_id=job.pk,
+            )
+            return
+        job.status = ExportJob.RUNNING
+
+    size = getattr(settings, "EXPORT_JOB_CHUNK_SIZE", 500)
+    start = job.done
+    entry_ids = job.entry_ids[start : start + size]
+    with tempfile.TemporaryFile() as f:
+        for chunk in _chunks(job, entry_ids):
+            f.write(chunk)
+        job.done += len(entry_ids)
+        if job.done >= job.total and job.format == ExportJob.GEOJSON:
+            f.write(COLLECTION_END)
+        job.size += f.tell()
+        f.seek(0)
+        # replaces the part of an interrupted attempt
+        _save(part_path(job, start), f)
+
+    if job.done >= job.total:
+        _join_parts(job)
+        _finish(job)
+    else:
+        enqueue(BUILD_EXPORT, job_id=job.pk)
+    job.save()
@@ -0,0 +1,585 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Streamed exports of communities.
+
+The communities are read with a server-side cursor, CHUNK_SIZE at a time,
+and each one is written out as soon as it is turned into a feature: as part
+of a GeoJSON FeatureCollection or into a zip file written on the fly. Only
+one chunk of communities is in memory at a time, whatever the size of the
+export.
+
+Block equivalency files (one CSV row per census unit of each community) are
+built a chunk of communities at a time from the unit through tables, with
+one query and one vectorized join per chunk (see block_equivalency).
+
+GeoParquet and FlatGeobuf files (see BULK_FORMATS) are written from the same
+chunks of communities, with their geometries read as WKB from PostGIS.
+
+The exports of a whole state, organization or drive are also kept on disk
+under EXPORT_CACHE_DIR/<scope>/<audience>/<version>/<name>, written as they
+are first sent. Bumping the version of a scope (see versions.py) makes its
+cached exports unreachable, so repeat downloads of unchanged data are a file
+send, or a 304 response for clients that kept the ETag.
+"""
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from collections import namedtuple
+from contextlib import suppress
+from itertools import islice
+
+import geojson
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.contrib.gis.db.models.functions import AsWKB
+from django.contrib.staticfiles import finders
+from django.core.serializers import serialize
+from django.db.models import (
+    BooleanField,
+    CharField,
+    OuterRef,
+    Subquery,
+    Value,
+)
+from django.db.models.functions import Concat
+from django.http import (
+    FileResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.utils.cache import patch_cache_control
+from geojson_rewind import rewind
+
+from .models import Address, CommunityEntry
+from .versions import get_version, on_bump
+
+# communities read from the database at a time
+CHUNK_SIZE = 100
+
+# the text of a GeoJSON FeatureCollection around its features
+COLLECTION_START = b'{"type": "FeatureCollection", "features": ['
+COLLECTION_END = b"]}"
+
+# communities of a block equivalency file read at a time, without their
+# geometries
+ENTRY_CHUNK_SIZE = 2000
+
+# the testimony columns of the block equivalency files: column -> lookup
+TESTIMONY_COLUMNS = {
+    "entry_name": "entry_name",
+    "author_name": "user_name",
+    "address": "address",
+    "cultural_interests": "cultural_interests",
+    "economic_interests": "economic_interests",
+    "comm_activities": "comm_activities",
+    "other_considerations": "other_considerations",
+    "custom_response": "custom_response",
+    "organization": "organization__name",
+    "drive": "drive__name",
+}
+
+# only shown to the authors and to the admins of their organizations
+PRIVATE_COLUMNS = ("author_name", "address")
+
+# the columns of the GeoParquet and FlatGeobuf exports: column -> lookup
+FEATURE_COLUMNS = {
+    "entry_ID": "entry_ID",
+    **TESTIMONY_COLUMNS,
+    "population": "population",
+}
+
+# GeoParquet 1.0 file metadata; coordinates are longitude, latitude (the
+# default OGC:CRS84)
+GEOPARQUET_METADATA = {
+    "version": "1.0.0",
+    "primary_column": "geometry",
+    "columns": {
+        "geometry": {
+            "encoding": "WKB",
+            "geometry_types": ["Polygon", "MultiPolygon"],
+        }
+    },
+}
+
+# bytes read at a time from the files of bulk exports
+FILE_CHUNK_SIZE = 64 * 1024
+
+# audiences: who a cached export was made for, as in tiles.py
+PUBLIC = "public"
+ADMIN = "admin"
+
+Artifact = namedtuple("Artifact", ["path", "etag"])
+
+
+def readme_path(name):
+    """
+    The path of a readme included in the exported zip files.
+    """
+    path = "main/readme/%s" % name
+    return finders.find(path) or os.path.join(settings.STATIC_ROOT, path)
+
+
+def iter_features(queryset, make_feature):
+    """
+    The GeoJSON features of the communities of a queryset, made by
+    make_feature(entry).
+    """
+    for entry in queryset.iterator(chunk_size=CHUNK_SIZE):
+        yield make_feature(entry)
+
+
+def state_map_feature(entry, viewer, private=None):
+    """
+    The GeoJSON feature of a community in the exports of the state map
+    pages. Its author name and address are only filled in for its author and
+    the admins of its organization, unless private says whether to include
+    them.
+    """
+    map_geojson = serialize(
+        "geojson",
+        [entry],
+        geometry_field="census_blocks_polygon",
+        fields=(
+            "entry_name",
+            "entry_ID",
+            "cultural_interests",
+            "economic_interests",
+            "comm_activities",
+            "other_considerations",
+            "custom_response",
+            "population",
+        ),
+    )
+    gj = geojson.loads(map_geojson)
+    gj = rewind(gj)
+    del gj["crs"]
+    user_map = entry
+    # iterate over block_groups or census_blocks in order to get array of IDs
+    if user_map.block_groups.exists():
+        gj["features"][0]["properties"]["block_group_ids"] = [
+            bg.census_id for bg in user_map.block_groups.only("census_id")
+        ]
+    elif user_map.census_blocks.exists():
+        gj["features"][0]["properties"]["census_block_ids"] = [
+            block.census_id
+            for block in user_map.census_blocks.only("census_id")
+        ]
+    # include address if user is authenticated + either author or org admin
+    if private is None and viewer.is_authenticated:
+        is_org_leader = user_map.organization and (
+            viewer.is_org_admin(user_map.organization_id)
+        )
+        private = bool(is_org_leader or viewer == user_map.user)
+    if private:
+        gj["features"][0]["properties"]["author_name"] = user_map.user_name
+        for a in Address.objects.filter(entry=user_map):
+            addy = a.street + " " + a.city + ", " + a.state + " " + a.zipcode
+            gj["features"][0]["properties"]["address"] = addy
+    elif private is not None:
+        gj["features"][0]["properties"]["author_name"] = ""
+        gj["features"][0]["properties"]["address"] = ""
+    # include organization and drive submitted to, if so
+    if user_map.organization:
+        gj["features"][0]["properties"][
+            "organization"
+        ] = user_map.organization.name
+    if user_map.drive:
+        gj["features"][0]["properties"]["drive"] = user_map.drive.name
+
+    feature = gj["features"][0]
+    return feature
+
+
+def feature_collection(features):
+    """
+    The encoded chunks of a GeoJSON FeatureCollection of features.
+    """
+    yield COLLECTION_START
+    for i, feature in enumerate(features):
+        yield (", " if i else "").encode() + geojson.dumps(feature).encode()
+    yield COLLECTION_END
+
+
+def _address():
+    # the last address of a community, as the map pages show it
+    return Subquery(
+        Address.objects.filter(entry=OuterRef("pk"))
+        .order_by("-id")
+        .annotate(
+            full=Concat(
+                "street",
+                Value(" "),
+                "city",
+                Value(", "),
+                "state",
+                Value(" "),
+                "zipcode",
+                output_field=CharField(),
+            )
+        )
+        .values("full")[:1]
+    )
+
+
+def unit_pairs(entry_ids):
+    """
+    The (entry id, census id, is a block) rows of the block groups and
+    census blocks of communities, read from both through tables in one
+    query.
+    """
+    groups = (
+        CommunityEntry.block_groups.through.objects.filter(
+            communityentry_id__in=entry_ids
+        )
+        .annotate(block=Value(False, output_field=BooleanField()))
+        .values_list("communityentry_id", "blockgroup__census_id", "block")
+    )
+    blocks = (
+        CommunityEntry.census_blocks.through.objects.filter(
+            communityentry_id__in=entry_ids
+        )
+        .annotate(block=Value(True, output_field=BooleanField()))
+        .values_list("communityentry_id", "censusblock__census_id", "block")
+    )
+    return list(groups.union(blocks, all=True))
+
+
+def equivalency_frame(entries, pairs, columns=()):
+    """
+    The BLOCKID, DISTRICT and testimony columns of the units of communities,
+    built in one vectorized join: entries is a DataFrame indexed by entry id
+    with the DISTRICT and the columns of each community, pairs the rows of
+    unit_pairs. Communities with block groups are exported with their block
+    groups only, like on the maps.
+    """
+    units = pd.DataFrame(pairs, columns=["entry", "BLOCKID", "block"])
+    block = units["block"].astype(bool)
+    with_groups = units.loc[~block, "entry"].unique()
+    units = units[~(block & units["entry"].isin(with_groups))]
+    frame = units.join(entries, on="entry", how="inner")
+    frame = frame.sort_values("DISTRICT", kind="stable")
+    return frame[["BLOCKID", "DISTRICT", *columns]]
+
+
+def testimony_frames(
+    queryset, columns=(), viewer=None, everyone=False, **expressions
+):
+    """
+    The given FEATURE_COLUMNS of the communities of a queryset, and one
+    column per expression, as DataFrames of ENTRY_CHUNK_SIZE communities
+    indexed by community id. The PRIVATE_COLUMNS are only filled in for
+    the communities of viewer and of the organizations viewer is an admin
+    of, or for every community with everyone.
+    """
+    private = [] if everyone else [c for c in columns if c in PRIVATE_COLUMNS]
+    if "address" in columns:
+        queryset = queryset.annotate(address=_address())
+    rows = (
+        queryset.annotate(**expressions)
+        .values_list(
+            "pk",
+            "user_id",
+            "organization_id",
+            *[FEATURE_COLUMNS[c] for c in columns],
+            *expressions,
+        )
+        .iterator(chunk_size=ENTRY_CHUNK_SIZE)
+    )
+    viewer_id, admin_orgs = None, []
+    if private and viewer is not None and viewer.is_authenticated:
+        viewer_id = viewer.pk
+        admin_orgs = list(
+            viewer.get_organizations().values_list("pk", flat=True)
+        )
+
+    names = ["pk", "_user", "_organization", *columns, *expressions]
+    for chunk in iter(lambda: list(islice(rows, ENTRY_CHUNK_SIZE)), []):
+        entries = pd.DataFrame(chunk, columns=names).set_index("pk")
+        if private:
+            visible = entries["_user"].eq(viewer_id) | entries[
+                "_organization"
+            ].isin(admin_orgs)
+            entries.loc[~visible, private] = ""
+        yield entries.drop(columns=["_user", "_organization"])
+
+
+def block_equivalency(
+    queryset, columns=(), viewer=None, start=0, header=True
+):
+    """
+    The encoded chunks of the block equivalency CSV file of the communities
+    of a queryset: one row per census unit with its id (BLOCKID), the number
+    of its community in the queryset order after start (DISTRICT) and the
+    given TESTIMONY_COLUMNS, with the private ones filled in as in
+    testimony_frames. Without header, the rows continue a file written
+    earlier.
+
+    Communities are read ENTRY_CHUNK_SIZE at a time, with one query for
+    the units of each chunk.
+    """
+    district = start
+    for entries in testimony_frames(queryset, columns, viewer):
+        entries["DISTRICT"] = np.arange(
+            district + 1, district + len(entries) + 1
+        )
+        district += len(entries)
+        frame = equivalency_frame(
+            entries, unit_pairs(list(entries.index)), columns
+        )
+        if header or len(frame):
+            yield frame.to_csv(index=False, header=header).encode()
+            header = False
+    if header:
+        yield ",".join(["BLOCKID", "DISTRICT", *columns]).encode() + b"\n"
+
+
+def geoparquet(queryset, path, columns=None, viewer=None, everyone=False):
+    """
+    Writes the communities of a queryset to a GeoParquet file, one row group
+    per chunk of testimony_frames, with their geometries as WKB straight
+    from PostGIS.
+    """
+    # only loaded by the processes that write these files
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = list(FEATURE_COLUMNS if columns is None else columns)
+    schema = pa.schema(
+        [
+            pa.field(c, pa.int64() if c == "population" else pa.string())
+            for c in columns
+        ]
+        + [pa.field("geometry", pa.binary())],
+        metadata={b"geo": json.dumps(GEOPARQUET_METADATA).encode()},
+    )
+    frames = testimony_frames(
+        queryset,
+        columns,
+        viewer,
+        everyone,
+        geometry=AsWKB("census_blocks_polygon"),
+    )
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for frame in frames:
+            frame["geometry"] = frame["geometry"].map(_wkb)
+            writer.write_table(
+                pa.Table.from_pandas(frame, schema, preserve_index=False)
+            )
+
+
+def flatgeobuf(queryset, path, columns=None, viewer=None, everyone=False):
+    """
+    Writes the communities of a queryset to a FlatGeobuf file with a
+    spatial index, with their geometries as WKB straight from PostGIS. The
+    index covers every feature, so they are all read before writing, and
+    communities without a geometry are left out.
+    """
+    # only loaded by the processes that write these files
+    from pyogrio.raw import write
+
+    columns = list(FEATURE_COLUMNS if columns is None else columns)
+    frames = list(
+        testimony_frames(
+            queryset.filter(census_blocks_polygon__isnull=False),
+            columns,
+            viewer,
+            everyone,
+            geometry=AsWKB("census_blocks_polygon"),
+        )
+    )
+    frame = (
+        pd.concat(frames)
+        if frames
+        else pd.DataFrame(columns=[*columns, "geometry"])
+    )
+    write(
+        path,
+        frame["geometry"].map(_wkb).to_numpy(dtype=object),
+        [
+            frame[c].to_numpy(dtype=float if c == "population" else object)
+            for c in columns
+        ],
+        fields=columns,
+        driver="FlatGeobuf",
+        geometry_type="MultiPolygon",
+        promote_to_multi=True,
+        crs="EPSG:4326",
+        layer_options={"SPATIAL_INDEX": "YES"},
+    )
+
+
+def _wkb(geometry):
+    # psycopg2 reads bytea as memoryview
+    return None if geometry is None else bytes(geometry)
+
+
+# the binary formats of the bulk exports: type -> (writer, extension,
+# content type)
+BULK_FORMATS = {
+    "parquet": (geoparquet, "parquet", "application/vnd.apache.parquet"),
+    "fgb": (flatgeobuf, "fgb", "application/flatgeobuf"),
+}
+
+
+def bulk_export(export_type, queryset, **kwargs):
+    """
+    The chunks of a bulk export of the communities of a queryset, written
+    to a temporary file by the writer of its BULK_FORMATS, which takes the
+    keyword arguments.
+    """
+    writer, extension, _ = BULK_FORMATS[export_type]
+    with tempfile.TemporaryDirectory() as directory:
+        # GDAL picks the layout of the file from its extension
+        path = os.path.join(directory, "export.%s" % extension)
+        writer(queryset, path, **kwargs)
+        with open(path, "rb") as f:
+            yield from iter(lambda: f.read(FILE_CHUNK_SIZE), b"")
+
+
+class _ZipBuffer:
+    """
+    An unseekable file for zipfile, emptied after every chunk written.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_stream(members):
+    """
+    The chunks of a zip file of (name, content) members, where content is
+    either an iterable of bytes or the path of a file to include.
+    """
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, content in members:
+            if isinstance(content, str):
+                z.write(content, arcname=name)
+            else:
+                # the size is not known in advance
+                with z.open(name, "w", force_zip64=True) as f:
+                    for chunk in content:
+                        f.write(chunk)
+                        data = buffer.take()
+                        if data:
+                            yield data
+            data = buffer.take()
+            if data:
+                yield data
+    yield buffer.take()
+
+
+def _scope_dir(scope):
+    return os.path.join(settings.EXPORT_CACHE_DIR, scope.replace(":", "-"))
+
+
+def export_artifact(scope, name, audience):
+    """
+    The Artifact of an export of a scope for an audience at the current
+    version of the scope, where name stands for the format and options of
+    the export.
+    """
+    version = get_version(scope)
+    return Artifact(
+        os.path.join(_scope_dir(scope), audience, str(version), name),
+        '"export-%s-%s-%s-%d"' % (scope, name, audience, version),
+    )
+
+
+def _save_chunks(path, chunks):
+    # yields the chunks, and saves them to path once they were all sent;
+    # the cache is an optimization only, so failing writes are ignored
+    f = tmp_path = None
+    with suppress(OSError):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # a temporary file first so that concurrent requests never read a
+        # partial export
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        f = os.fdopen(fd, "wb")
+    try:
+        for chunk in chunks:
+            if f is not None:
+                try:
+                    f.write(chunk)
+                except OSError:
+                    f.close()
+                    f = None
+            yield chunk
+        if f is not None:
+            f.close()
+            f = None
+            with suppress(OSError):
+                os.replace(tmp_path, path)
+    finally:
+        # the client went away, or the export failed
+        if f is not None:
+            f.close()
+        if tmp_path is not None:
+            with suppress(OSError):
+                os.remove(tmp_path)
+
+
+def export_response(request, artifact, make_chunks, content_type):
+    """
+    The response of an export: the cached file of its Artifact, or else
+    the chunks of make_chunks(), saved as they are sent. Exports without an
+    Artifact (those that depend on the viewer) are only streamed.
+    """
+    if artifact is None:
+        return StreamingHttpResponse(make_chunks(), content_type=content_type)
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH", "")
+    if request.method in ("GET", "HEAD") and artifact.etag in if_none_match:
+        response = HttpResponseNotModified()
+    else:
+        try:
+            response = FileResponse(
+                open(artifact.path, "rb"), content_type=content_type
+            )
+        except FileNotFoundError:
+            response = StreamingHttpResponse(
+                _save_chunks(artifact.path, make_chunks()),
+                content_type=content_type,
+            )
+    response["ETag"] = artifact.etag
+    patch_cache_control(response, private=True, max_age=0)
+    return response
+
+
+@on_bump
+def clear_export_cache(scopes):
+    # every cached export of a bumped scope belongs to an older version
+    for scope in scopes:
+        shutil.rmtree(_scope_dir(scope), ignore_errors=True)
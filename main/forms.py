@@ -21,6 +21,8 @@ from allauth.account.forms import LoginForm, SignupForm
 from django import forms
 from django.forms import ModelForm
 from .models import (
+    BlockGroup,
+    CensusBlock,
     CommunityEntry,
     Organization,
     Drive,
@@ -30,6 +32,7 @@ from .models import (
     State,
 )
 from .choices import STATES, UNITS
+from .display import DERIVED_FIELDS
 from django.contrib.gis.db import models
 from django.contrib.gis.measure import Area
 from django.core.files.images import get_image_dimensions
@@ -68,10 +71,18 @@ class CommunityForm(ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields["census_blocks_polygon_array"].delimiter = "|"
+        # the choices are only checked, their geometries are never needed
+        self.fields["block_groups"].queryset = BlockGroup.objects.defer(
+            "geometry"
+        )
+        self.fields["census_blocks"].queryset = CensusBlock.objects.defer(
+            "geometry"
+        )
 
     class Meta:
         model = CommunityEntry
-        fields = "__all__"
+        # these are derived from the drawn polygon on save
+        exclude = DERIVED_FIELDS
         user_polygon = models.PolygonField(
             error_messages={
                 "required": "User polygon missing. Please draw your community."
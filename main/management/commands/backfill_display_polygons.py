@@ -0,0 +1,56 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from main.display import DERIVED_FIELDS
+from main.models import CommunityEntry
+
+
+class Command(BaseCommand):
+
+    help = "Computes the display and planar polygons of existing communities"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="recompute every community, not only the missing ones",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="communities loaded and saved at once",
+        )
+
+    def handle(self, *args, **options):
+        query = CommunityEntry.objects.only(
+            "pk", "census_blocks_polygon", "user_polygon"
+        ).order_by("pk")
+        if not options["all"]:
+            query = query.filter(
+                Q(census_blocks_polygon__isnull=False)
+                | Q(user_polygon__isnull=False),
+                Q(display_polygon_low__isnull=True)
+                | Q(planar_polygon__isnull=True),
+            )
+
+        batch = []
+        count = 0
+        for entry in query.iterator(chunk_size=options["batch_size"]):
+            entry.update_derived_polygons()
+            batch.append(entry)
+            if len(batch) == options["batch_size"]:
+                count += self.save_batch(batch)
+        count += self.save_batch(batch)
+        self.stdout.write("Updated %d communities" % count)
+
+        # bulk updates skip the signals, so the map snapshots are rebuilt
+        # with the new geometries in one go
+        if count:
+            call_command("rebuild_map_snapshots", stdout=self.stdout)
+
+    def save_batch(self, batch):
+        CommunityEntry.objects.bulk_update(batch, DERIVED_FIELDS)
+        saved = len(batch)
+        batch.clear()
+        return saved
@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from main.exports import TESTIMONY_COLUMNS, equivalency_frame
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Times the construction of block equivalency files of synthetic "
+        "communities of increasing sizes, to check that it scales linearly "
+        "with the number of units"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            nargs="*",
+            type=int,
+            default=[1000, 10000, 100000],
+            help="numbers of units to export",
+        )
+        parser.add_argument(
+            "--units-per-community",
+            type=int,
+            default=50,
+            help="number of units of each synthetic community",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=3, help="runs of each size"
+        )
+
+    def handle(self, *args, **options):
+        columns = list(TESTIMONY_COLUMNS)
+        per_community = options["units_per_community"]
+        self.stdout.write("%10s %10s %12s" % ("units", "seconds", "us/unit"))
+        for size in options["sizes"]:
+            count = max(size // per_community, 1)
+            entries = pd.DataFrame(
+                {c: ["some testimony"] * count for c in columns},
+                index=pd.Index(np.arange(count), name="pk"),
+            )
+            entries["DISTRICT"] = np.arange(1, count + 1)
+            pairs = [
+                (i % count, "34%013d" % i, bool(i % 2))
+                for i in range(size)
+            ]
+            best = float("inf")
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                equivalency_frame(entries, pairs, columns).to_csv(
+                    index=False
+                )
+                best = min(best, time.perf_counter() - start)
+            self.stdout.write(
+                "%10d %10.3f %12.2f" % (size, best, 1e6 * best / size)
+            )
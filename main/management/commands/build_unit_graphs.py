@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from main.adjacency import build_unit_graph
+from main.models import BlockGroup, CensusBlock
+from main.units import STATE_FIPS, bump_units_generation
+
+UNIT_MODELS = {"blockgroup": BlockGroup, "censusblock": CensusBlock}
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Builds the adjacency graphs of the block groups and census blocks "
+        "loaded with their geometries by load_census_units, used to find "
+        "the pieces and holes of submitted communities"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--year",
+            type=int,
+            required=True,
+            choices=[2010, 2020],
+            help="vintage of the census units",
+        )
+        parser.add_argument(
+            "--states",
+            nargs="*",
+            default=[],
+            help="state abbreviations to build (default: every state)",
+        )
+        parser.add_argument(
+            "--units",
+            nargs="*",
+            choices=list(UNIT_MODELS),
+            default=list(UNIT_MODELS),
+            help="unit types to build (default: both)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            states = {
+                abbr.upper(): STATE_FIPS[abbr.upper()]
+                for abbr in options["states"]
+            } or STATE_FIPS
+        except KeyError as e:
+            raise CommandError("Unknown state %s" % e)
+        for unit in options["units"]:
+            model = UNIT_MODELS[unit]
+            for abbr, fips in states.items():
+                count = build_unit_graph(model, fips, options["year"])
+                if count:
+                    self.stdout.write(
+                        "Built the graph of %d %s of %s"
+                        % (count, model._meta.verbose_name_plural, abbr)
+                    )
+        # the other processes reload their graphs
+        bump_units_generation()
@@ -0,0 +1,92 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from main.classifier import NgramModel
+from main.moderation import ATTRIBUTE_THRESHOLDS, labeled_texts
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Evaluates the local moderation classifier on a held out part of "
+        "the reviewed reports, or of a labeled CSV file: how many texts "
+        "TriageBackend decides locally, how many of those it gets wrong, "
+        "and how it does alone when the Perspective API is unavailable"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--csv", help="CSV file with text and label (1 for toxic) columns"
+        )
+        parser.add_argument(
+            "--holdout",
+            type=float,
+            default=0.2,
+            help="share of the texts held out for the evaluation",
+        )
+        parser.add_argument(
+            "--clean-below",
+            type=float,
+            default=getattr(settings, "MODERATION_CLEAN_BELOW", 0.05),
+            help="probability under which a text is clean without the API",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        data = labeled_texts(options["csv"])
+        random.Random(options["seed"]).shuffle(data)
+        split = int(len(data) * options["holdout"])
+        test, train = data[:split], data[split:]
+        if not test:
+            raise CommandError("Not enough texts to hold some out")
+        try:
+            model = NgramModel.train(
+                [text for text, _ in train], [toxic for _, toxic in train]
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        start = time.perf_counter()
+        probabilities = [model.probability(text) for text, _ in test]
+        elapsed = time.perf_counter() - start
+
+        clean_below = options["clean_below"]
+        flag_above = max(t for _, t in ATTRIBUTE_THRESHOLDS)
+        flag_local = min(t for _, t in ATTRIBUTE_THRESHOLDS)
+        counts = dict.fromkeys(
+            ("cleared", "flagged", "escalated", "missed", "wrongly flagged"),
+            0,
+        )
+        # confusion of the local model alone, when the API is unavailable
+        tp = fp = fn = 0
+        for (_, toxic), p in zip(test, probabilities):
+            if p < clean_below:
+                counts["cleared"] += 1
+                counts["missed"] += toxic
+            elif p >= flag_above:
+                counts["flagged"] += 1
+                counts["wrongly flagged"] += not toxic
+            else:
+                counts["escalated"] += 1
+            flagged = p >= flag_local
+            tp += flagged and toxic
+            fp += flagged and not toxic
+            fn += toxic and not flagged
+
+        self.stdout.write(
+            "%d texts held out (%d toxic), trained on %d"
+            % (len(test), sum(toxic for _, toxic in test), len(train))
+        )
+        for name, count in counts.items():
+            self.stdout.write(
+                "%-16s %6d  %5.1f%%" % (name, count, 100 * count / len(test))
+            )
+        self.stdout.write(
+            "local only: precision %.3f, recall %.3f"
+            % (tp / max(tp + fp, 1), tp / max(tp + fn, 1))
+        )
+        self.stdout.write(
+            "%.1f microseconds per text" % (1e6 * elapsed / len(test))
+        )
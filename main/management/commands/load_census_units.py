@@ -0,0 +1,222 @@
+import csv
+import os
+from contextlib import contextmanager
+
+from django.contrib.gis.gdal import DataSource
+from django.contrib.gis.geos import MultiPolygon
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from main.models import BlockGroup, CensusBlock
+from main.units import STATE_FIPS, bump_units_generation, unit_catalog
+
+# the census id columns of the TIGER/Line files and the Census CSV exports
+ID_COLUMNS = ("GEOID20", "GEOID10", "GEOID", "GEOCODE")
+
+# the total population columns of the same files
+POPULATION_COLUMNS = ("POP20", "POP10", "P0010001", "P1_001N", "POPULATION")
+
+# units are told apart by the length of their census ids
+UNIT_MODELS = {12: BlockGroup, 15: CensusBlock}
+
+
+class LineStream:
+    """
+    A file-like object over an iterator of lines, read by COPY.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def copy_line(values):
+    return (
+        "\t".join("\\N" if v is None or v == "" else str(v) for v in values)
+        + "\n"
+    )
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Loads the block groups and census blocks of a TIGER/Line file or a "
+        "CSV file of census ids, so that submissions do not create them, "
+        "with their populations and the geometries of a TIGER/Line file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", help="shapefile, or CSV file with a header row"
+        )
+        parser.add_argument(
+            "--year",
+            type=int,
+            required=True,
+            choices=[2010, 2020],
+            help="vintage of the census units",
+        )
+        parser.add_argument(
+            "--states",
+            nargs="*",
+            default=[],
+            help="state abbreviations to load (default: every unit)",
+        )
+        parser.add_argument(
+            "--column",
+            help="census id column (default: the first of %s)"
+            % ", ".join(ID_COLUMNS),
+        )
+        parser.add_argument(
+            "--population-column",
+            help="population column (default: the first of %s, if any)"
+            % ", ".join(POPULATION_COLUMNS),
+        )
+        parser.add_argument(
+            "--skip-geometries",
+            action="store_true",
+            help="only load the census ids of a TIGER/Line file",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            prefixes = tuple(
+                STATE_FIPS[abbr.upper()] for abbr in options["states"]
+            )
+        except KeyError as e:
+            raise CommandError("Unknown state %s" % e)
+        if not os.path.exists(options["path"]):
+            raise CommandError("No such file: %s" % options["path"])
+
+        def keep(census_id):
+            return len(census_id) in UNIT_MODELS and (
+                not prefixes or census_id.startswith(prefixes)
+            )
+
+        with self.read_units(
+            options, keep
+        ) as units, transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE census_unit_load ("
+                "census_id varchar(15), "
+                "geometry geometry(MultiPolygon, 4326), "
+                "population integer"
+                ") ON COMMIT DROP"
+            )
+            cursor.copy_expert(
+                "COPY census_unit_load (census_id, geometry, population) "
+                "FROM STDIN",
+                LineStream(copy_line(unit) for unit in units),
+            )
+            for length, model in UNIT_MODELS.items():
+                table = connection.ops.quote_name(model._meta.db_table)
+                # the unique constraint on (census_id, year) makes loading
+                # the same file twice a no-op; units created by submissions
+                # get their missing geometries, and populations are replaced
+                cursor.execute(
+                    "INSERT INTO %s AS unit "
+                    "(census_id, year, geometry, population) "
+                    "SELECT DISTINCT ON (census_id) "
+                    "census_id, %%s, geometry, population "
+                    "FROM census_unit_load WHERE length(census_id) = %%s "
+                    "ON CONFLICT (census_id, year) DO UPDATE SET "
+                    "geometry = COALESCE(unit.geometry, EXCLUDED.geometry), "
+                    "population = "
+                    "COALESCE(EXCLUDED.population, unit.population) "
+                    "WHERE (unit.geometry IS NULL "
+                    "AND EXCLUDED.geometry IS NOT NULL) "
+                    "OR (EXCLUDED.population IS NOT NULL "
+                    "AND EXCLUDED.population IS DISTINCT FROM unit.population)"
+                    % table,
+                    [options["year"], length],
+                )
+                self.stdout.write(
+                    "Loaded %d new or updated %s"
+                    % (cursor.rowcount, model._meta.verbose_name_plural)
+                )
+        unit_catalog.cache_clear()
+        # the other processes reload their population tables
+        bump_units_generation()
+
+    @contextmanager
+    def read_units(self, options, keep):
+        """
+        The (census id, hex EWKB geometry or None, population or None) of the
+        units of a file that pass keep(census id), as a context manager that
+        closes the file; the columns are checked before COPY starts reading.
+        """
+        path = options["path"]
+        if path.lower().endswith(".csv"):
+            with open(path, newline="") as f:
+                reader = csv.DictReader(f)
+                fields = reader.fieldnames or []
+                column = self.id_column(fields, options["column"])
+                population = self.population_column(
+                    fields, options["population_column"]
+                )
+                units = (
+                    (
+                        row[column].strip(),
+                        None,
+                        row[population].strip() if population else None,
+                    )
+                    for row in reader
+                )
+                yield (unit for unit in units if keep(unit[0]))
+        else:
+            layer = DataSource(path)[0]
+            column = self.id_column(layer.fields, options["column"])
+            population = self.population_column(
+                layer.fields, options["population_column"]
+            )
+            geometries = not options["skip_geometries"]
+            units = (
+                (
+                    str(feature.get(column)).strip(),
+                    self.hex_geometry(feature.geom) if geometries else None,
+                    feature.get(population) if population else None,
+                )
+                for feature in layer
+                if keep(str(feature.get(column)).strip())
+            )
+            yield (unit for unit in units if keep(unit[0]))
+
+    def hex_geometry(self, geom):
+        # TIGER/Line files are in NAD83
+        geom.transform(4326)
+        geometry = geom.geos
+        if geometry.geom_type == "Polygon":
+            geometry = MultiPolygon(geometry, srid=geometry.srid)
+        return geometry.hexewkb.decode()
+
+    def id_column(self, fields, column):
+        if column:
+            if column not in fields:
+                raise CommandError("No %s column" % column)
+            return column
+        for column in ID_COLUMNS:
+            if column in fields:
+                return column
+        raise CommandError(
+            "No census id column, use --column (found %s)" % ", ".join(fields)
+        )
+
+    def population_column(self, fields, column):
+        if column:
+            if column not in fields:
+                raise CommandError("No %s column" % column)
+            return column
+        for column in POPULATION_COLUMNS:
+            if column in fields:
+                return column
+        return None
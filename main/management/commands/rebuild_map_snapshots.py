@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from main.models import State
+from main.snapshots import rebuild_state_map_snapshot
+
+
+class Command(BaseCommand):
+
+    help = "Recomputes the precomputed state map snapshots from scratch"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "states",
+            nargs="*",
+            help="state abbreviations to rebuild (default: all states)",
+        )
+
+    def handle(self, *args, **options):
+        states = State.objects.all()
+        if options["states"]:
+            abbrs = [abbr.upper() for abbr in options["states"]]
+            states = states.filter(abbr__in=abbrs)
+            if len(states) != len(abbrs):
+                raise CommandError("Unknown state in %s" % ", ".join(abbrs))
+        for state in states:
+            rebuild_state_map_snapshot(state)
+            self.stdout.write("Rebuilt the %s map snapshot" % state.abbr)
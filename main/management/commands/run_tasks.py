@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from main.tasks import run_tasks
+
+
+class Command(BaseCommand):
+
+    help = "Runs the queued background tasks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="run the due tasks and exit instead of waiting for more",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=2,
+            help="seconds to wait when no task is due",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_tasks()
+            if count:
+                self.stdout.write("Ran %d tasks" % count)
+            if options["once"]:
+                break
+            time.sleep(options["sleep"])
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from main.classifier import BUCKETS, NgramModel
+from main.moderation import labeled_texts
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Trains the local moderation classifier on the reviewed reports, or "
+        "on a labeled CSV file, and saves it for LocalBackend and "
+        "TriageBackend"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--csv", help="CSV file with text and label (1 for toxic) columns"
+        )
+        parser.add_argument(
+            "--output",
+            default=getattr(settings, "MODERATION_MODEL_PATH", ""),
+            help="model file (default: MODERATION_MODEL_PATH)",
+        )
+        parser.add_argument(
+            "--buckets",
+            type=int,
+            default=BUCKETS,
+            help="number of n-gram hash buckets",
+        )
+
+    def handle(self, *args, **options):
+        if not options["output"]:
+            raise CommandError("Set MODERATION_MODEL_PATH or use --output")
+        data = labeled_texts(options["csv"])
+        try:
+            model = NgramModel.train(
+                [text for text, _ in data],
+                [toxic for _, toxic in data],
+                buckets=options["buckets"],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        model.save(options["output"])
+        self.stdout.write(
+            "Trained on %d toxic and %d clean texts, saved to %s"
+            % (
+                sum(toxic for _, toxic in data),
+                sum(not toxic for _, toxic in data),
+                options["output"],
+            )
+        )
+        self.stdout.write(
+            "Restart the web and worker processes to load the new model"
+        )
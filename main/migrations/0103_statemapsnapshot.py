@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-16 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0102_turf'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StateMapSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entries', models.JSONField(blank=True, default=dict)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('state', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='map_snapshot', to='main.state')),
+            ],
+        ),
+    ]
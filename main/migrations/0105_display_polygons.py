@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-16 11:40
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0104_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='communityentry',
+            name='display_polygon_high',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='communityentry',
+            name='display_polygon_low',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='communityentry',
+            name='display_polygon_mid',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-16 12:31
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0105_display_polygons'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='communityentry',
+            name='planar_polygon',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+    ]
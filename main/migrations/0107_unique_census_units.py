@@ -0,0 +1,73 @@
+# Generated by Django 3.2.25 on 2026-10-16 14:02
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, model_name, field):
+    """
+    Keeps the oldest of each (census_id, year) group of units and points the
+    communities of the others at it before deleting them.
+    """
+    unit = apps.get_model('main', model_name)
+    through = getattr(
+        apps.get_model('main', 'CommunityEntry'), field
+    ).through
+    unit_field = model_name.lower() + '_id'
+    groups = (
+        unit.objects.values('census_id', 'year')
+        .annotate(keep=Min('id'), n=Count('id'))
+        .filter(n__gt=1)
+    )
+    for group in groups.iterator():
+        keep = group['keep']
+        others = list(
+            unit.objects.filter(
+                census_id=group['census_id'], year=group['year']
+            )
+            .exclude(id=keep)
+            .values_list('id', flat=True)
+        )
+        links = through.objects.filter(**{unit_field + '__in': others})
+        # communities already linked to the kept unit
+        links.filter(
+            communityentry_id__in=through.objects.filter(
+                **{unit_field: keep}
+            ).values('communityentry_id')
+        ).delete()
+        # communities linked to several of the duplicates
+        first_links = links.values('communityentry_id').annotate(
+            first=Min('id')
+        ).values('first')
+        links.exclude(id__in=list(first_links)).delete()
+        links.update(**{unit_field: keep})
+        unit.objects.filter(id__in=others).delete()
+
+
+def merge_census_units(apps, schema_editor):
+    merge_duplicates(apps, 'BlockGroup', 'block_groups')
+    merge_duplicates(apps, 'CensusBlock', 'census_blocks')
+    # the foreign keys are deferred: check them now, so that the deletes do
+    # not leave pending trigger events that block the ALTER TABLEs below
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0106_communityentry_planar_polygon'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_census_units, reverse_code=migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='blockgroup',
+            constraint=models.UniqueConstraint(fields=('census_id', 'year'), name='unique_block_group'),
+        ),
+        migrations.AddConstraint(
+            model_name='censusblock',
+            constraint=models.UniqueConstraint(fields=('census_id', 'year'), name='unique_census_block'),
+        ),
+    ]
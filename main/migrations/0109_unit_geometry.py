@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-16 15:10
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0108_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blockgroup',
+            name='geometry',
+            field=django.contrib.gis.db.models.fields.MultiPolygonField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='censusblock',
+            name='geometry',
+            field=django.contrib.gis.db.models.fields.MultiPolygonField(blank=True, null=True, srid=4326),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-16 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0109_unit_geometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blockgroup',
+            name='population',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='censusblock',
+            name='population',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
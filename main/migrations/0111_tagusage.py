@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-16 16:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_tags(apps, schema_editor):
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TagUsage = apps.get_model('main', 'TagUsage')
+    counts = (
+        TaggedItem.objects.order_by()
+        .values('tag_id')
+        .annotate(count=models.Count('id'))
+    )
+    TagUsage.objects.bulk_create(
+        [TagUsage(tag_id=row['tag_id'], count=row['count']) for row in counts],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0003_taggeditem_add_unique_index'),
+        ('main', '0110_unit_population'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagUsage',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='usage', serialize=False, to='taggit.tag')),
+                ('count', models.PositiveIntegerField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.RunPython(count_tags, migrations.RunPython.noop),
+        # the tag search matches name__istartswith, which filters on
+        # UPPER(name) LIKE 'PREFIX%'
+        migrations.RunSQL(
+            'CREATE INDEX taggit_tag_name_prefix ON taggit_tag '
+            '(UPPER(name::text) text_pattern_ops)',
+            'DROP INDEX IF EXISTS taggit_tag_name_prefix',
+        ),
+    ]
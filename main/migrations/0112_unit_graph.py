@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-17 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0111_tagusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnitGraph',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unit', models.CharField(max_length=20)),
+                ('fips', models.CharField(max_length=2)),
+                ('year', models.IntegerField()),
+                ('census_ids', models.BinaryField()),
+                ('indptr', models.BinaryField()),
+                ('indices', models.BinaryField()),
+                ('exterior', models.BinaryField()),
+                ('built_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='unitgraph',
+            constraint=models.UniqueConstraint(fields=('unit', 'fips', 'year'), name='unique_unit_graph'),
+        ),
+        migrations.AddField(
+            model_name='communityentry',
+            name='unit_components',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='communityentry',
+            name='unit_holes',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -23,15 +23,18 @@ from django.urls import reverse, reverse_lazy
 
 # Geo App
 import uuid
+from django.utils import timezone
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.models import Group
 from django.db import migrations
 from django.contrib.gis.db import models
 from .choices import STATES, UNITS
+from .display import DERIVED_FIELDS, derive_polygons
 from .utils import generate_unique_slug, generate_unique_token
 
 from taggit.managers import TaggableManager
+from taggit.models import Tag
 
 # state model editable content field
 from ckeditor.fields import RichTextField
@@ -298,10 +301,21 @@ class BlockGroup(models.Model):
     Fields included:
      - census_id: the official block group id
      - year: year of census (default - 2020, with an exception for states using 2010 units)
+     - geometry: the boundary of the unit, loaded by load_census_units
+     - population: the total population of the unit, loaded by load_census_units
     """
 
     census_id = models.CharField(max_length=12)
     year = models.IntegerField(default=2020)
+    geometry = models.MultiPolygonField(blank=True, null=True)
+    population = models.PositiveIntegerField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["census_id", "year"], name="unique_block_group"
+            ),
+        ]
 
 
 # ******************************************************************************#
@@ -313,10 +327,60 @@ class CensusBlock(models.Model):
     Fields included:
      - census_id: the official block group id
      - year: year of census (default - 2020, with an exception for states using 2010 units)
+     - geometry: the boundary of the unit, loaded by load_census_units
+     - population: the total population of the unit, loaded by load_census_units
     """
 
     census_id = models.CharField(max_length=15)
     year = models.IntegerField(default=2020)
+    geometry = models.MultiPolygonField(blank=True, null=True)
+    population = models.PositiveIntegerField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["census_id", "year"], name="unique_census_block"
+            ),
+        ]
+
+
+# ******************************************************************************#
+
+
+class UnitGraph(models.Model):
+    """
+    UnitGraph holds which block groups or census blocks of a state and year
+    share a boundary, as compressed sparse row arrays built from the unit
+    geometries by the build_unit_graphs command (see main/adjacency.py).
+    Fields included:
+     - unit: the unit model, "blockgroup" or "censusblock"
+     - fips: the FIPS code of the state
+     - year: year of census
+     - census_ids: the sorted census ids of the units, as int64
+     - indptr, indices: the neighbors of the i-th unit are
+       indices[indptr[i]:indptr[i + 1]], as int32
+     - exterior: whether each unit is on the outline of the state, as bool
+     - built_at: when the graph was built
+    """
+
+    unit = models.CharField(max_length=20)
+    fips = models.CharField(max_length=2)
+    year = models.IntegerField()
+    census_ids = models.BinaryField()
+    indptr = models.BinaryField()
+    indices = models.BinaryField()
+    exterior = models.BinaryField()
+    built_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["unit", "fips", "year"], name="unique_unit_graph"
+            ),
+        ]
+
+    def __str__(self):
+        return "%s %s %d" % (self.unit, self.fips, self.year)
 
 
 # ******************************************************************************#
@@ -368,6 +432,13 @@ class CommunityEntry(models.Model):
      - other_considerations: community needs and concerns questions response
      - custom_response: response to custom question, if included in a drive
      - tags: user generated tags
+     - display_polygon_low/mid/high: simplified copies of the polygon for
+       drawing at state, county and neighborhood zooms (see display.py)
+     - planar_polygon: geometry (not geography) copy of the polygon, indexed
+       for bounding box queries
+     - unit_components: the number of separate pieces of the units of the
+       community, when the unit graph of its state is built (see adjacency.py)
+     - unit_holes: the number of groups of units enclosed by the community
 
     """
 
@@ -404,6 +475,10 @@ class CommunityEntry(models.Model):
     census_blocks_polygon = models.GeometryField(
         geography=True, serialize=True, blank=True, null=True
     )
+    display_polygon_low = models.GeometryField(blank=True, null=True)
+    display_polygon_mid = models.GeometryField(blank=True, null=True)
+    display_polygon_high = models.GeometryField(blank=True, null=True)
+    planar_polygon = models.GeometryField(blank=True, null=True)
 
     block_groups = models.ManyToManyField(BlockGroup, blank=True)
 
@@ -448,9 +523,31 @@ class CommunityEntry(models.Model):
     admin_approved = models.BooleanField(default=True)
     private = models.BooleanField(default=False, null=True)
     population = models.IntegerField(blank=True, null=True, default=0)
+    unit_components = models.PositiveIntegerField(blank=True, null=True)
+    unit_holes = models.PositiveIntegerField(blank=True, null=True)
 
     tags = TaggableManager(blank=True)
 
+    def save(self, *args, **kwargs):
+        # keep the derived polygons in sync with the drawn community
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None:
+            self.update_derived_polygons()
+        elif {"census_blocks_polygon", "user_polygon"}.intersection(
+            update_fields
+        ):
+            self.update_derived_polygons()
+            kwargs["update_fields"] = set(update_fields).union(DERIVED_FIELDS)
+        super(CommunityEntry, self).save(*args, **kwargs)
+
+    def update_derived_polygons(self):
+        if self.census_blocks_polygon is not None:
+            geometry = self.census_blocks_polygon
+        else:
+            geometry = self.user_polygon
+        for field, value in derive_polygons(geometry).items():
+            setattr(self, field, value)
+
     def human_readable_name(self):
         return self.entry_name.replace(' ', '_')
 
@@ -516,6 +613,178 @@ class Report(models.Model):
         self.community.save()
 
 
+# ******************************************************************************#
+
+
+class StateMapSnapshot(models.Model):
+    """
+    StateMapSnapshot holds the precomputed public payload of a state map page.
+    Fields included:
+     - state: the state this snapshot belongs to
+     - entries: public communities keyed by entry_ID (coordinates, unit
+       counts, drive/org labels and the sidebar text)
+     - version: incremented on every change, used for ETags and cache keys
+     - updated_at: when the snapshot was last changed
+    """
+
+    state = models.OneToOneField(
+        State, on_delete=models.CASCADE, related_name="map_snapshot"
+    )
+    entries = models.JSONField(default=dict, blank=True)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "%s (v%d)" % (self.state.abbr, self.version)
+
+
+class DataVersion(models.Model):
+    """
+    DataVersion counts the changes to the communities of one map scope, so
+    that anything derived from them (tiles, cached payloads) can be keyed by
+    version instead of being invalidated by hand.
+    Fields included:
+     - scope: "state:<id>", "org:<id>" or "drive:<uuid>"
+     - version: incremented whenever a community in the scope changes
+    """
+
+    scope = models.CharField(max_length=100, unique=True)
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return "%s (v%d)" % (self.scope, self.version)
+
+
+class TagUsage(models.Model):
+    """
+    TagUsage counts the communities of each tag, kept up to date by the
+    signals on tag assignments, so that the most used tags are read rather
+    than aggregated (see main/tags.py).
+    Fields included:
+     - tag: the tag
+     - count: how many communities have the tag
+    """
+
+    tag = models.OneToOneField(
+        Tag, on_delete=models.CASCADE, primary_key=True, related_name="usage"
+    )
+    count = models.PositiveIntegerField(default=0, db_index=True)
+
+    def __str__(self):
+        return "%s (%d)" % (self.tag.name, self.count)
+
+
+class Task(models.Model):
+    """
+    Task is a unit of background work run by the run_tasks worker (see
+    main/tasks.py). Tasks are created in the same transaction as the data
+    they work on, so they run if and only if it is committed.
+    Fields included:
+     - name: the registered name of the task function
+     - kwargs: the keyword arguments of the task function
+     - status: pending, done or failed
+     - attempts: how many times the task has been run
+     - run_at: when the task is due, pushed back after each failure
+     - last_error: the traceback of the last failure
+    """
+
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_at"], name="task_due"),
+        ]
+
+    def __str__(self):
+        return "%s (%s)" % (self.name, self.status)
+
+
+class ExportJob(models.Model):
+    """
+    ExportJob is an export of many communities built in the background by
+    the task queue, a chunk of communities at a time (see
+    main/export_jobs.py), for exports too large for a request. Jobs are
+    deleted with their files EXPORT_JOB_EXPIRY_DAYS after they finish.
+    Fields included:
+     - user: who asked for the export, emailed when it is ready
+     - format: GeoJSON (geo) or block equivalency (csv)
+     - name: the file name of the export, without its extension
+     - entry_ids: the communities to export, by increasing id
+     - admin: whether the export was started from the admin site, and so
+       includes the author names and addresses of every community
+     - status: queued, running, done or failed
+     - done: how many of the communities were written
+     - size: the length of the parts of the file written so far
+    """
+
+    GEOJSON = "geo"
+    CSV = "csv"
+    FORMAT_CHOICES = (
+        (GEOJSON, "GeoJSON"),
+        (CSV, "Block equivalency"),
+    )
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="export_jobs",
+    )
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    name = models.CharField(max_length=200)
+    entry_ids = ArrayField(models.BigIntegerField(), default=list)
+    admin = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=QUEUED
+    )
+    done = models.PositiveIntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status"], name="export_job_status"),
+        ]
+
+    def __str__(self):
+        return "%s export of %s (%s)" % (self.format, self.name, self.status)
+
+    @property
+    def total(self):
+        return len(self.entry_ids)
+
+
 # ******************************************************************************#
 
 class Turf(models.Model):
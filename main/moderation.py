@@ -0,0 +1,318 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Automatic text moderation of submitted communities.
+
+The texts of a submission are scored once, concurrently, by the backend named
+in the MODERATION_BACKEND setting. Scores are cached by the hash of the text,
+so resubmitted or repeated texts are not sent again.
+
+A backend is a class with a score(text) method that returns a dict of
+attribute -> score between 0 and 1, for the attributes of
+ATTRIBUTE_THRESHOLDS. PerspectiveBackend asks Google's Perspective API.
+LocalBackend matches a word list and, once train_moderation_model has been
+run, a character n-gram classifier trained on the reported communities (see
+classifier.py), without leaving the process. TriageBackend scores texts
+locally and only sends the ambiguous ones to the API.
+
+Backends add UNCHECKED to the scores of texts they could not fully check,
+which are not cached, and submissions with such texts are left undecided.
+"""
+import csv
+import hashlib
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+from django.utils.module_loading import import_string
+from googleapiclient import discovery
+from googleapiclient.http import build_http
+
+from .classifier import NgramModel
+from .models import CommunityEntry, Report
+
+logger = logging.getLogger(__name__)
+
+# API uses many different metrics to get toxicity. these were the best i found, and i closely
+# experimented with good thresholds for tolerance. changing these values changes the entire filter
+# note that IDENTITY_ATTACK is quite low, leading to some false-positives. however, any higher
+# value for that leads to some false-negatives, especially if people try to game the system with
+# special characters
+ATTRIBUTE_THRESHOLDS = [
+    ("TOXICITY", 0.75),
+    ("IDENTITY_ATTACK", 0.5),
+    ("INSULT", 0.5),
+    ("PROFANITY", 0.75),
+    ("THREAT", 0.9),
+]
+
+# the free text fields of a community
+MODERATED_FIELDS = (
+    "entry_name",
+    "user_name",
+    "cultural_interests",
+    "economic_interests",
+    "comm_activities",
+    "other_considerations",
+)
+
+# scores only change with the backend, so they are kept for a long time
+SCORE_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+UNCHECKED = "UNCHECKED"
+
+
+class ModerationUnavailable(Exception):
+    """
+    Raised when the texts of a submission could not all be checked.
+    """
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=len(MODERATED_FIELDS), thread_name_prefix="moderation"
+)
+
+
+class PerspectiveBackend:
+    """
+    Scores texts with the Perspective API. The API client is built once per
+    process; its HTTP connections are not thread safe, so each thread uses
+    its own.
+    """
+
+    name = "perspective"
+    discovery_url = "https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1"
+
+    def __init__(self):
+        self.client = discovery.build(
+            "commentanalyzer",
+            "v1alpha1",
+            developerKey=os.environ.get("PERSPECTIVE_API_KEY"),
+            discoveryServiceUrl=self.discovery_url,
+            static_discovery=False,
+        )
+        self.local = threading.local()
+
+    def http(self):
+        if not hasattr(self.local, "http"):
+            self.local.http = build_http()
+        return self.local.http
+
+    def score(self, text):
+        analyze_request = {
+            "comment": {"text": text},
+            "languages": ["en"],
+            "requestedAttributes": {
+                attribute: {} for attribute, _ in ATTRIBUTE_THRESHOLDS
+            },
+        }
+        response = (
+            self.client.comments()
+            .analyze(body=analyze_request)
+            .execute(http=self.http())
+        )
+        return {
+            attribute: scores["summaryScore"]["value"]
+            for attribute, scores in response["attributeScores"].items()
+        }
+
+
+class LocalBackend:
+    """
+    Gives every attribute the score 1 to texts that contain one of the words
+    of the MODERATION_BLOCKED_WORDS setting. Other texts get the probability
+    of the model saved at MODERATION_MODEL_PATH by train_moderation_model,
+    or 0 without a model.
+    """
+
+    name = "local"
+
+    def __init__(self):
+        words = getattr(settings, "MODERATION_BLOCKED_WORDS", [])
+        self.pattern = re.compile(
+            r"\b(%s)\b" % "|".join(re.escape(w) for w in words) if words
+            # an empty list matches nothing
+            else r"(?!)",
+            re.IGNORECASE,
+        )
+        path = getattr(settings, "MODERATION_MODEL_PATH", "")
+        self.model = None
+        if path and os.path.exists(path):
+            self.model = NgramModel.load(path)
+
+    def blocked(self, text):
+        return self.pattern.search(text) is not None
+
+    def scores(self, value):
+        return {attribute: value for attribute, _ in ATTRIBUTE_THRESHOLDS}
+
+    def score(self, text):
+        if self.blocked(text):
+            return self.scores(1.0)
+        if self.model is None:
+            return self.scores(0.0)
+        return self.scores(self.model.probability(text))
+
+
+class TriageBackend:
+    """
+    Scores texts with LocalBackend, and only asks PerspectiveBackend about
+    the ambiguous ones: texts whose probability is below the
+    MODERATION_CLEAN_BELOW setting are clean, and texts above every
+    threshold of ATTRIBUTE_THRESHOLDS are flagged. Without a model, only the
+    word list is checked locally. When the API fails, the local scores are
+    used.
+    """
+
+    name = "triage"
+
+    def __init__(self):
+        self.local = LocalBackend()
+        self.clean_below = getattr(settings, "MODERATION_CLEAN_BELOW", 0.05)
+        self.flag_above = max(t for _, t in ATTRIBUTE_THRESHOLDS)
+        self.remote = None
+        self.lock = threading.Lock()
+
+    def get_remote(self):
+        # built on first use, so that a failing API does not stop the local
+        # checks
+        with self.lock:
+            if self.remote is None:
+                self.remote = PerspectiveBackend()
+            return self.remote
+
+    def score(self, text):
+        if self.local.blocked(text):
+            return self.local.scores(1.0)
+        if self.local.model is not None:
+            probability = self.local.model.probability(text)
+            if not self.clean_below <= probability < self.flag_above:
+                return self.local.scores(probability)
+        try:
+            return self.get_remote().score(text)
+        except Exception:
+            logger.warning("Perspective API unavailable", exc_info=True)
+            scores = self.local.score(text)
+            scores[UNCHECKED] = 1.0
+            return scores
+
+
+@lru_cache(maxsize=None)
+def _load_backend(path):
+    return import_string(path)()
+
+
+def get_backend():
+    return _load_backend(
+        getattr(
+            settings,
+            "MODERATION_BACKEND",
+            "main.moderation.TriageBackend",
+        )
+    )
+
+
+def is_flagged(scores):
+    return any(
+        scores.get(attribute, 0) >= threshold
+        for attribute, threshold in ATTRIBUTE_THRESHOLDS
+    )
+
+
+def _cache_key(backend, text):
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return "moderation:%s:%s" % (backend.name, digest)
+
+
+def score_texts(texts):
+    """
+    Returns a dict of text -> scores for the non-blank texts, scoring the
+    ones that are not cached yet concurrently.
+    """
+    backend = get_backend()
+    keys = {
+        _cache_key(backend, text): text
+        for text in texts
+        if text and not text.isspace()
+    }
+    cached = cache.get_many(list(keys))
+    scores = {keys[key]: value for key, value in cached.items()}
+    missing = [key for key in keys if key not in cached]
+    if missing:
+        results = _executor.map(backend.score, [keys[k] for k in missing])
+        new = dict(zip(missing, results))
+        cache.set_many(
+            {k: value for k, value in new.items() if UNCHECKED not in value},
+            SCORE_CACHE_TIMEOUT,
+        )
+        scores.update((keys[key], value) for key, value in new.items())
+    return scores
+
+
+def flag_submission(data):
+    """
+    Whether any of the moderated fields of submitted community data is
+    flagged by the moderation backend. Raises ModerationUnavailable if none
+    is, but some could not be checked.
+    """
+    texts = [data.get(field) or "" for field in MODERATED_FIELDS]
+    scores = list(score_texts(texts).values())
+    if any(is_flagged(value) for value in scores):
+        return True
+    if any(UNCHECKED in value for value in scores):
+        raise ModerationUnavailable
+    return False
+
+
+def submission_text(values):
+    return "\n".join(value or "" for value in values)
+
+
+def labeled_texts(path=None):
+    """
+    Returns the (text, toxic) training pairs of the CSV file at path, with
+    text and label columns (label 1 for toxic), or of the reports: reported
+    communities that reviewers unapproved are toxic, approved communities
+    are clean.
+    """
+    if path:
+        with open(path, newline="") as f:
+            return [
+                (row["text"], row["label"].strip() in ("1", "true", "True"))
+                for row in csv.DictReader(f)
+            ]
+    reported = Exists(Report.objects.filter(community=OuterRef("pk")))
+    rows = (
+        CommunityEntry.objects.filter(
+            Q(admin_approved=True) | Q(reported, admin_approved=False)
+        )
+        .order_by("pk")
+        .values_list("admin_approved", *MODERATED_FIELDS)
+    )
+    return [
+        (submission_text(values), not approved)
+        for approved, *values in rows.iterator()
+    ]
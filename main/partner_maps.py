@@ -0,0 +1,119 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Cached payloads of the organization and drive map pages.
+
+A partner map lists the communities of an organization or a drive, and org
+admins also see the unapproved ones and the authors' names. Each (org, drive,
+audience) payload is built once and cached under the version of its org or
+drive scope (see versions.py), so any submission, moderation or drive edit
+that bumps the scope is picked up by the next request.
+"""
+import json
+
+from django.core.cache import cache
+
+from .display import MAP_ZOOM
+from .encoding import encode_entries, page_encoding
+from .queries import map_entries
+from .tiles import ADMIN, PUBLIC
+from .versions import drive_scope, get_version, org_scope
+
+# cached payloads are keyed by version, so they never need to be deleted
+PARTNER_MAP_CACHE_TIMEOUT = 60 * 60 * 24
+
+# the attributes of each community used by the partner map template
+COMMUNITY_FIELDS = (
+    "id",
+    "entry_ID",
+    "entry_name",
+    "user_name",
+    "created_at",
+    "population",
+    "admin_approved",
+    "private",
+    "cultural_interests",
+    "comm_activities",
+    "economic_interests",
+    "other_considerations",
+    "drive_name",
+    "tag_names",
+)
+
+
+def map_scope(org, drive):
+    return drive_scope(drive.pk) if drive is not None else org_scope(org.pk)
+
+
+def build_partner_map_payload(org, drive, audience):
+    """
+    Returns the communities of an org or drive map as seen by the audience:
+    a dict of communities (list of dicts), entries (JSON text of the
+    coordinates), numBG and numBlock.
+    """
+    query = drive.submissions.all() if drive else org.submissions.all()
+    if audience == PUBLIC:
+        query = query.filter(admin_approved=True)
+    # one query for the list, the geometries, the unit counts and the tags
+    entries = map_entries(query, MAP_ZOOM).order_by("-created_at")
+
+    communities = []
+    coordinates = {}
+    num_bg = {}
+    num_block = {}
+    for obj in entries:
+        # only admins see who drew the communities
+        if audience == ADMIN:
+            obj.user_name = obj.user_name or obj.username
+        else:
+            obj.user_name = ""
+        communities.append({f: getattr(obj, f) for f in COMMUNITY_FIELDS})
+        if obj.geojson is None:
+            continue
+        coordinates[obj.entry_ID] = json.loads(obj.geojson)["coordinates"]
+        num_bg[obj.entry_ID] = obj.num_bg
+        num_block[obj.entry_ID] = obj.num_block
+
+    return {
+        "communities": communities,
+        "entries": json.dumps(encode_entries(coordinates, page_encoding())),
+        "numBG": num_bg,
+        "numBlock": num_block,
+    }
+
+
+def get_partner_map_payload(org, drive, audience):
+    """
+    Returns the payload of build_partner_map_payload from the cache, building
+    it if the org or drive changed since it was cached.
+    """
+    version = get_version(map_scope(org, drive))
+    key = "partner-map:%s:%s:%s:%s:%d" % (
+        org.pk,
+        drive.pk if drive else "",
+        audience,
+        page_encoding(),
+        version,
+    )
+    payload = cache.get(key)
+    if payload is None:
+        payload = build_partner_map_payload(org, drive, audience)
+        cache.set(key, payload, PARTNER_MAP_CACHE_TIMEOUT)
+    return payload
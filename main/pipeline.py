@@ -0,0 +1,166 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+The work that follows a community submission, run by the task queue (see
+tasks.py) once the submission is committed: archiving its GeoJSON on S3,
+checking its texts with the moderation backend, and emailing its author.
+"""
+import logging
+import os
+
+import boto3
+import geojson
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.mail import send_mail
+from django.core.serializers import serialize
+from django.template.loader import render_to_string
+from geojson_rewind import rewind
+
+from .models import CommunityEntry, Report
+from .moderation import MODERATED_FIELDS, flag_submission
+from .review import APPROVE, moderate
+from .tasks import enqueue, task
+
+ARCHIVE_ENTRY = "archive_entry"
+MODERATE_ENTRY = "moderate_entry"
+SEND_SUBMISSION_EMAIL = "send_submission_email"
+
+REPORT_EMAIL = "AUTOMATIC PROFANITY CHECKER"
+
+logger = logging.getLogger(__name__)
+
+
+def make_geojson_for_s3(entry):
+    map_geojson = serialize(
+        "geojson",
+        [entry],
+        geometry_field="census_blocks_polygon",
+        fields=(
+            "entry_name",
+            "entry_ID",
+            "cultural_interests",
+            "economic_interests",
+            "comm_activities",
+            "other_considerations",
+            "custom_response",
+            "population",
+        ),
+    )
+    gj = geojson.loads(map_geojson)
+    gj = rewind(gj)
+    del gj["crs"]
+    user_map = entry
+    # # iterate over block_groups or census_blocks in order to get array of IDs
+    # if user_map.block_groups.exists():
+    #     gj["features"][0]["properties"]["block_group_ids"] = [bg.census_id for bg in user_map.block_groups.all()]
+    # elif user_map.census_blocks.exists():
+    #     gj["features"][0]["properties"]["census_block_ids"] = [block.census_id for block in user_map.census_blocks.all()]
+    # # include organization and drive submitted to, if so
+    if user_map.organization:
+        gj["features"][0]["properties"][
+            "organization"
+        ] = user_map.organization.name
+    else:
+        gj["features"][0]["properties"]["organization"] = ""
+    if user_map.drive:
+        gj["features"][0]["properties"]["drive"] = user_map.drive.name
+    else:
+        gj["features"][0]["properties"]["drive"] = ""
+    if user_map.state:
+        gj["features"][0]["properties"]["state"] = user_map.state
+    else:
+        gj["features"][0]["properties"]["state"] = ""
+    feature = gj["features"][0]
+    return feature
+
+
+def _get_entry(entry_id):
+    # a community deleted before its tasks ran needs no more work
+    return (
+        CommunityEntry.objects.select_related("organization", "drive", "user")
+        .filter(pk=entry_id)
+        .first()
+    )
+
+
+@task(ARCHIVE_ENTRY)
+def archive_entry(entry_id, folder_name):
+    entry = _get_entry(entry_id)
+    if entry is None:
+        return
+    s3 = boto3.resource(
+        "s3",
+        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
+    )
+    s3.Bucket(os.environ.get("AWS_STORAGE_BUCKET_NAME")).put_object(
+        Body=str(make_geojson_for_s3(entry)),
+        Key=f"{folder_name}/{entry.entry_ID}.geojson",
+        ServerSideEncryption="AES256",
+        StorageClass="STANDARD_IA",
+    )
+
+
+@task(MODERATE_ENTRY)
+def moderate_entry(entry_id, approve):
+    """
+    Reports the community if its texts are flagged, or approves it if
+    approve is set and they are not. Texts that could not be checked raise
+    ModerationUnavailable, so the task is retried and the community is not
+    approved until they are.
+    """
+    entry = _get_entry(entry_id)
+    if entry is None:
+        return
+    if flag_submission({f: getattr(entry, f) for f in MODERATED_FIELDS}):
+        Report.objects.get_or_create(community=entry, email=REPORT_EMAIL)
+        logger.info("Reported community %s for moderation", entry.entry_ID)
+    elif approve:
+        # refreshes the cached maps of the community too
+        moderate(CommunityEntry.objects.filter(pk=entry.pk), APPROVE)
+
+
+@task(SEND_SUBMISSION_EMAIL)
+def send_submission_email(entry_id, path):
+    entry = _get_entry(entry_id)
+    if entry is None or not entry.user.email:
+        return
+    context = {
+        "entry": entry,
+        "url": "https://%s%s" % (Site.objects.get_current().domain, path),
+    }
+    subject = render_to_string("main/emails/submission_subject.txt", context)
+    send_mail(
+        subject.strip(),
+        render_to_string("main/emails/submission_message.txt", context),
+        settings.DEFAULT_FROM_EMAIL,
+        [entry.user.email],
+    )
+
+
+def enqueue_submission(entry, folder_name, approve, path):
+    """
+    Queues the tasks of a new community, in the transaction that saves it.
+    approve is whether to approve it once its texts pass moderation.
+    """
+    enqueue(ARCHIVE_ENTRY, entry_id=entry.pk, folder_name=folder_name)
+    enqueue(MODERATE_ENTRY, entry_id=entry.pk, approve=approve)
+    enqueue(SEND_SUBMISSION_EMAIL, entry_id=entry.pk, path=path)
@@ -0,0 +1,82 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Population of sets of census units.
+
+The populations loaded by load_census_units are read once per process into
+two NumPy arrays per (unit type, state, year): the sorted census ids as
+integers and their populations. Summing the population of any set of units
+is then a vectorized binary search, with no query.
+"""
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+
+from .units import units_generation
+
+
+@lru_cache(maxsize=getattr(settings, "POPULATION_TABLE_SIZE", 8))
+def population_table(model, fips, year, generation):
+    """
+    The (census ids, populations) arrays of the BlockGroup or CensusBlock
+    rows of a state (by FIPS code) and year that have a population.
+    generation is only part of the cache key.
+    """
+    rows = list(
+        model.objects.filter(
+            year=year, census_id__startswith=fips, population__isnull=False
+        )
+        .order_by()
+        .values_list("census_id", "population")
+    )
+    census_ids = np.array([int(c) for c, _ in rows], dtype=np.int64)
+    populations = np.array([p for _, p in rows], dtype=np.int64)
+    order = np.argsort(census_ids)
+    return census_ids[order], populations[order]
+
+
+def sum_population(model, census_ids, year):
+    """
+    Returns the total population of the given units and the number of units
+    whose population is unknown.
+    """
+    groups = {}
+    missing = 0
+    for census_id in dict.fromkeys(census_ids):
+        if census_id.isdigit():
+            groups.setdefault(census_id[:2], []).append(int(census_id))
+        elif census_id:
+            missing += 1
+    total = 0
+    generation = units_generation()
+    for fips, ids in groups.items():
+        table_ids, populations = population_table(
+            model, fips, year, generation
+        )
+        query = np.array(ids, dtype=np.int64)
+        if not len(table_ids):
+            missing += len(query)
+            continue
+        index = np.searchsorted(table_ids, query).clip(0, len(table_ids) - 1)
+        found = table_ids[index] == query
+        total += int(populations[index[found]].sum())
+        missing += int((~found).sum())
+    return total, missing
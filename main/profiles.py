@@ -0,0 +1,130 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Cached configuration of the entry page.
+
+Drive links are shared widely, so the drive and state settings shown on the
+entry page are read once and cached; the signals forget them whenever a
+drive, its organization or a state is saved. Only the access check of
+private drives depends on the user. The settings are forgotten once when
+they are saved and again when the transaction commits, in case an entry
+page read the old ones from the database in between.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from .models import AllowList, Drive, Membership, State
+
+PROFILE_TIMEOUT = 60 * 60
+
+# the drive settings used by the entry page
+DRIVE_FIELDS = (
+    "id",
+    "slug",
+    "name",
+    "state",
+    "private",
+    "require_user_addresses",
+    "draw_layer",
+    "custom_question",
+    "custom_question_example",
+    "opt_coi_def_title",
+    "opt_coi_def_info",
+    "units",
+    "flytox",
+    "flytoy",
+    "organization_id",
+)
+
+
+def _drive_key(slug):
+    return "entry-profile:drive:%s" % slug
+
+
+def _state_key(abbr):
+    return "entry-profile:state:%s" % abbr.upper()
+
+
+def drive_profile(slug):
+    """
+    The entry page settings of a drive and the name of its organization, as
+    a dict, or None if there is no such drive.
+    """
+    key = _drive_key(slug)
+    profile = cache.get(key)
+    if profile is None:
+        profile = (
+            Drive.objects.filter(slug=slug)
+            .values(*DRIVE_FIELDS, organization_name=F("organization__name"))
+            .first()
+        )
+        # unknown slugs are cached too, as an empty dict
+        cache.set(key, profile or {}, PROFILE_TIMEOUT)
+    return profile or None
+
+
+def state_profile(abbr):
+    """
+    The State of an abbreviation, or None if there is no such state.
+    """
+    key = _state_key(abbr)
+    state = cache.get(key)
+    if state is None:
+        state = State.objects.filter(abbr=abbr.upper()).first()
+        cache.set(key, state or False, PROFILE_TIMEOUT)
+    return state or None
+
+
+def _forget(keys):
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def forget_drives(*slugs):
+    _forget([_drive_key(slug) for slug in slugs])
+
+
+def forget_state(abbr):
+    _forget([_state_key(abbr)])
+
+
+def can_enter(user, profile):
+    """
+    Whether a user may submit to a drive: private drives are open to the
+    admins of their organization and to its allowlist, checked in one query.
+    """
+    if not profile["private"]:
+        return True
+    org = OuterRef("organization_id")
+    return (
+        Drive.objects.filter(pk=profile["id"])
+        .filter(
+            Exists(
+                Membership.objects.filter(
+                    organization=org, member=user, is_org_admin=True
+                )
+            )
+            | Exists(
+                AllowList.objects.filter(organization=org, email=user.email)
+            )
+        )
+        .exists()
+    )
@@ -0,0 +1,176 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Annotated community querysets shared by the map pages.
+
+Everything a map page shows about a community (its display geometry as
+GeoJSON, unit counts, organization, drive and tag names) is computed by the
+database in the same query that lists the communities, so drawing a map takes
+the same number of queries however many communities it has.
+"""
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import (
+    Count,
+    F,
+    Func,
+    IntegerField,
+    OuterRef,
+    Prefetch,
+    Subquery,
+    Value,
+)
+from django.db.models.functions import Coalesce
+from taggit.models import TaggedItem
+
+from .display import display_field
+from .models import Address, CommunityEntry, Report
+
+# columns of CommunityEntry shown in the community lists of the map pages
+MAP_ENTRY_FIELDS = (
+    "id",
+    "entry_ID",
+    "entry_name",
+    "user_name",
+    "created_at",
+    "population",
+    "admin_approved",
+    "private",
+    "cultural_interests",
+    "comm_activities",
+    "economic_interests",
+    "other_considerations",
+    "state_obj",
+)
+
+# GeoJSON coordinates are rounded to ~10cm
+GEOJSON_PRECISION = 6
+
+
+class AsGeometry(Func):
+    template = "(%(expressions)s)::geometry"
+    output_field = GeometryField(srid=4326)
+
+
+def display_geometry(zoom):
+    """
+    The geometry to draw a community with at the given zoom: its display
+    polygon, or the full polygon until the entry is backfilled.
+    """
+    return Coalesce(
+        display_field(zoom),
+        AsGeometry("census_blocks_polygon"),
+        AsGeometry("user_polygon"),
+        output_field=GeometryField(srid=4326),
+    )
+
+
+def unit_count(field):
+    """
+    Counts the block groups or census blocks of each community with a
+    correlated subquery, so that no GROUP BY is needed.
+    """
+    through = CommunityEntry._meta.get_field(field).remote_field.through
+    count = (
+        through.objects.filter(communityentry=OuterRef("pk"))
+        .order_by()
+        .values("communityentry")
+        .annotate(n=Count("*"))
+        .values("n")
+    )
+    return Coalesce(Subquery(count, output_field=IntegerField()), Value(0))
+
+
+def open_report_count():
+    """
+    Counts the unresolved reports of each community.
+    """
+    count = (
+        Report.objects.filter(community=OuterRef("pk"), resolved=False)
+        .order_by()
+        .values("community")
+        .annotate(n=Count("*"))
+        .values("n")
+    )
+    return Coalesce(Subquery(count, output_field=IntegerField()), Value(0))
+
+
+def tag_names():
+    """
+    Aggregates the sorted tag names of each community into an array (NULL if
+    the community has no tags).
+    """
+    names = (
+        TaggedItem.objects.filter(
+            content_type__app_label=CommunityEntry._meta.app_label,
+            content_type__model=CommunityEntry._meta.model_name,
+            object_id=OuterRef("pk"),
+        )
+        .order_by()
+        .values("object_id")
+        .annotate(names=ArrayAgg("tag__name", ordering="tag__name"))
+        .values("names")
+    )
+    return Subquery(names)
+
+
+def map_entries(queryset, zoom):
+    """
+    Annotates a CommunityEntry queryset with everything the map pages show:
+    geojson, num_bg, num_block, organization_name, drive_name, username and
+    tag_names. Only MAP_ENTRY_FIELDS are loaded from the entry itself.
+    """
+    return queryset.only(*MAP_ENTRY_FIELDS).annotate(
+        geojson=AsGeoJSON(
+            display_geometry(zoom), precision=GEOJSON_PRECISION
+        ),
+        num_bg=unit_count("block_groups"),
+        num_block=unit_count("census_blocks"),
+        organization_name=F("organization__name"),
+        drive_name=F("drive__name"),
+        username=F("user__username"),
+        tag_names=tag_names(),
+    )
+
+
+def review_entries(queryset):
+    """
+    Annotates a CommunityEntry queryset with what the moderation queue shows
+    (drive_name, username, open_reports, and the unit_components and
+    unit_holes fields) and prefetches the addresses,
+    without loading any geometry.
+    """
+    return (
+        queryset.only(*MAP_ENTRY_FIELDS, "unit_components", "unit_holes")
+        .annotate(
+            drive_name=F("drive__name"),
+            username=F("user__username"),
+            open_reports=open_report_count(),
+        )
+        .prefetch_related(
+            Prefetch(
+                "address_set",
+                queryset=Address.objects.only(
+                    "entry", "street", "city", "state", "zipcode"
+                ),
+            )
+        )
+    )
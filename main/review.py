@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Set-based moderation of communities.
+
+Approving, unapproving or resolving the reports of any number of communities
+is a single UPDATE, and deleting them a single cascaded DELETE, all in one
+transaction. Queryset updates skip the model signals, so the snapshots and
+the scope versions of the moderated communities are invalidated here, once
+for the whole batch (see snapshots.py and versions.py).
+"""
+from django.db import transaction
+
+from .models import CommunityEntry, Report
+from .snapshots import schedule_refresh
+from .versions import entry_scopes, schedule_bump
+
+APPROVE = "approve"
+UNAPPROVE = "unapprove"
+RESOLVE = "resolve"
+DELETE = "delete"
+MODERATION_ACTIONS = (APPROVE, UNAPPROVE, RESOLVE, DELETE)
+
+# what the signals and the invalidation need to know about a community
+_KEY_FIELDS = ("pk", "entry_ID", "state_obj", "organization", "drive")
+
+
+def invalidate_entries(rows):
+    """
+    Schedules one snapshot refresh and one version bump for the given
+    (entry_ID, state_obj_id, organization_id, drive_id) rows.
+    """
+    entry_ids = set()
+    scopes = set()
+    for entry_id, state_obj_id, organization_id, drive_id in rows:
+        entry_ids.add(entry_id)
+        scopes |= entry_scopes(state_obj_id, organization_id, drive_id)
+    schedule_refresh(entry_ids)
+    schedule_bump(scopes)
+
+
+def moderate(queryset, action):
+    """
+    Applies a moderation action to every community of a CommunityEntry
+    queryset and returns how many communities it matched.
+    """
+    if action not in MODERATION_ACTIONS:
+        raise ValueError("unknown moderation action %r" % action)
+    with transaction.atomic():
+        rows = list(
+            queryset.order_by().values_list(
+                "pk", "entry_ID", "state_obj_id", "organization_id", "drive_id"
+            )
+        )
+        pks = [row[0] for row in rows]
+        if not pks:
+            return 0
+        entries = CommunityEntry.objects.filter(pk__in=pks)
+        if action == RESOLVE:
+            # reports are not part of any cached payload
+            Report.objects.filter(community__in=pks, resolved=False).update(
+                resolved=True
+            )
+            return len(pks)
+        if action == DELETE:
+            # the addresses, reports, units and tags go in the same cascade
+            entries.only(*_KEY_FIELDS).delete()
+        else:
+            entries.update(admin_approved=action == APPROVE)
+        invalidate_entries(row[1:] for row in rows)
+    return len(pks)
@@ -0,0 +1,176 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_save,
+)
+from django.dispatch import receiver
+from taggit.models import TaggedItem
+
+from . import exports  # noqa: F401 -- clears the export cache on bumps
+from . import tiles  # noqa: F401 -- clears the tile cache on version bumps
+from .export_jobs import delete_job_files
+from .models import CommunityEntry, Drive, ExportJob, Organization, State
+from .profiles import forget_drives, forget_state
+from .snapshots import schedule_refresh
+from .tags import count_tag
+from .versions import (
+    drive_scope,
+    entry_scopes,
+    org_scope,
+    schedule_bump,
+)
+
+# ******************************************************************************#
+# keep the state map snapshots in sync with the communities
+
+
+def _scopes_of(entry):
+    return entry_scopes(
+        entry.state_obj_id, entry.organization_id, entry.drive_id
+    )
+
+
+@receiver(pre_save, sender=CommunityEntry)
+def entry_saving(sender, instance, raw=False, **kwargs):
+    # a community moved to another state, org or drive leaves its old scopes
+    if raw or instance.pk is None:
+        return
+    old = (
+        CommunityEntry.objects.filter(pk=instance.pk)
+        .values_list("state_obj_id", "organization_id", "drive_id")
+        .first()
+    )
+    if old is not None:
+        schedule_bump(entry_scopes(*old) - _scopes_of(instance))
+
+
+@receiver(post_save, sender=CommunityEntry)
+def entry_saved(sender, instance, raw=False, **kwargs):
+    # created, approved, unapproved, made private...
+    if not raw:
+        schedule_refresh([instance.entry_ID])
+        schedule_bump(_scopes_of(instance))
+
+
+@receiver(post_delete, sender=CommunityEntry)
+def entry_deleted(sender, instance, **kwargs):
+    schedule_refresh([instance.entry_ID])
+    schedule_bump(_scopes_of(instance))
+
+
+@receiver(m2m_changed, sender=CommunityEntry.block_groups.through)
+@receiver(m2m_changed, sender=CommunityEntry.census_blocks.through)
+@receiver(m2m_changed, sender=CommunityEntry.tags.through)
+def entry_units_changed(sender, instance, action, reverse, **kwargs):
+    # the unit counts and the tags are part of the snapshot and of the
+    # partner map payloads
+    if action.startswith("post_") and isinstance(instance, CommunityEntry):
+        schedule_refresh([instance.entry_ID])
+        schedule_bump(_scopes_of(instance))
+
+
+@receiver(post_save, sender=Drive)
+@receiver(post_save, sender=Organization)
+def labels_changed(sender, instance, created, raw=False, **kwargs):
+    # drive and organization names are shown on the state map
+    if not (created or raw):
+        schedule_refresh(
+            instance.submissions.values_list("entry_ID", flat=True)
+        )
+    # and drive names on the partner maps
+    if sender is Drive and not raw:
+        schedule_bump(
+            {drive_scope(instance.pk), org_scope(instance.organization_id)}
+        )
+    # both are in the exports of every scope of their communities
+    if not (created or raw):
+        schedule_bump(
+            set().union(
+                *[
+                    entry_scopes(*keys)
+                    for keys in instance.submissions.values_list(
+                        "state_obj_id", "organization_id", "drive_id"
+                    ).distinct()
+                ]
+            )
+        )
+
+
+# ******************************************************************************#
+# keep the tag usage counts in sync with the tag assignments
+
+
+@receiver(post_save, sender=TaggedItem)
+def tag_added(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        count_tag(instance.tag_id, 1)
+
+
+@receiver(post_delete, sender=TaggedItem)
+def tag_removed(sender, instance, **kwargs):
+    # also sent for the tags of deleted communities
+    count_tag(instance.tag_id, -1)
+
+
+# ******************************************************************************#
+# forget the cached entry page settings of edited drives and states
+
+
+@receiver(pre_save, sender=Drive)
+def drive_saving(sender, instance, raw=False, **kwargs):
+    # a renamed slug leaves the old one cached
+    if not raw and instance.pk is not None:
+        old = Drive.objects.filter(pk=instance.pk).values_list(
+            "slug", flat=True
+        )
+        forget_drives(*[slug for slug in old if slug])
+
+
+@receiver(post_save, sender=Drive)
+@receiver(post_delete, sender=Drive)
+def drive_changed(sender, instance, **kwargs):
+    forget_drives(instance.slug)
+
+
+@receiver(post_save, sender=Organization)
+def organization_changed(sender, instance, created, raw=False, **kwargs):
+    # the organization name is shown on the entry pages of its drives
+    if not (created or raw):
+        forget_drives(*instance.drive_set.values_list("slug", flat=True))
+
+
+@receiver(post_save, sender=State)
+@receiver(post_delete, sender=State)
+def state_changed(sender, instance, **kwargs):
+    forget_state(instance.abbr)
+
+
+# ******************************************************************************#
+# delete the files of expired or deleted export jobs
+
+
+@receiver(post_delete, sender=ExportJob)
+def export_job_deleted(sender, instance, **kwargs):
+    job_id = instance.pk
+    transaction.on_commit(lambda: delete_job_files(job_id))
@@ -0,0 +1,248 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Precomputed state map payloads.
+
+The state map page used to walk every submission of a state on every request.
+Instead, each state has a StateMapSnapshot holding the public communities
+keyed by entry_ID. Writes to a CommunityEntry patch only that entry's key in
+the snapshot (see signals.py), and the map page fetches the whole snapshot
+from a cacheable JSON endpoint.
+"""
+import json
+import threading
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Func, JSONField, TextField, Value
+from django.db.models.functions import Cast
+
+from .display import MAP_ZOOM
+from .encoding import encode_records
+from .models import CommunityEntry, StateMapSnapshot
+from .queries import map_entries
+from .topojson import build_topology, geometry_type
+
+# cached payloads are keyed by version, so they never need to be deleted
+SNAPSHOT_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class JSONBMerge(Func):
+    """jsonb || jsonb -- adds or replaces the keys of the right operand"""
+
+    arg_joiner = " || "
+    template = "(%(expressions)s)"
+    output_field = JSONField()
+
+
+class JSONBRemoveKeys(Func):
+    """jsonb - text[] -- drops the given keys"""
+
+    arg_joiner = " - "
+    template = "(%(expressions)s)"
+    output_field = JSONField()
+
+
+def public_map_entries(queryset, zoom=MAP_ZOOM):
+    """
+    Restricts a CommunityEntry queryset to the communities shown on public
+    maps, annotated with everything needed to build their snapshot records.
+    """
+    return map_entries(
+        queryset.filter(admin_approved=True).exclude(private=True), zoom
+    )
+
+
+def build_entry_record(entry):
+    """
+    Returns the snapshot record of one community, or None if it has nothing
+    to draw. Expects an entry from public_map_entries().
+    """
+    if entry.geojson is None:
+        return None
+    return {
+        "coordinates": json.loads(entry.geojson)["coordinates"],
+        "num_bg": entry.num_bg,
+        "num_block": entry.num_block,
+        "organization": entry.organization_name or "",
+        "drive": entry.drive_name or "",
+        "entry_name": entry.entry_name,
+        "created_at": entry.created_at.isoformat(),
+        "population": entry.population or 0,
+        "tags": entry.tag_names or [],
+        "cultural_interests": entry.cultural_interests,
+        "comm_activities": entry.comm_activities,
+        "economic_interests": entry.economic_interests,
+        "other_considerations": entry.other_considerations,
+    }
+
+
+def rebuild_state_map_snapshot(state):
+    """
+    Recomputes the snapshot of a state from scratch. Only needed the first
+    time a state map is requested, or from the rebuild_map_snapshots command.
+    """
+    records = {}
+    for entry in public_map_entries(state.submissions.all()):
+        record = build_entry_record(entry)
+        if record is not None:
+            records[entry.entry_ID] = record
+    with transaction.atomic():
+        StateMapSnapshot.objects.get_or_create(state=state)
+        StateMapSnapshot.objects.filter(state=state).update(
+            entries=records, version=F("version") + 1
+        )
+
+
+def refresh_entries(entry_ids):
+    """
+    Patches every snapshot that contains, or should contain, one of the given
+    communities (by entry_ID). Deleted, private and unapproved communities are
+    removed; the others are rebuilt from the database.
+    """
+    entry_ids = set(entry_ids)
+    if not entry_ids:
+        return
+    records_by_state = defaultdict(dict)
+    query = public_map_entries(
+        CommunityEntry.objects.filter(
+            entry_ID__in=entry_ids, state_obj__isnull=False
+        )
+    )
+    for entry in query:
+        record = build_entry_record(entry)
+        if record is not None:
+            records_by_state[entry.state_obj_id][entry.entry_ID] = record
+
+    state_ids = set(records_by_state)
+    state_ids.update(
+        StateMapSnapshot.objects.filter(
+            entries__has_any_keys=list(entry_ids)
+        ).values_list("state_id", flat=True)
+    )
+    with transaction.atomic():
+        for state_id in state_ids:
+            records = records_by_state.get(state_id, {})
+            entries = F("entries")
+            stale = sorted(entry_ids - set(records))
+            if stale:
+                entries = JSONBRemoveKeys(entries, Value(stale))
+            if records:
+                entries = JSONBMerge(
+                    entries,
+                    Cast(Value(json.dumps(records)), output_field=JSONField()),
+                )
+            StateMapSnapshot.objects.filter(state_id=state_id).update(
+                entries=entries, version=F("version") + 1
+            )
+
+
+_pending = threading.local()
+
+
+def schedule_refresh(entry_ids):
+    """
+    Queues communities for refresh_entries() once the current transaction
+    commits. Several writes to the same community (the entry, then its block
+    groups, then its tags) are folded into a single refresh.
+    """
+    _pending.__dict__.setdefault("entry_ids", set()).update(entry_ids)
+    transaction.on_commit(_flush_pending)
+
+
+def _flush_pending():
+    entry_ids = _pending.__dict__.pop("entry_ids", None)
+    if entry_ids:
+        refresh_entries(entry_ids)
+
+
+def get_state_map_payload(state, encoding="", quantization=None):
+    """
+    Returns (version, payload) for a state map, where payload is the JSON text
+    served by the map data endpoint, with coordinates in the given encoding
+    (see encoding.py). With a quantization, the communities are a TopoJSON
+    topology instead (see topojson.py).
+    """
+    version = (
+        StateMapSnapshot.objects.filter(state=state)
+        .values_list("version", flat=True)
+        .first()
+    )
+    if version is None:
+        rebuild_state_map_snapshot(state)
+    else:
+        payload = cache.get(
+            _payload_cache_key(state, version, encoding, quantization)
+        )
+        if payload is not None:
+            return version, payload
+
+    version, entries = (
+        StateMapSnapshot.objects.filter(state=state)
+        .annotate(entries_text=Cast("entries", output_field=TextField()))
+        .values_list("version", "entries_text")
+        .get()
+    )
+    if quantization is not None:
+        topology = build_topology(
+            record_features(json.loads(entries)), quantization
+        )
+        payload = '{"version": %d, "topology": %s}' % (
+            version,
+            json.dumps(topology),
+        )
+    else:
+        if encoding:
+            records = json.loads(entries)
+            encode_records(records.values(), encoding)
+            entries = json.dumps(records)
+        payload = '{"version": %d, "entries": %s}' % (version, entries)
+    cache.set(
+        _payload_cache_key(state, version, encoding, quantization),
+        payload,
+        SNAPSHOT_CACHE_TIMEOUT,
+    )
+    return version, payload
+
+
+def record_features(records):
+    """
+    GeoJSON features of snapshot records ({entry_ID: record}), with the rest
+    of each record as the properties.
+    """
+    for entry_id, record in records.items():
+        properties = dict(record)
+        coordinates = properties.pop("coordinates")
+        yield {
+            "type": "Feature",
+            "id": entry_id,
+            "geometry": {
+                "type": geometry_type(coordinates),
+                "coordinates": coordinates,
+            },
+            "properties": properties,
+        }
+
+
+def _payload_cache_key(state, version, encoding, quantization):
+    if quantization is not None:
+        encoding = "topojson-%d" % quantization
+    return "state-map:%d:%d:%s" % (state.id, version, encoding)
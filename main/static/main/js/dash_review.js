@@ -110,110 +110,217 @@ function newLowerLegislatureLayer(state) {
 }
 
 var community_bounds = {};
+var approved_color = "rgb(110, 178, 181)";
+var unapproved_color = "rgb(255, 50, 0)";
+var review_status = "";
+var review_next = null;
 
-map.on("load", function () {
-  // this is where the census blocks are loaded, from a url to the mbtiles file uploaded to mapbox
-  // for (let census in CENSUS_KEYS) {
-  //   newSourceLayer(census, CENSUS_KEYS[census]);
-  // }
-  // // upper layers
-  // for (let upper in UPPER_KEYS) {
-  //   newSourceLayer(upper, UPPER_KEYS[upper]);
-  // }
-  // // lower layers
-  // for (let lower in LOWER_KEYS) {
-  //   newSourceLayer(lower, LOWER_KEYS[lower]);
-  // }
-  // for (let i = 0; i < states.length; i++) {
-  //   newCensusLayer(states[i]);
-  //   newUpperLegislatureLayer(states[i]);
-  //   newLowerLegislatureLayer(states[i]);
-  // }
-
-  var outputstr = entries.replace(/'/g, '"');
-  entries = JSON.parse(outputstr);
-  var zooming = true;
-
-  for (obj in entries) {
-    // check how deeply nested the outer ring of the unioned polygon is
-    final = [];
-    // set the coordinates of the outer ring to final
-    if (entries[obj][0][0].length > 2) {
-      final = [entries[obj][0][0]];
-    } else if (entries[obj][0].length > 2) {
-      final = [entries[obj][0]];
-    } else {
-      final = entries[obj];
-    }
-    // add info to bounds list for zooming
-    // ok zoomer
-    var fit = new L.Polygon(final).getBounds();
-    var southWest = new mapboxgl.LngLat(fit['_southWest']['lat'], fit['_southWest']['lng']);
-    var northEast = new mapboxgl.LngLat(fit['_northEast']['lat'], fit['_northEast']['lng']);
-    community_bounds[obj] = new mapboxgl.LngLatBounds(southWest, northEast);
-
-    approved_color = "rgb(110, 178, 181)";
-    unapproved_color = "rgb(255, 50, 0)";
-    if (approved.indexOf(obj) > -1) {
-      color = approved_color;
-    } else {
-      color = unapproved_color;
+function entryUrl(url, entry_id) {
+  return url.replace("__entry__", entry_id);
+}
+
+// the moderation queue is loaded a page at a time; each community's
+// geometry is only fetched once its row is shown
+function loadReviewPage(reset) {
+  var params = {status: review_status};
+  if (drive_slug) params.drive = drive_slug;
+  if (!reset && review_next) params.after = review_next;
+  return $.getJSON(queue_url, params).then(function (data) {
+    if (reset) {
+      $("#review-entries .community-review-span").each(function () {
+        removeEntryLayers(this.id);
+      });
+      $("#review-entries").empty();
     }
-    map.addLayer({
-      id: obj,
-      type: "fill",
-      source: {
-        type: "geojson",
-        data: {
-          type: "Feature",
-          geometry: {
-            type: "Polygon",
-            coordinates: final,
-          },
-        },
-      },
-      layout: {
-        visibility: "visible",
-      },
-      paint: {
-        "fill-color": color,
-        "fill-opacity": 0.15
-      },
+    data.results.forEach(function (entry) {
+      $("#review-entries").append(renderReviewRow(entry));
+      $.getJSON(entryUrl(geometry_url, entry.entry_ID)).then(function (g) {
+        if (g.geometry) drawEntry(entry.entry_ID, g.geometry, entry.admin_approved);
+      });
     });
-    map.addLayer({
-      id: obj + "line",
-      type: "line",
-      source: {
-        type: "geojson",
-        data: {
-          type: "Feature",
-          geometry: {
-            type: "Polygon",
-            coordinates: final,
-          },
-        },
-      },
-      layout: {
-        visibility: "visible",
-        "line-join": "round",
-        "line-cap": "round",
-      },
-      paint: {
-        "line-color": "rgba(0, 0, 0,0.2)",
-        "line-width": 2,
+    if (data.counts) updateCounts(data.counts);
+    review_next = data.next;
+    $("#review-more").toggleClass("d-none", review_next === null);
+    $("#review-empty").toggleClass("d-none", $("#review-entries tr").length > 0);
+  });
+}
+
+function renderReviewRow(entry) {
+  var row = $($("#review-row-template").html());
+  row.attr("id", entry.entry_ID);
+  row.find(".community-link").attr("href", "/submission/" + entry.entry_ID).text(entry.entry_name);
+  if (entry.drive && !drive_slug) row.find(".community-drive .badge").text(entry.drive);
+  else row.find(".community-drive").remove();
+  row.find(".community-author").text(entry.author + (entry.address ? " | " + entry.address : ""));
+  // communities in several pieces or with enclaves (see main/adjacency.py)
+  var shape = [];
+  if (entry.components > 1) shape.push(entry.components + " pieces");
+  if (entry.holes > 0) shape.push(entry.holes + " hole(s)");
+  if (shape.length) row.find(".community-shape .badge").text(shape.join(", "));
+  else row.find(".community-shape").remove();
+  ["cultural_interests", "comm_activities", "economic_interests", "other_considerations"].forEach(function (field) {
+    var span = row.find(".community-" + field);
+    if (entry[field]) span.find(".text-muted").text(entry[field]);
+    else span.remove();
+  });
+  updateRow(row, entry);
+  return row;
+}
+
+// shows the buttons and badges matching the state of a community
+function updateRow(row, entry) {
+  if ("admin_approved" in entry) {
+    row.find("[data-action=approve]").toggleClass("d-none", entry.admin_approved);
+    row.find("[data-action=unapprove]").toggleClass("d-none", !entry.admin_approved);
+  }
+  if ("reports" in entry) {
+    row.find(".community-reports .badge").text(entry.reports + " report(s)");
+    row.find(".community-reports").toggleClass("d-none", entry.reports === 0);
+    row.find("[data-action=resolve]").toggleClass("d-none", entry.reports === 0);
+  }
+}
+
+function updateCounts(counts) {
+  for (var status in counts) {
+    $(".review-count-" + status).text(counts[status]);
+  }
+}
+
+function drawEntry(entry_id, geometry, approved) {
+  // check how deeply nested the outer ring of the unioned polygon is
+  var coordinates = geometry.coordinates;
+  var final = [];
+  // set the coordinates of the outer ring to final
+  if (coordinates[0][0].length > 2) {
+    final = [coordinates[0][0]];
+  } else if (coordinates[0].length > 2) {
+    final = [coordinates[0]];
+  } else {
+    final = coordinates;
+  }
+  // add info to bounds list for zooming
+  // ok zoomer
+  var fit = new L.Polygon(final).getBounds();
+  var southWest = new mapboxgl.LngLat(fit['_southWest']['lat'], fit['_southWest']['lng']);
+  var northEast = new mapboxgl.LngLat(fit['_northEast']['lat'], fit['_northEast']['lng']);
+  community_bounds[entry_id] = new mapboxgl.LngLatBounds(southWest, northEast);
+
+  var source = {
+    type: "geojson",
+    data: {
+      type: "Feature",
+      geometry: {
+        type: "Polygon",
+        coordinates: final,
       },
-    });
+    },
+  };
+  map.addLayer({
+    id: entry_id,
+    type: "fill",
+    source: source,
+    layout: {
+      visibility: "visible",
+    },
+    paint: {
+      "fill-color": approved ? approved_color : unapproved_color,
+      "fill-opacity": 0.15
+    },
+  });
+  map.addLayer({
+    id: entry_id + "line",
+    type: "line",
+    source: source,
+    layout: {
+      visibility: "visible",
+      "line-join": "round",
+      "line-cap": "round",
+    },
+    paint: {
+      "line-color": "rgba(0, 0, 0,0.2)",
+      "line-width": 2,
+    },
+  });
+}
+
+function removeEntryLayers(entry_id) {
+  [entry_id, entry_id + "line"].forEach(function (id) {
+    if (map.getLayer(id)) {
+      map.removeLayer(id);
+      map.removeSource(id);
+    }
+  });
+  delete community_bounds[entry_id];
+}
+
+// moderation actions answer with what changed, the row is updated in place
+$(document).on("click", ".review-action", function (e) {
+  e.stopPropagation();
+  var row = $(this).closest("tr");
+  var entry_id = row.attr("id");
+  $.post(entryUrl(action_url, entry_id), {
+    action: $(this).data("action"),
+    drive: drive_slug,
+    csrfmiddlewaretoken: $('input[name="csrfmiddlewaretoken"]').val(),
+  }).then(function (delta) {
+    updateCounts(delta.counts);
+    if (delta.deleted) {
+      removeEntryLayers(entry_id);
+      row.remove();
+      return;
+    }
+    updateRow(row, delta);
+    if ("admin_approved" in delta && map.getLayer(entry_id)) {
+      map.setPaintProperty(entry_id, "fill-color", delta.admin_approved ? approved_color : unapproved_color);
+    }
+  });
+});
+
+// bulk actions apply to the checked rows, or to every submission matching
+// the current filter; the list is reloaded afterwards
+$(document).on("click", ".review-select", function (e) {
+  e.stopPropagation();
+});
+
+$(".review-bulk-action").click(function () {
+  var action = $(this).data("action");
+  var params = {
+    action: action,
+    drive: drive_slug,
+    status: review_status,
+    csrfmiddlewaretoken: $('input[name="csrfmiddlewaretoken"]').val(),
+  };
+  if ($("#review-select-all").prop("checked")) {
+    params.all = 1;
+  } else {
+    params.entries = $(".review-select:checked").map(function () {
+      return $(this).closest("tr").attr("id");
+    }).get();
+    if (params.entries.length === 0) return;
   }
-  // hover to highlight
-  $(".community-review-span").hover(function() {
-    map.setPaintProperty(this.id + "line", "line-color", "rgba(0, 0, 0,0.5)");
-    map.setPaintProperty(this.id + "line", "line-width", 4);
-    map.setPaintProperty(this.id, "fill-opacity", 0.5);
-  }, function () {
-    map.setPaintProperty(this.id + "line", "line-color", "rgba(0, 0, 0,0.2)");
-    map.setPaintProperty(this.id + "line", "line-width", 2);
-    map.setPaintProperty(this.id, "fill-opacity", 0.15);
+  if (action === "delete" && !confirm("Delete the selected communities?")) return;
+  $.post(bulk_url, $.param(params, true)).then(function (data) {
+    updateCounts(data.counts);
+    $("#review-select-all").prop("checked", false);
+    review_next = null;
+    loadReviewPage(true);
   });
+});
+
+$("#review-status button").click(function () {
+  $("#review-status button").removeClass("active");
+  $(this).addClass("active");
+  review_status = $(this).data("status");
+  review_next = null;
+  loadReviewPage(true);
+});
+
+$("#review-more").click(function () {
+  loadReviewPage(false);
+});
+
+map.on("load", function () {
+  loadReviewPage(true);
   // fly to state if org, otherwise stay on map
   if (state !== "") {
     map.flyTo({
@@ -230,15 +337,30 @@ map.on("load", function () {
   }
 });
 
+// hover to highlight
+$(document).on("mouseenter", ".community-review-span", function () {
+  if (!map.getLayer(this.id)) return;
+  map.setPaintProperty(this.id + "line", "line-color", "rgba(0, 0, 0,0.5)");
+  map.setPaintProperty(this.id + "line", "line-width", 4);
+  map.setPaintProperty(this.id, "fill-opacity", 0.5);
+});
+$(document).on("mouseleave", ".community-review-span", function () {
+  if (!map.getLayer(this.id)) return;
+  map.setPaintProperty(this.id + "line", "line-color", "rgba(0, 0, 0,0.2)");
+  map.setPaintProperty(this.id + "line", "line-width", 2);
+  map.setPaintProperty(this.id, "fill-opacity", 0.15);
+});
+
 // on click, zoom to community
-$(".community-review-span").click(function () {
-  map.fitBounds(community_bounds[this.id], {padding: 100});
+$(document).on("click", ".community-review-span", function () {
+  if (community_bounds[this.id]) {
+    map.fitBounds(community_bounds[this.id], {padding: 100});
+  }
 });
 
-document.querySelectorAll(".comm-content").forEach(function (p) {
-  p.querySelector("a").addEventListener("click", function (e) {
-    e.stopPropagation();
-    p.classList.toggle("show");
-    this.textContent = p.classList.contains("show") ? "Show Less" : "Show More";
-  });
+$(document).on("click", ".comm-content a", function (e) {
+  e.stopPropagation();
+  var p = this.closest(".comm-content");
+  p.classList.toggle("show");
+  this.textContent = p.classList.contains("show") ? "Show Less" : "Show More";
 });
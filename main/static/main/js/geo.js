@@ -390,15 +390,17 @@ function surveyP1ToAddress() {
   automaticScrollToTop();
 }
 
-// TODO: update so that these are objects, then they will show up
-// move this outside this function and load in existing tags from server
-tags_repl = tags.replaceAll("'", '"');
-tagslist = JSON.parse(tags_repl ? tags_repl : '{}');
-
+// the typeahead asks the server for the tags that start with the typed text
 var tagnames = new Bloodhound({
   datumTokenizer: Bloodhound.tokenizers.obj.whitespace('text'),
   queryTokenizer: Bloodhound.tokenizers.whitespace,
-  local: tagslist,
+  remote: {
+    url: tag_search_url + "?q=%QUERY",
+    wildcard: "%QUERY",
+    filter: function(response) {
+      return response.results;
+    },
+  },
 });
 tagnames.initialize();
 
@@ -416,17 +418,55 @@ $('#tags-select-modal').on('shown.bs.modal', function() {
   $('#search-tags').focus();
 });
 
-// search bar filtering Communities
+// search bar of the tags modal: the most used tags are in the page, the
+// others are searched on the server
+var modalTags = "";
+var tagSearch = null;
 $(document).ready(function(){
+  modalTags = $("#tags-col").html();
   $("#search-tags").on("keyup", function() {
-    var value = $(this).val().toLowerCase();
-    $("#tags-col .btn").filter(function() {
-      var innerText = $(this).text().toLowerCase();
-      $(this).toggle(innerText.indexOf(value) > -1)
-    });
+    var value = $(this).val().trim();
+    clearTimeout(tagSearch);
+    tagSearch = setTimeout(function() {
+      if (!value) {
+        showModalTags(null);
+        return;
+      }
+      $.getJSON(tag_search_url, {q: value, limit: 50}, function(response) {
+        // ignore the answers to earlier searches
+        if ($("#search-tags").val().trim() === value) {
+          showModalTags(response.results);
+        }
+      });
+    }, 200);
   });
 });
 
+function showModalTags(results) {
+  var col = $("#tags-col");
+  if (results === null) {
+    col.html(modalTags);
+  } else {
+    col.empty();
+    results.forEach(function(tag) {
+      col.append(
+        $("<button type='button' class='btn btn-outline-secondary tag-select mb-2'></button>")
+          .attr("id", "tag_select_" + tag.value)
+          .text(tag.text)
+      );
+    });
+  }
+  // keep the selected tags and the tag limit visible
+  var selected = $("#id_tags").tagsinput("items") || [];
+  col.find(".tag-select").removeClass("active disabled");
+  selected.forEach(function(tag) {
+    $("#tag_select_" + tag.value).addClass("active");
+  });
+  if ($(".bootstrap-tagsinput-max").length > 0) {
+    col.find(".tag-select:not(.active)").addClass("disabled");
+  }
+}
+
 var tagsText = [];
 $(".tag-top").on('click', function(){
   if ($(this).hasClass("active")) {
@@ -436,7 +476,7 @@ $(".tag-top").on('click', function(){
  }
 });
 
-$(".tag-select").on('click', function(){
+$("#tags-col").on('click', ".tag-select", function(){
   if ($(this).hasClass("active")) {
     $('#id_tags').tagsinput('remove', {'value': parseInt($(this).attr('id').slice(11)), 'text': $(this).text()});
   } else {
@@ -894,6 +934,10 @@ function createCommPolygon() {
           dane_cty_blocks.push(parseInt(geoids_array[i]));
         }
       }
+      if (submit_unit_ids) {
+        // the server assembles the polygon from the ids of the units
+        return;
+      }
       if (multiPolySave === undefined) {
         multiPolySave = feature;
       } else {
@@ -920,9 +964,12 @@ function createCommPolygon() {
 
   // for display purposes -- this is the final multipolygon!!
   // TODO: implement community entry model change -> store only outer coordinates (like code in map.js)
-  var wkt = new Wkt.Wkt();
-  var wkt_obj = wkt.read(JSON.stringify(multiPolySave.geometry));
-  var poly_wkt = wkt_obj.write();
+  var poly_wkt = "";
+  if (!submit_unit_ids) {
+    var wkt = new Wkt.Wkt();
+    var wkt_obj = wkt.read(JSON.stringify(multiPolySave.geometry));
+    poly_wkt = wkt_obj.write();
+  }
   triggerSuccessMessage();
   updateFormFields(poly_wkt);
 
@@ -1830,18 +1877,25 @@ map.on("style.load", function () {
     if (old_units || has20) {
       // set as indicator that population is loading
       $(".comm-pop").html("...");
-      if (drawUsingBlocks) {
-        var blockCommPop = 0;
-        filter.forEach(function(feature) {
-          if (feature in blockPopCache) {
-            blockCommPop += blockPopCache[feature];
-          }
-        });
-        $(".comm-pop").html(blockCommPop);
-        sessionStorage.setItem("pop", blockCommPop);
+      var getTilePop = function () {
+        if (drawUsingBlocks) {
+          var blockCommPop = 0;
+          filter.forEach(function(feature) {
+            if (feature in blockPopCache) {
+              blockCommPop += blockPopCache[feature];
+            }
+          });
+          $(".comm-pop").html(blockCommPop);
+          sessionStorage.setItem("pop", blockCommPop);
+        } else {
+          // remove "in" and "GEOID" parts of filter, for population
+          getCommPop(cleanFilter(filter));
+        }
+      };
+      if (population_url) {
+        getServerCommPop(cleanFilter(filter), getTilePop);
       } else {
-        // remove "in" and "GEOID" parts of filter, for population
-        getCommPop(cleanFilter(filter));
+        getTilePop();
       }
     }
     if (isChanged) {
@@ -2091,6 +2145,31 @@ function getCommPop(filter) {
     });
 }
 
+// get the population for a community from the server, which knows the
+// population of every unit, not only of the rendered ones. fallback is called
+// when it does not
+var popRequest = 0;
+function getServerCommPop(filter, fallback) {
+  var request = ++popRequest;
+  $.post(population_url, {
+    units: filter.join(","),
+    csrfmiddlewaretoken: $("[name=csrfmiddlewaretoken]").val(),
+  })
+    .done(function (data) {
+      // a newer selection was sent in the meantime
+      if (request !== popRequest) return;
+      if (data.missing > 0) {
+        fallback();
+        return;
+      }
+      $(".comm-pop").html(data.population);
+      sessionStorage.setItem("pop", data.population);
+    })
+    .fail(function () {
+      if (request === popRequest) fallback();
+    });
+}
+
 /****************************************************************************/
 
 function cleanFilter(filter) {
@@ -108,14 +108,95 @@ var shownCois = new Set(); // Tracks the ids of the cois that are selected to be
 var coidata_geojson_format;
 const mxzoom = 10, tol = 3.5;
 
+// the state map fetches its communities from the map data endpoint and
+// builds the sidebar itself; the partner map embeds them in the page
+function loadCoiData() {
+  if (typeof coidata_url === "undefined") {
+    coidata = decodeEntries(
+      JSON.parse(coidata.replace(/'/g, '"')), geometry_encoding
+    );
+    numBG = JSON.parse(numBG.replace(/'/g, '"'));
+    numBlock = JSON.parse(numBlock.replace(/'/g, '"'));
+    return $.Deferred().resolve().promise();
+  }
+  return $.getJSON(coidata_url).then(function (data) {
+    var ids = Object.keys(data.entries);
+    // newest first, like the rest of the site
+    ids.sort(function (a, b) {
+      return data.entries[a].created_at < data.entries[b].created_at ? 1 : -1;
+    });
+    coidata = {};
+    numBG = {};
+    numBlock = {};
+    var rows = [];
+    ids.forEach(function (coi_id) {
+      var entry = data.entries[coi_id];
+      coidata[coi_id] = geometry_encoding
+        ? decodeCoordinates(
+            entry.coordinates, geometryPrecision(geometry_encoding)
+          )
+        : entry.coordinates;
+      numBG[coi_id] = entry.num_bg;
+      numBlock[coi_id] = entry.num_block;
+      rows.push(renderCommunityRow(coi_id, entry));
+    });
+    $("#map-cois").append(rows);
+    comms_counter = ids.length;
+    comms_count_total = ids.length;
+    $("#comms_count").html(ids.length);
+  });
+}
+
+// fill in a copy of the sidebar row template -- text only, never html
+function renderCommunityRow(coi_id, entry) {
+  var row = $($("#community-row-template").html());
+  row.attr("id", coi_id);
+  row.find(".community-link").attr("href", "/submission/" + coi_id).text(entry.entry_name);
+  row.find(".map-checkbox").val(coi_id);
+  row.find(".community-date").text(
+    new Date(entry.created_at).toLocaleDateString(undefined, {year: "numeric", month: "long", day: "numeric"})
+  );
+  ["organization", "drive"].forEach(function (label) {
+    var span = row.find(".community-" + label);
+    if (entry[label]) span.find(".badge").text(entry[label]);
+    else span.remove();
+  });
+  if (entry.population > 0) row.find(".community-population span").text(entry.population);
+  else row.find(".community-population").remove();
+  var tags = row.find(".community-tags");
+  entry.tags.forEach(function (tag) {
+    tags.append($('<span class="badge badge-pill badge-primary"></span>').text(tag), " ");
+  });
+  if (entry.tags.length > 0) tags.append("<br>");
+  ["cultural_interests", "comm_activities", "economic_interests", "other_considerations"].forEach(function (field) {
+    var span = row.find(".community-" + field);
+    if (entry[field]) span.find(".text-muted").text(entry[field]);
+    else span.remove();
+  });
+  return row;
+}
+
+// same opacity steps as drawCois, computed by mapbox from the tile properties
+function tileOpacity() {
+  if (comms_counter < 25) return 0.15;
+  var bigger = function (blocks, bgs) {
+    return ['any', ['>', ['get', 'num_block'], blocks], ['>', ['get', 'num_bg'], bgs]];
+  };
+  return ['case',
+    bigger(900, 100), 0.045,
+    bigger(600, 50), 0.06,
+    bigger(300, 15), 0.09,
+    0.12
+  ];
+}
+
 map.on("load", function () {
-  var layers = map.getStyle().layers;
   addAllLayers(map, document, "map");
-  // draw all coi's in one layer
-  coidata = JSON.parse(coidata.replace(/'/g, '"'));
-  numBG = JSON.parse(numBG.replace(/'/g, '"'));
-  numBlock = JSON.parse(numBlock.replace(/'/g, '"'));
+  loadCoiData().then(drawCois);
+});
 
+function drawCois() {
+  // draw all coi's in one layer
   coidata_geojson_format = {
     'type': 'FeatureCollection',
     'features': []
@@ -182,29 +263,41 @@ map.on("load", function () {
   // mxzoom(def 18 higher = more detail)
   // tol(def .375 higher = simpler geometry)
 
-  map.addSource('coi_all', {
-      'type': 'geojson',
-      'data': coidata_geojson_format,
-      'maxzoom': mxzoom,
-      'tolerance': tol
-  });
+  // the server renders vector tiles of the communities when it can, so only
+  // the tiles in view are loaded
+  var coiLayerSource = {'source': 'coi_all'};
+  var coiOpacity = ['get', 'coi_op'];
+  if (typeof coi_tiles_url !== "undefined" && coi_tiles_url !== "") {
+    map.addSource('coi_all', {
+        'type': 'vector',
+        'tiles': [window.location.origin + coi_tiles_url],
+        'promoteId': 'entry_ID',
+    });
+    coiLayerSource['source-layer'] = 'communities';
+    coiOpacity = tileOpacity();
+  } else {
+    map.addSource('coi_all', {
+        'type': 'geojson',
+        'data': coidata_geojson_format,
+        'maxzoom': mxzoom,
+        'tolerance': tol
+    });
+  }
 
   map.addLayer(
-    {
+    Object.assign({
       'id': 'coi_layer_fill',
       'type': 'fill',
-      'source': 'coi_all',
       'paint': {
           'fill-color': 'rgb(110, 178, 181)',
-          'fill-opacity': ['get', 'coi_op'],
+          'fill-opacity': coiOpacity,
       },
-    },
+    }, coiLayerSource),
     firstSymbolId
   );
-  map.addLayer({
+  map.addLayer(Object.assign({
     id: "coi_line",
     type: "line",
-    source: 'coi_all',
     layout: {
       visibility: "none",
       "line-join": "round",
@@ -214,10 +307,10 @@ map.on("load", function () {
       "line-color": "rgba(0, 0, 0,0.2)",
       "line-width": 2,
     },
-  });
+  }, coiLayerSource));
 
   // hover to highlight
-  $(".community-review-span").hover(function() {
+  $("#map-cois").on("mouseenter", ".community-review-span", function() {
       let highlight_id = this.id + "_boldline";
       let highlight_id_fill = this.id + "_fill";
       if (map.getLayer(highlight_id)) {
@@ -258,7 +351,7 @@ map.on("load", function () {
           },
       });
     }
-  }, function () {
+  }).on("mouseleave", ".community-review-span", function () {
     let highlight_id = this.id + "_boldline";
     let highlight_id_fill = this.id + "_fill";
     map.setLayoutProperty(highlight_id, "visibility", "none")
@@ -287,24 +380,23 @@ map.on("load", function () {
       essential: true // this animation is considered essential with respect to prefers-reduced-motion
     });
   }
-});
+}
 
 map.on("style.load", function () {
 
 });
 
 // on click, zoom to community
-$(".community-review-span").click(function () {
+$("#map-cois").on("click", ".community-review-span", function () {
   map.fitBounds(community_bounds[this.id], {padding: 100});
 });
 
 // show more button
-document.querySelectorAll(".comm-content").forEach(function (p) {
-  p.querySelector("a").addEventListener("click", function (e) {
-    e.stopPropagation();
-    p.classList.toggle("show");
-    this.textContent = p.classList.contains("show") ? "Show Less" : "Show More";
-  });
+$("#map-cois").on("click", ".comm-content .read-more", function (e) {
+  e.stopPropagation();
+  var p = this.closest(".comm-content");
+  p.classList.toggle("show");
+  this.textContent = p.classList.contains("show") ? "Show Less" : "Show More";
 });
 
 
@@ -354,6 +446,26 @@ function toggleEntryVisibility(checkbox)  {
 };
 
 // Uncheck all communities that are currently checked and display the total community layer
+// large exports are built in the background: the job is polled until its
+// file can be downloaded
+function startExportJob(url, dataToSend) {
+  $.post(url, dataToSend, function (job) {
+    pollExportJob(job);
+  });
+}
+
+function pollExportJob(job) {
+  if (job.status == "done") {
+    window.location = job.download_url;
+  } else if (job.status == "failed") {
+    alert("The export failed, please try again later.");
+  } else {
+    setTimeout(function () {
+      $.getJSON(job.url, pollExportJob);
+    }, 3000);
+  }
+}
+
 function showAllCommunities() {
   $(".map-checkbox:checkbox:checked").toArray().forEach(function(coiCheckbox) {
     coiCheckbox.checked = false;
@@ -368,21 +480,46 @@ function exportCois(url, type) {
       'cois': JSON.stringify(Array.from(coisToExport)),
       csrfmiddlewaretoken: $('input[name="csrfmiddlewaretoken"]').attr('value'),
   }
+  var background = type == "geo" || type == "csv";
+  if (export_job_link && background && coisToExport.has("all")) {
+    startExportJob(export_job_link + "/" + type + "/", dataToSend);
+    return;
+  }
+  // whole state exports are GETs, so that the browser revalidates its copy
+  var whole = coisToExport.has("all");
+  if (type == "parquet" || type == "fgb") {
+    // GeoParquet and FlatGeobuf files are binary, and saved as they are
+    var init = whole
+      ? {}
+      : { method: "POST", body: new URLSearchParams(dataToSend) };
+    fetch(url, init)
+      .then(function (response) {
+        return response.blob();
+      })
+      .then(function (blob) {
+        downloadBlob(blob, type);
+      });
+    return;
+  }
   $.ajax({
-          type: "POST",
+          type: whole ? "GET" : "POST",
           url: url,
-          data: dataToSend,
+          data: whole ? {} : dataToSend,
           success:function(response){
-            const blob = type == "geo" ? new Blob([JSON.stringify(response)], {type : 'application/json'}) : new Blob([response], {type : 'application/csv'})
-            const url = window.URL.createObjectURL(blob);
-            var link = type == "geo" ? document.getElementById("map-geo-link") : link = document.getElementById("map-csv-link")
-            link.href = url
-            link.click()
-            window.URL.revokeObjectURL(url);
+            const blob = type == "csv" ? new Blob([response], {type : 'application/csv'}) : new Blob([JSON.stringify(response)], {type : 'application/json'})
+            downloadBlob(blob, type);
         }
       });
 };
 
+function downloadBlob(blob, type) {
+  const url = window.URL.createObjectURL(blob);
+  var link = document.getElementById("map-" + type + "-link")
+  link.href = url
+  link.click()
+  window.URL.revokeObjectURL(url);
+}
+
 function showAllCommunities() {
   $(".map-checkbox:checkbox:checked").toArray().forEach(function(coiCheckbox) {
     coiCheckbox.checked = false;
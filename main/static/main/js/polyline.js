@@ -0,0 +1,70 @@
+/*
+ * Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+ *
+ * This file is part of Representable
+ * (see http://representable.org).
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program. If not, see <http://www.gnu.org/licenses/>.
+ */
+/*------------------------------------------------------------------------*/
+/* Decoder for the compact community coordinates of the map pages.       */
+/* The encoder and a description of the format are in main/encoding.py. */
+
+// "polyline6" -> 6, "" -> null (plain coordinate arrays)
+function geometryPrecision(encoding) {
+  if (!encoding) return null;
+  return parseInt(encoding.replace("polyline", ""), 10);
+}
+
+// one encoded ring -> [[lng, lat], ...]
+function decodeRing(encoded, precision) {
+  var factor = Math.pow(10, precision);
+  var ring = [];
+  var index = 0, x = 0, y = 0;
+  while (index < encoded.length) {
+    var delta = [0, 0];
+    for (var i = 0; i < 2; i++) {
+      var result = 0, shift = 0, byte;
+      do {
+        byte = encoded.charCodeAt(index++) - 63;
+        result |= (byte & 0x1f) << shift;
+        shift += 5;
+      } while (byte >= 0x20);
+      delta[i] = (result & 1) ? ~(result >> 1) : (result >> 1);
+    }
+    x += delta[0];
+    y += delta[1];
+    ring.push([x / factor, y / factor]);
+  }
+  return ring;
+}
+
+// encoded rings at any nesting depth -> GeoJSON coordinates
+function decodeCoordinates(encoded, precision) {
+  if (typeof encoded === "string") return decodeRing(encoded, precision);
+  return encoded.map(function (part) {
+    return decodeCoordinates(part, precision);
+  });
+}
+
+// {entry_ID: coordinates} as embedded in the map pages
+function decodeEntries(entries, encoding) {
+  var precision = geometryPrecision(encoding);
+  if (precision === null) return entries;
+  var decoded = {};
+  for (var entry_id in entries) {
+    decoded[entry_id] = decodeCoordinates(entries[entry_id], precision);
+  }
+  return decoded;
+}
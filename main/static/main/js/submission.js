@@ -68,7 +68,7 @@ map.on("load", function () {
   addAllLayers(map, document, "submission");
 
   var outputstr = a.replace(/'/g, '"');
-  a = JSON.parse(outputstr);
+  a = decodeEntries(JSON.parse(outputstr), geometry_encoding);
   var dest = [];
 
   for (obj in a) {
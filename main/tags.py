@@ -0,0 +1,97 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tag suggestions for the entry page.
+
+The number of communities of each tag is kept in TagUsage by the signals on
+tag assignments, so the most used tags are an indexed read, cached for a few
+minutes, and the typeahead searches tag names by prefix (backed by an index
+on UPPER(name)) instead of loading every tag into the page.
+"""
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.functions import Coalesce, Greatest
+from taggit.models import Tag
+
+from .models import TagUsage
+
+TOP_TAGS_KEY = "tags:top"
+
+# the counts move slowly, a slightly stale list of top tags is fine
+TOP_TAGS_TIMEOUT = 60 * 5
+
+# the most tags a search returns
+MAX_RESULTS = 50
+
+
+def count_tag(tag_id, delta):
+    """
+    Adds delta to the number of communities of a tag. Counts stop at zero:
+    tags loaded by loaddata are not counted, but are when removed.
+    """
+    updated = TagUsage.objects.filter(tag_id=tag_id).update(
+        count=Greatest(F("count") + delta, 0)
+    )
+    if not updated and delta > 0:
+        _, created = TagUsage.objects.get_or_create(
+            tag_id=tag_id, defaults={"count": delta}
+        )
+        if not created:
+            # created concurrently
+            TagUsage.objects.filter(tag_id=tag_id).update(
+                count=F("count") + delta
+            )
+
+
+def top_tags(limit=15):
+    """
+    The id -> name mapping of the most used tags, most used first.
+    """
+    key = "%s:%d" % (TOP_TAGS_KEY, limit)
+    tags = cache.get(key)
+    if tags is None:
+        tags = list(
+            TagUsage.objects.filter(count__gt=0)
+            .order_by("-count", "tag__name")
+            .values_list("tag_id", "tag__name")[:limit]
+        )
+        cache.set(key, tags, TOP_TAGS_TIMEOUT)
+    return dict(tags)
+
+
+def search_tags(prefix, limit=10):
+    """
+    The tags whose names start with prefix (case insensitively), most used
+    first, as {"value": id, "text": name} dicts.
+    """
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+    tags = (
+        Tag.objects.filter(name__istartswith=prefix)
+        .annotate(uses=Coalesce("usage__count", 0))
+        .order_by("-uses", "name")
+    )
+    return [
+        {"value": pk, "text": name}
+        for pk, name in tags.values_list("id", "name")[
+            : max(1, min(limit, MAX_RESULTS))
+        ]
+    ]
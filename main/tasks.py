@@ -0,0 +1,145 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+A durable background task queue stored in the database.
+
+Functions registered with @task are queued with enqueue(name, **kwargs),
+which creates a Task row in the current transaction: the task only exists
+once the data it works on is committed, and is never lost if the process
+stops. The run_tasks worker claims due tasks with SELECT ... FOR UPDATE SKIP
+LOCKED, so any number of workers can run side by side, and runs each one in
+a savepoint. A failed task is retried with exponential backoff until it has
+been tried max_attempts times, and then its on_failure function, if any, is
+called with the same arguments.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# registered task functions by name
+_registry = {}
+
+
+def task(name, max_attempts=5, on_failure=None):
+    """
+    Registers a task function under a name. Its keyword arguments must be
+    JSON serializable. on_failure is called with them once the task failed
+    max_attempts times.
+    """
+
+    def register(func):
+        func.task_name = name
+        func.max_attempts = max_attempts
+        func.on_failure = on_failure
+        _registry[name] = func
+        return func
+
+    return register
+
+
+def enqueue(name, run_at=None, **kwargs):
+    """
+    Queues a registered task, to run once the current transaction commits.
+    """
+    func = _registry[name]
+    return Task.objects.create(
+        name=name,
+        kwargs=kwargs,
+        max_attempts=func.max_attempts,
+        run_at=run_at or timezone.now(),
+    )
+
+
+def retry_delay(attempts):
+    """
+    How long to wait before the next attempt of a task that failed attempts
+    times: TASK_RETRY_DELAY seconds, doubled after each failure, up to
+    TASK_MAX_RETRY_DELAY.
+    """
+    delay = getattr(settings, "TASK_RETRY_DELAY", 30) * 2 ** (attempts - 1)
+    return timedelta(
+        seconds=min(delay, getattr(settings, "TASK_MAX_RETRY_DELAY", 3600))
+    )
+
+
+def _give_up(task):
+    func = _registry.get(task.name)
+    if getattr(func, "on_failure", None) is None:
+        return
+    try:
+        with transaction.atomic():
+            func.on_failure(**task.kwargs)
+    except Exception:
+        logger.exception("on_failure of task %s failed", task)
+
+
+def run_next():
+    """
+    Runs the next due task, if any, and returns it.
+    """
+    with transaction.atomic():
+        task = (
+            Task.objects.select_for_update(skip_locked=True)
+            .filter(status=Task.PENDING, run_at__lte=timezone.now())
+            .order_by("run_at", "id")
+            .first()
+        )
+        if task is None:
+            return None
+        task.attempts += 1
+        try:
+            func = _registry[task.name]
+            # the work of a failed task is rolled back, but not its attempt
+            with transaction.atomic():
+                func(**task.kwargs)
+        except Exception:
+            task.last_error = traceback.format_exc()
+            if task.attempts >= task.max_attempts:
+                task.status = Task.FAILED
+                logger.error("Task %s failed:\n%s", task, task.last_error)
+                _give_up(task)
+            else:
+                task.run_at = timezone.now() + retry_delay(task.attempts)
+        else:
+            task.status = Task.DONE
+            task.last_error = ""
+        task.save()
+    return task
+
+
+def run_tasks(limit=None):
+    """
+    Runs due tasks until there are none left, or limit tasks were run.
+    Returns how many were run.
+    """
+    count = 0
+    while limit is None or count < limit:
+        if run_next() is None:
+            break
+        count += 1
+    return count
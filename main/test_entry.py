@@ -1,19 +1,30 @@
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
-from .models import CommunityEntry, Address, BlockGroup
+from .models import CommunityEntry, Address, BlockGroup, CensusBlock, TagUsage
 
 from main.views import EntryView
 from main.forms import CommunityForm, AddressForm
 from django.template import RequestContext
 from django.template.loader import render_to_string
+import tempfile
 import uuid
+from io import StringIO
+
+from django.core.cache import cache
+from django.urls import reverse
+from django.core.management import call_command
 
 # must be imported after other models
 from django.contrib.gis.geos import Point, Polygon, MultiPolygon
 from django.contrib.gis.db.models import Union
 from django.contrib.gis.db import models
 from django.contrib.gis.geos import GEOSGeometry
-from main.models import State
+from main.models import AllowList, Drive, Organization, State
+from main.adjacency import analyze_units, build_unit_graph, unit_graph
+from main.population import population_table, sum_population
+from main.profiles import can_enter, drive_profile
+from main.tags import top_tags
+from main.units import assemble_units, resolve_units, unit_catalog
 
 class EntryTest(TestCase):
     def setUp(self):
@@ -264,3 +275,250 @@ class EntryTest(TestCase):
         # self.assertTrue(
         #     CommunityEntry.objects.count() == community_entry_count
         # )
+
+
+def square(x, y):
+    return MultiPolygon(Polygon.from_bbox((x, y, x + 1, y + 1)), srid=4326)
+
+
+class ResolveUnitsTest(TestCase):
+    def setUp(self):
+        unit_catalog.cache_clear()
+        cache.clear()
+
+    def test_resolve_units(self):
+        existing = BlockGroup.objects.create(census_id="340210001001")
+        old = BlockGroup.objects.create(census_id="340210001002", year=2010)
+        # the NJ catalog, then the new unit
+        with self.assertNumQueries(4):
+            ids = resolve_units(
+                BlockGroup,
+                ["340210001002", "340210001001", "340210001002"],
+                2020,
+            )
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(ids[1], existing.id)
+        self.assertNotIn(old.id, ids)
+        self.assertEqual(
+            BlockGroup.objects.get(id=ids[0]).census_id, "340210001002"
+        )
+        # everything is in the catalog now
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                resolve_units(
+                    BlockGroup, ["340210001002", "340210001001"], 2020
+                ),
+                ids,
+            )
+
+    def test_load_census_units(self):
+        BlockGroup.objects.create(census_id="340210001001")
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as f:
+            f.write("GEOID20,NAME\n")
+            f.write("340210001001,a\n340210001002,b\n")
+            f.write("340210001002001,c\n421010001001,d\n")
+            f.flush()
+            for i in range(2):
+                call_command(
+                    "load_census_units",
+                    f.name,
+                    year=2020,
+                    states=["nj"],
+                    stdout=StringIO(),
+                )
+        self.assertEqual(
+            sorted(BlockGroup.objects.values_list("census_id", flat=True)),
+            ["340210001001", "340210001002"],
+        )
+        self.assertEqual(CensusBlock.objects.count(), 1)
+        with self.assertNumQueries(1):
+            resolve_units(CensusBlock, ["340210001002001"], 2020)
+
+    def test_assemble_units(self):
+        for census_id, x in [
+            ("340210001001", 0),
+            ("340210001002", 1),
+            ("340210002001", 2),
+        ]:
+            BlockGroup.objects.create(
+                census_id=census_id, geometry=square(x, 0)
+            )
+        BlockGroup.objects.create(census_id="340210003001")
+        ids = ["340210001001", "340210001002", "340210002001"]
+        polygon = assemble_units(BlockGroup, ids, 2020)
+        self.assertEqual(polygon.geom_type, "MultiPolygon")
+        self.assertEqual(len(polygon), 1)
+        self.assertAlmostEqual(polygon.area, 3)
+        # both tracts are cached
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                assemble_units(BlockGroup, ids, 2020).equals(polygon)
+            )
+        # no geometry, or no unit at all
+        self.assertIsNone(
+            assemble_units(BlockGroup, ["340210003001"], 2020)
+        )
+        self.assertIsNone(
+            assemble_units(BlockGroup, ["340210004001"], 2020)
+        )
+
+
+class PopulationTest(TestCase):
+    def setUp(self):
+        population_table.cache_clear()
+        for census_id, population in [
+            ("340210001001", 100),
+            ("340210001002", 250),
+            ("340210002001", None),
+            ("421010001001", 7),
+        ]:
+            BlockGroup.objects.create(
+                census_id=census_id, population=population
+            )
+
+    def test_sum_population(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                sum_population(
+                    BlockGroup,
+                    ["340210001002", "340210001001", "340210001002"],
+                    2020,
+                ),
+                (350, 0),
+            )
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                sum_population(
+                    BlockGroup,
+                    ["340210001001", "340210002001", "421010001001"],
+                    2020,
+                ),
+                (107, 1),
+            )
+        self.assertEqual(
+            sum_population(BlockGroup, ["340210001001"], 2010), (0, 1)
+        )
+
+    def test_population_view(self):
+        url = reverse("main:unit_population", kwargs={"abbr": "nj"})
+        response = self.client.post(
+            url, {"units": "340210001001,340210001002"}
+        )
+        self.assertEqual(response.json(), {"population": 350, "missing": 0})
+        response = self.client.post(
+            url, {"units": "340210001001,340210001002001"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class TagTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = get_user_model().objects.create_user(
+            "janedoe", "jane@doe.com", "janedoe"
+        )
+        self.entries = [
+            CommunityEntry.objects.create(user=user, entry_name="test %d" % i)
+            for i in range(3)
+        ]
+        self.entries[0].tags.add("Housing", "Health")
+        self.entries[1].tags.add("Housing", "Schools")
+        self.entries[2].tags.add("Housing", "Health")
+
+    def test_usage_counts(self):
+        self.assertEqual(
+            list(top_tags(15).values()), ["Housing", "Health", "Schools"]
+        )
+        self.entries[0].tags.remove("Health")
+        self.entries[1].delete()
+        self.assertEqual(
+            dict(TagUsage.objects.values_list("tag__name", "count")),
+            {"Housing": 2, "Health": 1, "Schools": 0},
+        )
+
+    def test_usage_count_stops_at_zero(self):
+        # e.g. tags loaded by loaddata, which are not counted
+        TagUsage.objects.filter(tag__name="Schools").update(count=0)
+        self.entries[1].tags.remove("Schools")
+        self.assertEqual(TagUsage.objects.get(tag__name="Schools").count, 0)
+
+    def test_search(self):
+        url = reverse("main:tag_search")
+        results = self.client.get(url, {"q": "h"}).json()["results"]
+        self.assertEqual([t["text"] for t in results], ["Housing", "Health"])
+        results = self.client.get(url, {"q": "hea", "limit": 1}).json()
+        self.assertEqual(results["results"][0]["text"], "Health")
+        self.assertEqual(self.client.get(url).json()["results"], [])
+
+
+class DriveProfileTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            "janedoe", "jane@doe.com", "janedoe"
+        )
+        self.org = Organization.objects.create(name="Test Org", states=["NJ"])
+        self.drive = Drive.objects.create(
+            name="Test Drive", state="NJ", organization=self.org
+        )
+
+    def test_cached_profile(self):
+        self.assertEqual(drive_profile(self.drive.slug)["name"], "Test Drive")
+        with self.assertNumQueries(0):
+            profile = drive_profile(self.drive.slug)
+        self.assertEqual(profile["organization_name"], "Test Org")
+        self.assertIsNone(drive_profile("no-such-drive"))
+
+        self.drive.name = "Renamed Drive"
+        self.drive.save()
+        self.org.name = "Renamed Org"
+        self.org.save()
+        profile = drive_profile(self.drive.slug)
+        self.assertEqual(profile["name"], "Renamed Drive")
+        self.assertEqual(profile["organization_name"], "Renamed Org")
+
+    def test_forgotten_on_commit(self):
+        drive_profile(self.drive.slug)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drive.name = "Renamed Drive"
+            self.drive.save()
+            # read by another request before the commit
+            cache.set(
+                "entry-profile:drive:%s" % self.drive.slug,
+                {"name": "Test Drive"},
+            )
+        profile = drive_profile(self.drive.slug)
+        self.assertEqual(profile["name"], "Renamed Drive")
+
+    def test_private_drive(self):
+        self.drive.private = True
+        self.drive.save()
+        profile = drive_profile(self.drive.slug)
+        with self.assertNumQueries(1):
+            self.assertFalse(can_enter(self.user, profile))
+        AllowList.objects.create(organization=self.org, email="jane@doe.com")
+        self.assertTrue(can_enter(self.user, profile))
+
+
+class UnitGraphTest(TestCase):
+    def setUp(self):
+        unit_graph.cache_clear()
+        # a 3 x 3 grid of block groups, numbered row by row
+        self.ids = ["3402100010%02d" % i for i in range(9)]
+        for i, census_id in enumerate(self.ids):
+            BlockGroup.objects.create(
+                census_id=census_id, geometry=square(i % 3, i // 3)
+            )
+        self.assertEqual(build_unit_graph(BlockGroup, "34", 2020), 9)
+
+    def test_analyze_units(self):
+        ring = [c for i, c in enumerate(self.ids) if i != 4]
+        self.assertEqual(analyze_units(BlockGroup, ring, 2020), (1, 1))
+        # units that only meet at a corner are not contiguous
+        corners = [self.ids[0], self.ids[4]]
+        self.assertEqual(analyze_units(BlockGroup, corners, 2020), (2, 0))
+        self.assertEqual(
+            analyze_units(BlockGroup, self.ids[:3], 2020), (1, 0)
+        )
+        self.assertIsNone(analyze_units(BlockGroup, ["340210002000"], 2020))
+        self.assertIsNone(analyze_units(CensusBlock, ["340210001000"], 2020))
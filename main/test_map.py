@@ -0,0 +1,577 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import zipfile
+
+import pyarrow.parquet as pq
+import pyogrio
+
+from django.db import connection
+from django.http import FileResponse
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import GEOSGeometry
+from django.urls import reverse
+
+from .display import DISPLAY_FIELDS, display_field
+from .encoding import (
+    decode_coordinates,
+    encode_coordinates,
+    encode_ring,
+    parse_encoding,
+)
+from .exports import block_equivalency
+from .models import (
+    BlockGroup,
+    CensusBlock,
+    CommunityEntry,
+    Drive,
+    Membership,
+    Organization,
+    State,
+    StateMapSnapshot,
+)
+from .snapshots import rebuild_state_map_snapshot
+from .topojson import build_topology, parse_quantization, topology_features
+
+# Polygon from the Princeton, NJ area.
+TEST_POLYGON = "SRID=4326;MULTIPOLYGON(((-74.66634750366211 40.351123031789,-74.66574668884277 40.35017456869076,-74.66694831848145 40.34916067959381,-74.66797828674316 40.35066515471735,-74.66634750366211 40.351123031789)))"
+
+
+class StateMapTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.state = State.objects.create(
+            name="Michigan",
+            abbr="MI",
+            content_news="<p>Test news content</p>",
+            content_criteria="<p>Test criteria content</p>",
+            content_coi="<p>Test COI content</p>",
+        )
+        self.user = get_user_model().objects.create_user(
+            "johndoe", "john@doe.com", "johndoe"
+        )
+        self.data_url = reverse("main:map_data", kwargs={"state": "mi"})
+
+    def create_entry(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return CommunityEntry.objects.create(
+                user=self.user,
+                state="mi",
+                state_obj=self.state,
+                entry_name="test",
+                economic_interests="test",
+                census_blocks_polygon=GEOSGeometry(TEST_POLYGON),
+                **kwargs
+            )
+
+    def get_entries(self):
+        response = self.client.get(self.data_url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["entries"]
+
+    def test_map_page(self):
+        response = self.client.get("/map/mi/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.data_url)
+
+    def test_only_public_entries(self):
+        public = self.create_entry()
+        self.create_entry(private=True)
+        self.create_entry(admin_approved=False)
+        entries = self.get_entries()
+        self.assertEqual(list(entries), [public.entry_ID])
+        self.assertEqual(entries[public.entry_ID]["entry_name"], "test")
+        self.assertEqual(entries[public.entry_ID]["num_bg"], 0)
+
+    def test_snapshot_follows_moderation(self):
+        entry = self.create_entry()
+        self.assertIn(entry.entry_ID, self.get_entries())
+
+        entry.admin_approved = False
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.save()
+        self.assertNotIn(entry.entry_ID, self.get_entries())
+
+        entry.admin_approved = True
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.save()
+        self.assertIn(entry.entry_ID, self.get_entries())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.delete()
+        self.assertEqual(self.get_entries(), {})
+
+    def test_etag(self):
+        self.create_entry()
+        response = self.client.get(self.data_url)
+        etag = response["ETag"]
+        response = self.client.get(self.data_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # any change to the state's communities invalidates the etag
+        self.create_entry()
+        response = self.client.get(self.data_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(
+            StateMapSnapshot.objects.get(state=self.state).version,
+            response.json()["version"],
+        )
+
+    def test_encoding(self):
+        entry = self.create_entry()
+        plain = self.get_entries()[entry.entry_ID]["coordinates"]
+        response = self.client.get(self.data_url, {"encoding": "polyline6"})
+        encoded = response.json()["entries"][entry.entry_ID]["coordinates"]
+        self.assertIsInstance(encoded[0][0], str)
+        self.assertEqual(decode_coordinates(encoded, 6), plain)
+        response = self.client.get(self.data_url, {"encoding": "geobuf"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_topojson(self):
+        entry = self.create_entry()
+        response = self.client.get(
+            self.data_url, {"format": "topojson", "quantization": 1000}
+        )
+        topology = response.json()["topology"]
+        self.assertEqual(topology["type"], "Topology")
+        (geometry,) = topology["objects"]["communities"]["geometries"]
+        self.assertEqual(geometry["id"], entry.entry_ID)
+        self.assertEqual(geometry["properties"]["entry_name"], "test")
+        self.assertNotEqual(
+            response["ETag"], self.client.get(self.data_url)["ETag"]
+        )
+        response = self.client.get(
+            self.data_url, {"format": "topojson", "quantization": 1}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class GeometryEncodingTest(TestCase):
+    def test_polyline(self):
+        # the example of Google's polyline format, in lng,lat order
+        ring = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+        self.assertEqual(
+            encode_ring([[lat, lng] for lng, lat in ring], 5),
+            "_p~iF~ps|U_ulLnnqC_mqNvxq`@",
+        )
+
+    def test_round_trip(self):
+        coordinates = GEOSGeometry(TEST_POLYGON).coords
+        coordinates = [
+            [[[round(c, 6) for c in p] for p in ring] for ring in polygon]
+            for polygon in coordinates
+        ]
+        encoded = encode_coordinates(coordinates, 6)
+        self.assertEqual(decode_coordinates(encoded, 6), coordinates)
+
+    def test_parse_encoding(self):
+        self.assertIsNone(parse_encoding(""))
+        self.assertEqual(parse_encoding("polyline5"), 5)
+        for encoding in ("polyline7", "polyline", "geobuf"):
+            with self.assertRaises(ValueError):
+                parse_encoding(encoding)
+
+
+def square(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+
+
+class TopoJSONTest(TestCase):
+    def feature(self, id, *polygons):
+        return {
+            "type": "Feature",
+            "id": id,
+            "geometry": {"type": "MultiPolygon", "coordinates": polygons},
+            "properties": {},
+        }
+
+    def test_shared_arcs(self):
+        left = self.feature("left", [square(0, 0, 1, 1)])
+        right = self.feature("right", [square(1, 0, 2, 1)])
+        same = self.feature("same", [square(1, 0, 2, 1)[::-1]])
+        topology = build_topology([left, right, same])
+        # the shared edge, the rest of each square
+        self.assertEqual(len(topology["arcs"]), 3)
+        geometries = topology["objects"]["communities"]["geometries"]
+        self.assertEqual(
+            geometries[2]["arcs"],
+            [[[~i for i in reversed(geometries[1]["arcs"][0][0])]]],
+        )
+
+    def test_round_trip(self):
+        features = [
+            self.feature("a", [square(0, 0, 4, 4), square(1, 1, 2, 2)]),
+            self.feature("b", [square(4, 0, 8, 4)], [square(0, 6, 2, 8)]),
+        ]
+        for quantization in (0, 9):
+            topology = build_topology(features, quantization)
+            decoded = topology_features(topology)
+            for feature, result in zip(features, decoded):
+                self.assertEqual(result["id"], feature["id"])
+                for polygon, result_polygon in zip(
+                    feature["geometry"]["coordinates"],
+                    result["geometry"]["coordinates"],
+                ):
+                    for ring, result_ring in zip(polygon, result_polygon):
+                        self.assertEqual(len(ring), len(result_ring))
+                        result_ring = {
+                            tuple(round(c, 9) for c in p) for p in result_ring
+                        }
+                        self.assertEqual({tuple(p) for p in ring}, result_ring)
+
+    def test_parse_quantization(self):
+        self.assertEqual(parse_quantization("0"), 0)
+        self.assertEqual(parse_quantization("10000"), 10000)
+        for value in ("1", "-5", "many"):
+            with self.assertRaises(ValueError):
+                parse_quantization(value)
+
+
+class DisplayPolygonTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "johndoe", "john@doe.com", "johndoe"
+        )
+
+    def test_display_field(self):
+        self.assertEqual(display_field(5), "display_polygon_low")
+        self.assertEqual(display_field(9), "display_polygon_mid")
+        self.assertEqual(display_field(16), "display_polygon_high")
+
+    def test_computed_on_save(self):
+        entry = CommunityEntry.objects.create(
+            user=self.user,
+            entry_name="test",
+            census_blocks_polygon=GEOSGeometry(TEST_POLYGON),
+        )
+        entry.refresh_from_db()
+        full = entry.census_blocks_polygon
+        for field in DISPLAY_FIELDS:
+            geometry = getattr(entry, field)
+            self.assertIsNotNone(geometry)
+            self.assertLessEqual(geometry.num_coords, full.num_coords)
+            self.assertFalse(geometry.empty)
+        self.assertTrue(entry.planar_polygon.equals(full))
+
+        entry.census_blocks_polygon = None
+        entry.save(update_fields=["census_blocks_polygon"])
+        entry.refresh_from_db()
+        self.assertIsNone(entry.display_polygon_low)
+        self.assertIsNone(entry.planar_polygon)
+
+
+class MapQueryCountTest(TestCase):
+    """
+    Drawing a map must take the same number of queries however many
+    communities it shows.
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.state = State.objects.create(name="New Jersey", abbr="NJ")
+        self.user = get_user_model().objects.create_user(
+            "johndoe", "john@doe.com", "johndoe"
+        )
+        self.org = Organization.objects.create(
+            name="Test Organization", states=["NJ"]
+        )
+        self.drive = Drive.objects.create(
+            name="Test Drive", state="NJ", organization=self.org
+        )
+        self.block_group = BlockGroup.objects.create(census_id="340210001001")
+
+    def add_entries(self, n):
+        # commit, so that the cached partner maps see the new entries
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(n):
+                entry = CommunityEntry.objects.create(
+                    user=self.user,
+                    state="nj",
+                    state_obj=self.state,
+                    organization=self.org,
+                    drive=self.drive,
+                    entry_name="test %d" % i,
+                    census_blocks_polygon=GEOSGeometry(TEST_POLYGON),
+                )
+                entry.block_groups.add(self.block_group)
+                entry.tags.add("parks", "schools")
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return len(queries)
+
+    def assertConstantQueries(self, func):
+        self.add_entries(1)
+        expected = self.count_queries(func)
+        self.add_entries(5)
+        self.assertEqual(self.count_queries(func), expected)
+
+    def test_snapshot(self):
+        self.assertConstantQueries(
+            lambda: rebuild_state_map_snapshot(self.state)
+        )
+        snapshot = StateMapSnapshot.objects.get(state=self.state)
+        record = next(iter(snapshot.entries.values()))
+        self.assertEqual(record["num_bg"], 1)
+        self.assertEqual(record["tags"], ["parks", "schools"])
+        self.assertEqual(record["drive"], "Test Drive")
+
+    def test_partner_map(self):
+        url = "/map/p/%s/" % self.org.slug
+        self.assertConstantQueries(lambda: self.client.get(url))
+        response = self.client.get(url)
+        self.assertEqual(response.context["comms_counter"], 6)
+        self.assertContains(response, "schools")
+
+    def test_partner_map_admin(self):
+        Membership.objects.create(member=self.user, organization=self.org)
+        self.client.force_login(self.user)
+        url = "/map/p/%s/%s/" % (self.org.slug, self.drive.slug)
+        self.assertConstantQueries(lambda: self.client.get(url))
+        response = self.client.get(url)
+        self.assertContains(response, "johndoe")
+
+    def test_partner_map_cache(self):
+        self.add_entries(2)
+        url = "/map/p/%s/%s/" % (self.org.slug, self.drive.slug)
+        first = self.count_queries(lambda: self.client.get(url))
+        cached = self.count_queries(lambda: self.client.get(url))
+        self.assertLess(cached, first)
+
+        # moderation and drive edits reach the public map
+        entry = CommunityEntry.objects.get(entry_name="test 0")
+        entry.admin_approved = False
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.save()
+        response = self.client.get(url)
+        self.assertEqual(response.context["comms_counter"], 1)
+        self.assertNotContains(response, "johndoe")
+
+        self.drive.name = "Renamed Drive"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drive.save()
+        communities = self.client.get(url).context["communities"]
+        self.assertEqual(communities[0]["drive_name"], "Renamed Drive")
+
+        # org admins see the unapproved entry and the authors
+        Membership.objects.create(member=self.user, organization=self.org)
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.context["comms_counter"], 2)
+        self.assertContains(response, "johndoe")
+
+
+class CommunityBoundsTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = get_user_model().objects.create_user(
+            "johndoe", "john@doe.com", "johndoe"
+        )
+        for i in range(3):
+            CommunityEntry.objects.create(
+                user=self.user,
+                entry_name="test %d" % i,
+                census_blocks_polygon=GEOSGeometry(TEST_POLYGON),
+            )
+        CommunityEntry.objects.create(
+            user=self.user,
+            entry_name="hidden",
+            admin_approved=False,
+            census_blocks_polygon=GEOSGeometry(TEST_POLYGON),
+        )
+
+    def get(self, **params):
+        params.setdefault("bbox", "-74.7,40.3,-74.6,40.4")
+        return self.client.get(reverse("main:community_bounds"), params)
+
+    def test_pages(self):
+        page = self.get(limit=2).json()
+        self.assertEqual(
+            [r["entry_name"] for r in page["results"]], ["test 0", "test 1"]
+        )
+        self.assertIsNotNone(page["next"])
+        page = self.get(limit=2, after=page["next"]).json()
+        self.assertEqual(
+            [r["entry_name"] for r in page["results"]], ["test 2"]
+        )
+        self.assertIsNone(page["next"])
+
+    def test_bbox(self):
+        page = self.get(bbox="-80,30,-79,31").json()
+        self.assertEqual(page["results"], [])
+        self.assertEqual(self.get(bbox="1,2,3").status_code, 400)
+        self.assertEqual(self.get(bbox="2,2,1,3").status_code, 400)
+
+    def test_tag_filter(self):
+        entry = CommunityEntry.objects.get(entry_name="test 1")
+        entry.tags.add("parks")
+        page = self.get(tag="parks").json()
+        self.assertEqual(len(page["results"]), 1)
+        self.assertEqual(page["results"][0]["entry_ID"], entry.entry_ID)
+
+    def test_encoding(self):
+        page = self.get(encoding="polyline6").json()
+        self.assertIsInstance(page["results"][0]["coordinates"][0][0], str)
+        self.assertEqual(self.get(encoding="polyline9").status_code, 400)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        export_cache = tempfile.TemporaryDirectory()
+        self.addCleanup(export_cache.cleanup)
+        settings = self.settings(EXPORT_CACHE_DIR=export_cache.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.state = State.objects.create(
+            name="New Jersey",
+            abbr="NJ",
+            content_news="<p>Test news content</p>",
+            content_criteria="<p>Test criteria content</p>",
+            content_coi="<p>Test COI content</p>",
+        )
+        self.user = get_user_model().objects.create_user(
+            "johndoe", "john@doe.com", "johndoe"
+        )
+        self.client.force_login(self.user)
+        for i in range(3):
+            entry = CommunityEntry.objects.create(
+                user=self.user,
+                state="nj",
+                state_obj=self.state,
+                entry_name="test %d" % i,
+                census_blocks_polygon=GEOSGeometry(TEST_POLYGON),
+            )
+            entry.block_groups.add(
+                BlockGroup.objects.create(census_id="34021000%d001" % i),
+                BlockGroup.objects.create(census_id="34021000%d002" % i),
+            )
+
+    def export(self, type):
+        response = self.client.post(
+            reverse("main:multi_export", kwargs={"abbr": "nj", "type": type}),
+            {"cois": json.dumps(["all"])},
+        )
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def test_geojson(self):
+        collection = json.loads(self.export("geo"))
+        self.assertEqual(collection["type"], "FeatureCollection")
+        names = [f["properties"]["entry_name"] for f in collection["features"]]
+        self.assertEqual(sorted(names), ["test 0", "test 1", "test 2"])
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export("csv").decode())))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual({r["DISTRICT"] for r in rows}, {"1", "2", "3"})
+
+    def test_zip(self):
+        with zipfile.ZipFile(io.BytesIO(self.export("zip"))) as z:
+            collection = json.loads(z.read("New_Jersey_communities.geojson"))
+        self.assertEqual(len(collection["features"]), 3)
+
+    def test_geoparquet(self):
+        table = pq.read_table(io.BytesIO(self.export("parquet")))
+        self.assertEqual(
+            sorted(table.column("entry_name").to_pylist()),
+            ["test 0", "test 1", "test 2"],
+        )
+        metadata = json.loads(table.schema.metadata[b"geo"])
+        self.assertEqual(metadata["primary_column"], "geometry")
+        # WKB from PostGIS
+        wkb = table.column("geometry")[0].as_py()
+        geometry = GEOSGeometry(memoryview(wkb))
+        self.assertEqual(geometry.geom_type, "MultiPolygon")
+
+    def test_flatgeobuf(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "communities.fgb")
+            with open(path, "wb") as f:
+                f.write(self.export("fgb"))
+            info = pyogrio.read_info(path)
+        self.assertEqual(info["features"], 3)
+        self.assertIn("entry_name", list(info["fields"]))
+
+    def test_cached_export(self):
+        # the author sees their own names, so export as someone else
+        self.client.force_login(
+            get_user_model().objects.create_user(
+                "janedoe", "jane@doe.com", "janedoe"
+            )
+        )
+        url = reverse(
+            "main:multi_export", kwargs={"abbr": "nj", "type": "geo"}
+        )
+        data = {"cois": json.dumps(["all"])}
+        first = self.client.post(url, data)
+        content = b"".join(first.streaming_content)
+        second = self.client.post(url, data)
+        self.assertIsInstance(second, FileResponse)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(b"".join(second.streaming_content), content)
+
+        # any change to the state's communities makes a new export
+        entry = CommunityEntry.objects.get(entry_name="test 0")
+        entry.entry_name = "renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.save()
+        third = self.client.post(url, data)
+        self.assertNotIsInstance(third, FileResponse)
+        self.assertNotEqual(third["ETag"], first["ETag"])
+        self.assertIn(b"renamed", b"".join(third.streaming_content))
+
+    def test_conditional_export(self):
+        self.client.force_login(
+            get_user_model().objects.create_user(
+                "janedoe", "jane@doe.com", "janedoe"
+            )
+        )
+        url = reverse(
+            "main:multi_export", kwargs={"abbr": "nj", "type": "geo"}
+        )
+        first = self.client.get(url)
+        content = json.loads(b"".join(first.streaming_content))
+        self.assertEqual(content["type"], "FeatureCollection")
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_block_equivalency(self):
+        entry = CommunityEntry.objects.get(entry_name="test 0")
+        entry.census_blocks.add(
+            CensusBlock.objects.create(census_id="340210000001000")
+        )
+        other = get_user_model().objects.create_user(
+            "janedoe", "jane@doe.com", "janedoe"
+        )
+        query = CommunityEntry.objects.order_by("entry_name")
+        columns = ["entry_name", "author_name"]
+        rows = list(
+            csv.DictReader(
+                io.StringIO(
+                    b"".join(
+                        block_equivalency(query, columns, viewer=other)
+                    ).decode()
+                )
+            )
+        )
+        # communities with block groups are exported without their blocks
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(
+            [r["DISTRICT"] for r in rows], ["1", "1", "2", "2", "3", "3"]
+        )
+        self.assertEqual(rows[0]["entry_name"], "test 0")
+        self.assertEqual({r["author_name"] for r in rows}, {""})
+
+    def test_empty_block_equivalency(self):
+        query = CommunityEntry.objects.none()
+        self.assertEqual(
+            b"".join(block_equivalency(query, ["entry_name"])),
+            b"BLOCKID,DISTRICT,entry_name\n",
+        )
@@ -0,0 +1,102 @@
+import tempfile
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from . import moderation
+from .classifier import NgramModel
+from .moderation import flag_submission, get_backend, score_texts
+
+
+class CountingBackend(moderation.LocalBackend):
+    name = "counting"
+
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    def score(self, text):
+        self.texts.append(text)
+        return super().score(text)
+
+
+@override_settings(
+    MODERATION_BACKEND="main.test_moderation.CountingBackend",
+    MODERATION_BLOCKED_WORDS=["darn"],
+)
+class ModerationTest(SimpleTestCase):
+    def setUp(self):
+        moderation._load_backend.cache_clear()
+        cache.clear()
+
+    def test_flag_submission(self):
+        data = {
+            "entry_name": "Riverside",
+            "user_name": "",
+            "cultural_interests": "the darn bridge",
+            "economic_interests": "Riverside",
+        }
+        self.assertTrue(flag_submission(data))
+        self.assertFalse(flag_submission({"entry_name": "Riverside"}))
+        # each distinct text is scored once, blank texts never
+        self.assertEqual(
+            sorted(get_backend().texts), ["Riverside", "the darn bridge"]
+        )
+
+    def test_scores(self):
+        scores = score_texts(["darn it", "   "])
+        self.assertEqual(list(scores), ["darn it"])
+        self.assertEqual(scores["darn it"]["TOXICITY"], 1.0)
+
+
+TOXIC = ["you are all idiots", "stupid idiot neighbors", "idiots go away"]
+CLEAN = ["the river park", "our library and schools", "church events"]
+
+
+class OfflineTriageBackend(moderation.TriageBackend):
+    name = "offline"
+
+    def get_remote(self):
+        raise ConnectionError("no network in tests")
+
+
+class ClassifierTest(SimpleTestCase):
+    def setUp(self):
+        moderation._load_backend.cache_clear()
+        cache.clear()
+        self.model = NgramModel.train(TOXIC + CLEAN, [1] * 3 + [0] * 3)
+
+    def test_probability(self):
+        self.assertGreater(self.model.probability("what idiots"), 0.5)
+        self.assertLess(self.model.probability("the library park"), 0.5)
+        with tempfile.NamedTemporaryFile(suffix=".npz") as f:
+            self.model.save(f.name)
+            loaded = NgramModel.load(f.name)
+        self.assertEqual(
+            loaded.probability("what idiots"),
+            self.model.probability("what idiots"),
+        )
+
+    def test_triage(self):
+        with tempfile.NamedTemporaryFile(suffix=".npz") as f:
+            self.model.save(f.name)
+            with override_settings(
+                MODERATION_BACKEND="main.test_moderation.OfflineTriageBackend",
+                MODERATION_MODEL_PATH=f.name,
+                MODERATION_CLEAN_BELOW=0.01,
+            ):
+                backend = get_backend()
+                self.assertIsNotNone(backend.local.model)
+                # decided locally, or locally after the API failed
+                scores = score_texts(["idiots", "church library", "hello"])
+        self.assertTrue(moderation.is_flagged(scores["idiots"]))
+        self.assertFalse(moderation.is_flagged(scores["church library"]))
+        self.assertIn(moderation.UNCHECKED, scores["hello"])
+        # the texts that could not be sent to the API are not cached
+        cached = [
+            text
+            for text, value in scores.items()
+            if moderation.UNCHECKED not in value
+        ]
+        keys = [moderation._cache_key(backend, text) for text in scores]
+        self.assertEqual(len(cache.get_many(keys)), len(cached))
@@ -0,0 +1,161 @@
+from django.test import TestCase, Client
+from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import GEOSGeometry
+from django.urls import reverse
+
+from .models import (
+    Address,
+    CommunityEntry,
+    Drive,
+    Membership,
+    Organization,
+    Report,
+)
+from .test_map import TEST_POLYGON
+from .versions import drive_scope, get_version
+
+
+class ReviewQueueTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = get_user_model().objects.create_user(
+            "johndoe", "john@doe.com", "johndoe"
+        )
+        self.org = Organization.objects.create(
+            name="Test Organization", states=["NJ"]
+        )
+        self.drive = Drive.objects.create(
+            name="Test Drive", state="NJ", organization=self.org
+        )
+        Membership.objects.create(
+            member=self.user, organization=self.org, is_org_admin=True
+        )
+        self.client.force_login(self.user)
+        self.entries = [
+            CommunityEntry.objects.create(
+                user=self.user,
+                organization=self.org,
+                drive=self.drive,
+                entry_name="test %d" % i,
+                admin_approved=i % 2 == 0,
+                census_blocks_polygon=GEOSGeometry(TEST_POLYGON),
+            )
+            for i in range(5)
+        ]
+        Address.objects.create(
+            entry=self.entries[4], street="1 Main St", city="Trenton"
+        )
+        Report.objects.create(community=self.entries[0], email="a@b.com")
+        self.url_kwargs = self.org.get_url_kwargs()
+        self.queue_url = reverse("main:review_queue", kwargs=self.url_kwargs)
+
+    def action_url(self, entry):
+        return reverse(
+            "main:review_action",
+            kwargs=dict(self.url_kwargs, entry_ID=entry.entry_ID),
+        )
+
+    def test_review_page(self):
+        response = self.client.get(
+            reverse("main:review_org", kwargs=self.url_kwargs)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.queue_url)
+
+    def test_pages(self):
+        page = self.client.get(self.queue_url, {"limit": 3}).json()
+        self.assertEqual(
+            [r["entry_name"] for r in page["results"]],
+            ["test 4", "test 3", "test 2"],
+        )
+        self.assertEqual(page["results"][0]["address"], "1 Main St, Trenton")
+        self.assertEqual(
+            page["counts"], {"pending": 2, "approved": 3, "reported": 1}
+        )
+        page = self.client.get(
+            self.queue_url, {"limit": 3, "after": page["next"]}
+        ).json()
+        self.assertEqual(
+            [r["entry_name"] for r in page["results"]], ["test 1", "test 0"]
+        )
+        self.assertIsNone(page["next"])
+        self.assertNotIn("counts", page)
+
+    def test_status_filters(self):
+        def names(status):
+            page = self.client.get(self.queue_url, {"status": status}).json()
+            return [r["entry_name"] for r in page["results"]]
+
+        self.assertEqual(names("pending"), ["test 3", "test 1"])
+        self.assertEqual(names("reported"), ["test 0"])
+        response = self.client.get(self.queue_url, {"status": "spam"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_geometry(self):
+        url = reverse(
+            "main:review_geometry",
+            kwargs=dict(self.url_kwargs, entry_ID=self.entries[0].entry_ID),
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.json()["geometry"]["type"], "MultiPolygon")
+
+    def test_actions(self):
+        entry = self.entries[1]
+        delta = self.client.post(
+            self.action_url(entry), {"action": "approve"}
+        ).json()
+        self.assertTrue(delta["admin_approved"])
+        self.assertEqual(delta["counts"]["pending"], 1)
+        entry.refresh_from_db()
+        self.assertTrue(entry.admin_approved)
+
+        delta = self.client.post(
+            self.action_url(self.entries[0]), {"action": "resolve"}
+        ).json()
+        self.assertEqual(delta["counts"]["reported"], 0)
+
+        delta = self.client.post(
+            self.action_url(entry), {"action": "delete"}
+        ).json()
+        self.assertTrue(delta["deleted"])
+        self.assertFalse(CommunityEntry.objects.filter(pk=entry.pk).exists())
+
+    def test_other_org(self):
+        other = Organization.objects.create(name="Other", states=["NJ"])
+        entry = CommunityEntry.objects.create(
+            user=self.user, organization=other, entry_name="other"
+        )
+        response = self.client.post(
+            self.action_url(entry), {"action": "delete"}
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(CommunityEntry.objects.filter(pk=entry.pk).exists())
+
+    def test_bulk_entries(self):
+        response = self.client.post(
+            reverse("main:review_bulk_action", kwargs=self.url_kwargs),
+            {
+                "action": "approve",
+                "entries": [e.entry_ID for e in self.entries[:2]],
+            },
+        )
+        self.assertEqual(response.json()["count"], 2)
+        self.assertEqual(response.json()["counts"]["pending"], 1)
+
+    def test_bulk_all_matching(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("main:review_bulk_action", kwargs=self.url_kwargs),
+                {"action": "delete", "all": "1", "status": "pending"},
+            )
+        self.assertEqual(response.json()["count"], 2)
+        self.assertEqual(
+            list(
+                CommunityEntry.objects.order_by("id").values_list(
+                    "entry_name", flat=True
+                )
+            ),
+            ["test 0", "test 2", "test 4"],
+        )
+        # one version bump for the whole batch
+        self.assertEqual(get_version(drive_scope(self.drive.pk)), 1)
@@ -0,0 +1,237 @@
+import json
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import GEOSGeometry
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import moderation
+from .export_jobs import expire_export, job_path, part_path, start_export
+from .models import CommunityEntry, ExportJob, Report, Task
+from .pipeline import moderate_entry, send_submission_email
+from .tasks import enqueue, run_next, run_tasks, task
+from .test_map import TEST_POLYGON
+
+calls = []
+
+
+@task("test_record")
+def record(value):
+    calls.append(value)
+
+
+def gave_up():
+    calls.append("gave up")
+
+
+@task("test_fail", max_attempts=2, on_failure=gave_up)
+def fail():
+    Task.objects.create(name="rolled back")
+    raise RuntimeError("failed")
+
+
+@override_settings(TASK_RETRY_DELAY=10)
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_run(self):
+        enqueue("test_record", value=1)
+        enqueue("test_record", value=2)
+        enqueue("test_record", run_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(run_tasks(), 2)
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(Task.objects.filter(status=Task.DONE).count(), 2)
+
+    def test_retry(self):
+        enqueue("test_fail")
+        first = run_next()
+        self.assertEqual(first.status, Task.PENDING)
+        self.assertIn("RuntimeError", first.last_error)
+        self.assertGreater(first.run_at, timezone.now() + timedelta(seconds=5))
+        # the work of the failed attempt was rolled back
+        self.assertEqual(Task.objects.count(), 1)
+        # not due yet
+        self.assertIsNone(run_next())
+
+        self.assertEqual(calls, [])
+
+        Task.objects.update(run_at=timezone.now())
+        self.assertEqual(run_next().status, Task.FAILED)
+        self.assertEqual(run_tasks(), 0)
+        self.assertEqual(calls, ["gave up"])
+
+
+@override_settings(
+    MODERATION_BACKEND="main.moderation.LocalBackend",
+    MODERATION_BLOCKED_WORDS=["darn"],
+)
+class SubmissionTasksTest(TestCase):
+    def setUp(self):
+        moderation._load_backend.cache_clear()
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            "johndoe", "john@doe.com", "johndoe"
+        )
+
+    def test_moderate_entry(self):
+        clean = CommunityEntry.objects.create(
+            user=self.user, entry_name="Riverside", admin_approved=False
+        )
+        flagged = CommunityEntry.objects.create(
+            user=self.user,
+            entry_name="Riverside",
+            comm_activities="darn",
+            admin_approved=False,
+        )
+        moderate_entry(entry_id=clean.pk, approve=True)
+        moderate_entry(entry_id=flagged.pk, approve=True)
+        clean.refresh_from_db()
+        flagged.refresh_from_db()
+        self.assertTrue(clean.admin_approved)
+        self.assertFalse(flagged.admin_approved)
+        self.assertTrue(Report.objects.filter(community=flagged).exists())
+
+    @override_settings(
+        MODERATION_BACKEND="main.test_moderation.OfflineTriageBackend"
+    )
+    def test_moderate_entry_unchecked(self):
+        entry = CommunityEntry.objects.create(
+            user=self.user, entry_name="Riverside", admin_approved=False
+        )
+        enqueue("moderate_entry", entry_id=entry.pk, approve=True)
+        task = run_next()
+        # retried once the API is back, never approved unchecked
+        self.assertEqual(task.status, Task.PENDING)
+        self.assertIn("ModerationUnavailable", task.last_error)
+        entry.refresh_from_db()
+        self.assertFalse(entry.admin_approved)
+
+    def test_send_submission_email(self):
+        entry = CommunityEntry.objects.create(
+            user=self.user, entry_name="Riverside"
+        )
+        send_submission_email(entry_id=entry.pk, path="/submission/")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            mail.outbox[0].subject, 'Your community "Riverside" was submitted'
+        )
+        self.assertIn("/submission/", mail.outbox[0].body)
+
+
+@override_settings(EXPORT_JOB_CHUNK_SIZE=2, EXPORT_JOB_CONCURRENCY=1)
+class ExportJobTest(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = self.settings(
+            DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+            MEDIA_ROOT=media.name,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = get_user_model().objects.create_user(
+            "johndoe", "john@doe.com", "johndoe"
+        )
+        for i in range(5):
+            CommunityEntry.objects.create(
+                user=self.user,
+                entry_name="test %d" % i,
+                census_blocks_polygon=GEOSGeometry(TEST_POLYGON),
+            )
+
+    def start(self, format=ExportJob.GEOJSON):
+        return start_export(
+            self.user, CommunityEntry.objects.all(), format, "test"
+        )
+
+    def test_geojson(self):
+        job = self.start()
+        # one task per chunk of 2 communities
+        self.assertEqual(run_tasks(), 3)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.DONE)
+        self.assertEqual(job.done, 5)
+        with default_storage.open(job_path(job)) as f:
+            collection = json.load(f)
+        names = [f["properties"]["entry_name"] for f in collection["features"]]
+        self.assertEqual(names, ["test %d" % i for i in range(5)])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("/exportjobs/%d/download/" % job.pk, mail.outbox[0].body)
+
+    def test_csv(self):
+        job = self.start(ExportJob.CSV)
+        run_tasks()
+        with default_storage.open(job_path(job)) as f:
+            # none of the communities have census units
+            self.assertEqual(f.read().count("BLOCKID"), 1)
+
+    def test_resume(self):
+        job = self.start()
+        run_next()
+        # an attempt that stopped in the middle of the next chunk
+        default_storage.save(
+            part_path(job, 2), ContentFile(b', {"type": "Fea')
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            run_tasks()
+        with default_storage.open(job_path(job)) as f:
+            self.assertEqual(len(json.load(f)["features"]), 5)
+        # only the joined file is kept
+        _, files = default_storage.listdir("export_jobs/%d" % job.pk)
+        self.assertEqual(files, ["test.geojson"])
+
+    def test_concurrency(self):
+        first = self.start()
+        second = self.start()
+        run_next()
+        run_next()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.status, ExportJob.RUNNING)
+        # waits for the first job to finish
+        self.assertEqual(second.status, ExportJob.QUEUED)
+        run_tasks()
+        first.refresh_from_db()
+        self.assertEqual(first.status, ExportJob.DONE)
+
+    def test_status(self):
+        job = self.start()
+        self.client.force_login(self.user)
+        response = self.client.get("/exportjobs/%d/" % job.pk)
+        self.assertEqual(response.json()["status"], ExportJob.QUEUED)
+        self.assertEqual(response.json()["total"], 5)
+        response = self.client.get("/exportjobs/%d/download/" % job.pk)
+        self.assertEqual(response.status_code, 404)
+
+        run_tasks()
+        response = self.client.get("/exportjobs/%d/download/" % job.pk)
+        self.assertEqual(response["Content-Type"], "application/json")
+        content = b"".join(response.streaming_content)
+        self.assertIn(b"FeatureCollection", content)
+
+    def test_expiry(self):
+        job = self.start()
+        run_tasks()
+        job.refresh_from_db()
+        # not expired yet
+        expire_export(job_id=job.pk)
+        self.assertTrue(ExportJob.objects.filter(pk=job.pk).exists())
+        self.assertTrue(
+            Task.objects.filter(
+                name="expire_export", status=Task.PENDING
+            ).exists()
+        )
+
+        job.finished_at -= timedelta(days=7)
+        job.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            expire_export(job_id=job.pk)
+        self.assertFalse(ExportJob.objects.filter(pk=job.pk).exists())
+        self.assertFalse(default_storage.exists(job_path(job)))
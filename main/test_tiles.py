@@ -0,0 +1,111 @@
+import tempfile
+
+from django.test import TestCase, Client
+from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import GEOSGeometry
+
+from .models import CommunityEntry, DataVersion, State
+from .test_map import TEST_POLYGON
+from .tiles import is_valid_tile, tile_bounds, tile_lnglat_polygon
+from .versions import get_version, state_scope
+
+# the zoom 12 tile around the test polygon
+TILE_URL = "/tiles/communities/12/1198/1545.mvt"
+
+
+class TileMathTest(TestCase):
+    def test_tile_bounds(self):
+        xmin, ymin, xmax, ymax = tile_bounds(0, 0, 0)
+        self.assertAlmostEqual(xmin, -20037508.342789244)
+        self.assertAlmostEqual(ymax, 20037508.342789244)
+        xmin, ymin, xmax, ymax = tile_bounds(1, 1, 1)
+        self.assertAlmostEqual(xmin, 0)
+        self.assertAlmostEqual(ymax, 0)
+
+    def test_valid_tile(self):
+        self.assertTrue(is_valid_tile(12, 1198, 1545))
+        self.assertFalse(is_valid_tile(1, 2, 0))
+        self.assertFalse(is_valid_tile(23, 0, 0))
+
+    def test_lnglat_polygon(self):
+        polygon = GEOSGeometry(TEST_POLYGON)
+        tile = tile_lnglat_polygon(12, 1198, 1545)
+        self.assertTrue(tile.intersects(polygon))
+        next_tile = tile_lnglat_polygon(12, 1199, 1545)
+        self.assertFalse(next_tile.intersects(polygon))
+
+
+class CommunityTilesTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        tile_cache = tempfile.TemporaryDirectory()
+        self.addCleanup(tile_cache.cleanup)
+        settings = self.settings(TILE_CACHE_DIR=tile_cache.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.state = State.objects.create(
+            name="Michigan",
+            abbr="MI",
+            content_news="<p>Test news content</p>",
+            content_criteria="<p>Test criteria content</p>",
+            content_coi="<p>Test COI content</p>",
+        )
+        self.user = get_user_model().objects.create_user(
+            "johndoe", "john@doe.com", "johndoe"
+        )
+
+    def create_entry(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return CommunityEntry.objects.create(
+                user=self.user,
+                state="mi",
+                state_obj=self.state,
+                entry_name="test",
+                census_blocks_polygon=GEOSGeometry(TEST_POLYGON),
+                **kwargs
+            )
+
+    def test_scope_required(self):
+        response = self.client.get(TILE_URL)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(TILE_URL + "?state=zz")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/tiles/communities/1/5/0.mvt?state=mi")
+        self.assertEqual(response.status_code, 404)
+
+    def test_tiles(self):
+        response = self.client.get(TILE_URL + "?state=mi")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"")
+
+        self.create_entry()
+        response = self.client.get(TILE_URL + "?state=mi")
+        self.assertEqual(
+            response["Content-Type"], "application/vnd.mapbox-vector-tile"
+        )
+        self.assertNotEqual(response.content, b"")
+
+        response = self.client.get(
+            TILE_URL + "?state=mi", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_version_bumps(self):
+        scope = state_scope(self.state.id)
+        self.assertEqual(get_version(scope), 0)
+        entry = self.create_entry()
+        self.assertEqual(get_version(scope), 1)
+
+        entry.private = True
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.save()
+        self.assertEqual(get_version(scope), 2)
+
+        # moving the community away also bumps the scope it left
+        other = State.objects.create(name="Ohio", abbr="OH")
+        entry.state_obj = other
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.save()
+        self.assertEqual(get_version(scope), 3)
+        self.assertEqual(get_version(state_scope(other.id)), 1)
+        self.assertEqual(DataVersion.objects.count(), 2)
@@ -0,0 +1,210 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Mapbox vector tiles of the communities of a state, organization or drive.
+
+Tiles are rendered by PostGIS (ST_AsMVT) and kept on disk under
+TILE_CACHE_DIR/<scope>/<audience>/<version>/<z>/<x>/<y>.mvt. Bumping the
+version of a scope (see versions.py) makes every cached tile of the scope
+unreachable, and the old directory is removed right away.
+"""
+import math
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.db import connection
+from django.db.models import BinaryField, Func, Q
+
+from .models import CommunityEntry
+from .queries import display_geometry, unit_count
+from .versions import on_bump
+
+TILE_LAYER = "communities"
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+MAX_ZOOM = 22
+
+# half the circumference of the earth in web mercator meters
+WEB_MERCATOR_MAX = 20037508.342789244
+
+# audiences: who a tile was rendered for
+PUBLIC = "public"
+ADMIN = "admin"
+
+
+class AsMVTGeom(Func):
+    """
+    Clips a lng/lat geometry to a web mercator tile and converts it to tile
+    coordinates. The output is only meant to be fed to ST_AsMVT.
+    """
+
+    function = "ST_AsMVTGeom"
+    template = (
+        "%(function)s(ST_Transform(%(expressions)s, 3857), "
+        "ST_MakeEnvelope(%(xmin)r, %(ymin)r, %(xmax)r, %(ymax)r, 3857), "
+        "%(extent)d, %(buffer)d, true)"
+    )
+    output_field = BinaryField()
+
+
+def tile_bounds(z, x, y):
+    """
+    Returns (xmin, ymin, xmax, ymax) of a tile in web mercator meters.
+    """
+    size = 2 * WEB_MERCATOR_MAX / 2 ** z
+    xmin = -WEB_MERCATOR_MAX + x * size
+    ymax = WEB_MERCATOR_MAX - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def tile_lnglat_polygon(z, x, y, padding=0.1):
+    """
+    Returns the lng/lat polygon of a tile, padded by a fraction of its size on
+    every side. The padding covers the geography edges of the polygon, which
+    are great circles and so bow away from the tile's parallels.
+    """
+    n = 2 ** z
+
+    def lng(tx):
+        return tx / n * 360.0 - 180.0
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    west = max(lng(x - padding), -180.0)
+    east = min(lng(x + 1 + padding), 180.0)
+    north = lat(max(y - padding, 0))
+    south = lat(min(y + 1 + padding, n))
+    return Polygon.from_bbox((west, south, east, north))
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def scope_entries(state=None, organization=None, drive=None, audience=PUBLIC):
+    """
+    Returns the communities drawn on a tile of the given scope. Only the admins
+    of an organization see its private and unapproved communities.
+    """
+    query = CommunityEntry.objects.all()
+    if state is not None:
+        query = query.filter(state_obj=state)
+    if organization is not None:
+        query = query.filter(organization=organization)
+    if drive is not None:
+        query = query.filter(drive=drive)
+    if audience != ADMIN:
+        query = query.filter(admin_approved=True).exclude(private=True)
+    return query
+
+
+def render_tile(query, z, x, y):
+    """
+    Renders one tile of the given communities and returns the MVT bytes
+    (empty if no community touches the tile).
+    """
+    xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+    if z > 3:
+        bounds = tile_lnglat_polygon(z, x, y)
+        query = query.filter(
+            Q(census_blocks_polygon__intersects=bounds)
+            | Q(
+                census_blocks_polygon__isnull=True,
+                user_polygon__intersects=bounds,
+            )
+        )
+    else:
+        # at the lowest zooms a tile covers most of a hemisphere and its
+        # lng/lat box would not be accurate, so the whole scope is drawn
+        query = query.filter(
+            Q(census_blocks_polygon__isnull=False)
+            | Q(user_polygon__isnull=False)
+        )
+    query = query.annotate(
+        geom=AsMVTGeom(
+            display_geometry(z),
+            xmin=xmin,
+            ymin=ymin,
+            xmax=xmax,
+            ymax=ymax,
+            extent=TILE_EXTENT,
+            buffer=TILE_BUFFER,
+        ),
+        num_bg=unit_count("block_groups"),
+        num_block=unit_count("census_blocks"),
+    ).values("entry_ID", "num_bg", "num_block", "geom")
+
+    sql, params = query.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT ST_AsMVT(tile, %%s, %d, 'geom') FROM (%s) AS tile "
+            "WHERE tile.geom IS NOT NULL" % (TILE_EXTENT, sql),
+            (TILE_LAYER,) + tuple(params),
+        )
+        tile = cursor.fetchone()[0]
+    return bytes(tile) if tile is not None else b""
+
+
+def _scope_dir(scope):
+    return os.path.join(settings.TILE_CACHE_DIR, scope.replace(":", "-"))
+
+
+def get_tile(scope, version, audience, query, z, x, y):
+    """
+    Returns the cached tile of a scope version, rendering it on a miss.
+    """
+    path = os.path.join(
+        _scope_dir(scope),
+        audience,
+        str(version),
+        str(z),
+        str(x),
+        "%d.mvt" % y,
+    )
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    tile = render_tile(query, z, x, y)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so that concurrent requests never
+        # read a partial tile
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(tile)
+        os.replace(tmp_path, path)
+    except OSError:
+        # the cache is an optimization only
+        pass
+    return tile
+
+
+@on_bump
+def clear_tile_cache(scopes):
+    # every cached tile of a bumped scope belongs to an older version
+    for scope in scopes:
+        shutil.rmtree(_scope_dir(scope), ignore_errors=True)
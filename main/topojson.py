@@ -0,0 +1,291 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+TopoJSON output of community polygons.
+
+Communities are unions of the same block groups and census blocks, so the
+boundary between two neighbouring (or overlapping) communities is the same
+line in both. A TopoJSON topology stores each such line once as an arc, and
+the polygons refer to their arcs by index (~index for an arc walked
+backwards). See https://github.com/topojson/topojson-specification.
+
+Coordinates are quantized to a grid of quantization x quantization positions
+over the bounding box of all the features, and the arcs are delta encoded.
+A quantization of 0 keeps the coordinates as they are.
+"""
+from django.conf import settings
+
+OBJECT_NAME = "communities"
+
+
+def page_quantization():
+    """
+    The default quantization of the TopoJSON payloads and exports.
+    """
+    return getattr(settings, "TOPOJSON_QUANTIZATION", 10 ** 5)
+
+
+def parse_quantization(value):
+    """
+    Parses a quantization query parameter (None or "" for the default).
+    Raises ValueError for invalid values.
+    """
+    if value is None or value == "":
+        return page_quantization()
+    quantization = int(value)
+    if quantization != 0 and not 2 <= quantization <= 10 ** 9:
+        raise ValueError("quantization must be 0 or between 2 and 10^9")
+    return quantization
+
+
+def geometry_type(coordinates):
+    """
+    "Polygon" or "MultiPolygon", from the nesting of GeoJSON coordinates.
+    """
+    if coordinates and coordinates[0]:
+        if isinstance(coordinates[0][0][0], (list, tuple)):
+            return "MultiPolygon"
+    return "Polygon"
+
+
+def _polygons(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    raise ValueError("unsupported geometry type %r" % geometry["type"])
+
+
+class _Quantizer:
+    def __init__(self, bbox, quantization):
+        self.x0, self.y0, x1, y1 = bbox
+        self.quantization = quantization
+        if quantization:
+            self.kx = (x1 - self.x0) / (quantization - 1) or 1
+            self.ky = (y1 - self.y0) / (quantization - 1) or 1
+
+    def transform(self):
+        if not self.quantization:
+            return None
+        return {"scale": [self.kx, self.ky], "translate": [self.x0, self.y0]}
+
+    def ring(self, ring):
+        """
+        The positions of a ring on the grid, without repeated positions or
+        the closing position.
+        """
+        points = []
+        for x, y in (p[:2] for p in ring):
+            if self.quantization:
+                point = (
+                    round((x - self.x0) / self.kx),
+                    round((y - self.y0) / self.ky),
+                )
+            else:
+                point = (x, y)
+            if not points or points[-1] != point:
+                points.append(point)
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()
+        return points
+
+    def arc(self, arc):
+        if not self.quantization:
+            return [list(p) for p in arc]
+        encoded = [list(arc[0])]
+        for (x0, y0), (x1, y1) in zip(arc, arc[1:]):
+            encoded.append([x1 - x0, y1 - y0])
+        return encoded
+
+
+class _ArcIndex:
+    def __init__(self):
+        self.arcs = []
+        self.index = {}
+
+    def add(self, arc):
+        key = tuple(arc)
+        if key in self.index:
+            return self.index[key]
+        reverse = key[::-1]
+        if reverse in self.index:
+            return ~self.index[reverse]
+        self.index[key] = len(self.arcs)
+        self.arcs.append(arc)
+        return self.index[key]
+
+
+def _find_junctions(rings):
+    """
+    The positions where lines meet or part: positions that have different
+    neighbours in different places.
+    """
+    neighbours = {}
+    junctions = set()
+    for ring in rings:
+        n = len(ring)
+        for i, point in enumerate(ring):
+            before, after = ring[i - 1], ring[(i + 1) % n]
+            pair = (before, after) if before < after else (after, before)
+            seen = neighbours.setdefault(point, pair)
+            if seen != pair:
+                junctions.add(point)
+    return junctions
+
+
+def _rotate(ring, start):
+    return ring[start:] + ring[:start]
+
+
+def _ring_arcs(ring, junctions, arcs):
+    """
+    Cuts a ring at its junctions and returns the indices of its arcs.
+    """
+    cuts = [i for i, point in enumerate(ring) if point in junctions]
+    if not cuts:
+        # a ring that shares no junction is one closed arc; start it at its
+        # smallest position so that the same ring is found again, whichever
+        # way and from wherever it is walked
+        ring = _rotate(ring, ring.index(min(ring)))
+        return [arcs.add(ring + ring[:1])]
+    ring = _rotate(ring, cuts[0])
+    cuts = [i - cuts[0] for i in cuts] + [len(ring)]
+    closed = ring + ring[:1]
+    return [
+        arcs.add(closed[start : end + 1])
+        for start, end in zip(cuts, cuts[1:])
+    ]
+
+
+def build_topology(features, quantization=0, name=OBJECT_NAME):
+    """
+    Builds a TopoJSON topology from GeoJSON features (dicts with "geometry",
+    "properties" and optionally "id") with Polygon, MultiPolygon or null
+    geometries. The features are one GeometryCollection named name.
+    """
+    features = list(features)
+    points = [
+        p
+        for f in features
+        if f.get("geometry")
+        for polygon in _polygons(f["geometry"])
+        for ring in polygon
+        for p in ring
+    ]
+    if points:
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        bbox = [min(xs), min(ys), max(xs), max(ys)]
+    else:
+        bbox = [0, 0, 0, 0]
+    quantizer = _Quantizer(bbox, quantization)
+
+    # quantize first, so that positions that fall on the same grid cell are
+    # treated as shared
+    shapes = []
+    for feature in features:
+        polygons = []
+        if feature.get("geometry"):
+            for polygon in _polygons(feature["geometry"]):
+                rings = [quantizer.ring(ring) for ring in polygon]
+                # drop rings that collapsed to a line or a point, and the
+                # whole polygon if its exterior ring did
+                if rings and len(rings[0]) > 2:
+                    polygons.append([ring for ring in rings if len(ring) > 2])
+        shapes.append(polygons)
+
+    junctions = _find_junctions(
+        ring for polygons in shapes for rings in polygons for ring in rings
+    )
+    arcs = _ArcIndex()
+    geometries = []
+    for feature, polygons in zip(features, shapes):
+        polygon_arcs = [
+            [_ring_arcs(ring, junctions, arcs) for ring in rings]
+            for rings in polygons
+        ]
+        if not polygon_arcs:
+            geometry = {"type": None}
+        elif feature["geometry"]["type"] == "Polygon":
+            geometry = {"type": "Polygon", "arcs": polygon_arcs[0]}
+        else:
+            geometry = {"type": "MultiPolygon", "arcs": polygon_arcs}
+        if feature.get("id") is not None:
+            geometry["id"] = feature["id"]
+        if feature.get("properties"):
+            geometry["properties"] = feature["properties"]
+        geometries.append(geometry)
+
+    topology = {"type": "Topology", "bbox": bbox}
+    transform = quantizer.transform()
+    if transform:
+        topology["transform"] = transform
+    topology["objects"] = {
+        name: {"type": "GeometryCollection", "geometries": geometries}
+    }
+    topology["arcs"] = [quantizer.arc(arc) for arc in arcs.arcs]
+    return topology
+
+
+def topology_features(topology, name=OBJECT_NAME):
+    """
+    The GeoJSON features of a topology, the inverse of build_topology.
+    """
+    transform = topology.get("transform")
+    arcs = []
+    for arc in topology["arcs"]:
+        if transform:
+            (kx, ky), (dx, dy) = transform["scale"], transform["translate"]
+            x = y = 0
+            points = []
+            for qx, qy in arc:
+                x, y = x + qx, y + qy
+                points.append([x * kx + dx, y * ky + dy])
+        else:
+            points = [list(p) for p in arc]
+        arcs.append(points)
+
+    def ring(indices):
+        points = []
+        for index in indices:
+            arc = arcs[index] if index >= 0 else arcs[~index][::-1]
+            points.extend(arc[1:] if points else arc)
+        return points
+
+    features = []
+    for geometry in topology["objects"][name]["geometries"]:
+        feature = {
+            "type": "Feature",
+            "geometry": None,
+            "properties": geometry.get("properties", {}),
+        }
+        if geometry["type"] == "Polygon":
+            coordinates = [ring(r) for r in geometry["arcs"]]
+        elif geometry["type"] == "MultiPolygon":
+            coordinates = [[ring(r) for r in p] for p in geometry["arcs"]]
+        if geometry["type"]:
+            feature["geometry"] = {
+                "type": geometry["type"],
+                "coordinates": coordinates,
+            }
+        if "id" in geometry:
+            feature["id"] = geometry["id"]
+        features.append(feature)
+    return features
@@ -0,0 +1,254 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Census units (BlockGroup and CensusBlock rows) of submitted communities.
+
+The units of a state can be preloaded with the load_census_units command, so
+that submissions only read them. Each process keeps the census id -> pk
+mapping of the most recently used (state, year) catalogs in memory; the units
+that are not in the catalog, or were added since it was read, are looked up
+(and created if needed) in bulk and added to it.
+
+When their geometries are loaded too, the polygon of a community can be
+assembled from its census ids alone (see assemble_units).
+"""
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.gis.db.models import Union
+from django.contrib.gis.geos import (
+    GeometryCollection,
+    GEOSGeometry,
+    MultiPolygon,
+)
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.functions import Substr
+
+# the census ids of the units of a state start with its FIPS code
+STATE_FIPS = {
+    "AL": "01",
+    "AK": "02",
+    "AZ": "04",
+    "AR": "05",
+    "CA": "06",
+    "CO": "08",
+    "CT": "09",
+    "DE": "10",
+    "DC": "11",
+    "FL": "12",
+    "GA": "13",
+    "HI": "15",
+    "ID": "16",
+    "IL": "17",
+    "IN": "18",
+    "IA": "19",
+    "KS": "20",
+    "KY": "21",
+    "LA": "22",
+    "ME": "23",
+    "MD": "24",
+    "MA": "25",
+    "MI": "26",
+    "MN": "27",
+    "MS": "28",
+    "MO": "29",
+    "MT": "30",
+    "NE": "31",
+    "NV": "32",
+    "NH": "33",
+    "NJ": "34",
+    "NM": "35",
+    "NY": "36",
+    "NC": "37",
+    "ND": "38",
+    "OH": "39",
+    "OK": "40",
+    "OR": "41",
+    "PA": "42",
+    "RI": "44",
+    "SC": "45",
+    "SD": "46",
+    "TN": "47",
+    "TX": "48",
+    "UT": "49",
+    "VT": "50",
+    "VA": "51",
+    "WA": "53",
+    "WV": "54",
+    "WI": "55",
+    "WY": "56",
+    "PR": "72",
+}
+
+# block group and block ids start with the id of their tract
+TRACT_LENGTH = 11
+
+# states whose maps still use the 2010 units
+STATES_USING_OLD_UNITS = ("il", "ok")
+
+# bumped whenever load_census_units changes units, so that every process
+# reloads the tables it derived from them (see population.py)
+GENERATION_KEY = "census-units:generation"
+
+# unit geometries do not change within a census year
+UNION_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def unit_year(abbr):
+    """
+    The census year of the units of a state.
+    """
+    return 2010 if abbr.lower() in STATES_USING_OLD_UNITS else 2020
+
+
+def units_generation():
+    return cache.get(GENERATION_KEY, 0)
+
+
+def bump_units_generation():
+    cache.add(GENERATION_KEY, 0, None)
+    cache.incr(GENERATION_KEY)
+
+
+@lru_cache(maxsize=getattr(settings, "CENSUS_UNIT_CATALOG_SIZE", 4))
+def unit_catalog(model, fips, year):
+    """
+    The census id -> pk mapping of the BlockGroup or CensusBlock rows of a
+    state (by FIPS code) and year.
+    """
+    units = model.objects.filter(year=year, census_id__startswith=fips)
+    return dict(units.values_list("census_id", "id"))
+
+
+def _create_units(model, census_ids, year):
+    """
+    Returns the census id -> pk mapping of the given units, creating the
+    missing ones: one lookup, plus one insert and one lookup of the inserted
+    rows if some are new. The unique constraint on (census_id, year) makes
+    concurrent submissions of the same new units safe: the losing insert is
+    ignored and the rows are looked up.
+    """
+    ids = dict(
+        model.objects.filter(year=year, census_id__in=census_ids).values_list(
+            "census_id", "id"
+        )
+    )
+    missing = [c for c in census_ids if c not in ids]
+    if missing:
+        # ignore_conflicts leaves the new primary keys unset, so the new
+        # rows are looked up again
+        model.objects.bulk_create(
+            [model(census_id=c, year=year) for c in missing],
+            ignore_conflicts=True,
+        )
+        ids.update(
+            model.objects.filter(year=year, census_id__in=missing).values_list(
+                "census_id", "id"
+            )
+        )
+    return ids
+
+
+def resolve_units(model, census_ids, year):
+    """
+    Returns the ids of the BlockGroup or CensusBlock rows of the given census
+    ids and year, in the order of census_ids, creating the missing rows.
+    """
+    census_ids = list(dict.fromkeys(c for c in census_ids if c))
+    ids = {}
+    missing = {}
+    for census_id in census_ids:
+        catalog = unit_catalog(model, census_id[:2], year)
+        if census_id in catalog:
+            ids[census_id] = catalog[census_id]
+        else:
+            missing.setdefault(census_id[:2], []).append(census_id)
+    for fips, fips_ids in missing.items():
+        created = _create_units(model, fips_ids, year)
+        unit_catalog(model, fips, year).update(created)
+        ids.update(created)
+    return [ids[c] for c in census_ids]
+
+
+def _union_key(model, year, tract, census_ids):
+    digest = hashlib.sha1(",".join(sorted(census_ids)).encode()).hexdigest()
+    return "unit-union:%s:%d:%s:%s" % (
+        model._meta.model_name,
+        year,
+        tract,
+        digest,
+    )
+
+
+def assemble_units(model, census_ids, year):
+    """
+    Returns the union of the geometries of the BlockGroup or CensusBlock rows
+    of the given census ids and year as a MultiPolygon, or None if any of
+    them is missing or has no geometry.
+
+    The units are unioned by tract in the database, and the union of each
+    set of units of a tract is cached, so that whole tracts (and any other
+    set of units that comes up again) are only unioned once. The tract
+    unions are then unioned in one cascaded union.
+    """
+    groups = {}
+    for census_id in dict.fromkeys(c for c in census_ids if c):
+        groups.setdefault(census_id[:TRACT_LENGTH], []).append(census_id)
+    if not groups:
+        return None
+    keys = {
+        _union_key(model, year, tract, ids): tract
+        for tract, ids in groups.items()
+    }
+    cached = cache.get_many(list(keys))
+    # EWKB is cached rather than the geometries, which do not pickle
+    parts = [GEOSGeometry(memoryview(ewkb)) for ewkb in cached.values()]
+    missing = {tract: key for key, tract in keys.items() if key not in cached}
+    if missing:
+        rows = (
+            model.objects.filter(
+                year=year,
+                census_id__in=[c for t in missing for c in groups[t]],
+                geometry__isnull=False,
+            )
+            .annotate(tract=Substr("census_id", 1, TRACT_LENGTH))
+            .order_by()
+            .values("tract")
+            .annotate(union=Union("geometry"), count=Count("id"))
+        )
+        unions = {}
+        for row in rows:
+            if row["count"] != len(groups[row["tract"]]):
+                return None
+            unions[missing[row["tract"]]] = row["union"]
+        if len(unions) != len(missing):
+            return None
+        cache.set_many(
+            {key: bytes(union.ewkb) for key, union in unions.items()},
+            UNION_CACHE_TIMEOUT,
+        )
+        parts.extend(unions.values())
+
+    union = GeometryCollection(parts, srid=parts[0].srid).unary_union
+    if union.geom_type == "Polygon":
+        union = MultiPolygon(union, srid=union.srid)
+    return union
@@ -147,6 +147,21 @@ urlpatterns = [
         views.main.MultiExportView.as_view(),
         name="multi_export",
     ),
+    path(
+        "exportjobs/<int:pk>/",
+        views.main.ExportJobStatus.as_view(),
+        name="export_job",
+    ),
+    path(
+        "exportjobs/<int:pk>/download/",
+        views.main.ExportJobDownload.as_view(),
+        name="export_job_download",
+    ),
+    path(
+        "exportjobs/<abbr>/<type>/",
+        views.main.ExportJobStart.as_view(),
+        name="export_job_start",
+    ),
     path(
         "multiexport/drive/<drive>/<type>/",
         views.partners.MultiExportView.as_view(),
@@ -174,7 +189,30 @@ urlpatterns = [
         name="partner_turf",
     ),
     path("map/<state>/", views.main.Map.as_view(), name="map"),
+    path(
+        "map/<state>/data/", views.main.MapData.as_view(), name="map_data"
+    ),
     path("map/<state>/<lat>/<lng>", views.main.Map.as_view(), name="map"),
+    path(
+        "tiles/communities/<int:z>/<int:x>/<int:y>.mvt",
+        views.main.CommunityTiles.as_view(),
+        name="community_tiles",
+    ),
+    path(
+        "api/communities/",
+        views.main.CommunityBounds.as_view(),
+        name="community_bounds",
+    ),
+    path(
+        "api/population/<abbr>/",
+        views.main.UnitPopulation.as_view(),
+        name="unit_population",
+    ),
+    path(
+        "api/tags/",
+        views.main.TagSearch.as_view(),
+        name="tag_search",
+    ),
     path(
         "map/p/<slug:slug>/",
         views.partners.PartnerMap.as_view(),
@@ -251,6 +289,37 @@ urlpatterns = [
                     views.dashboard.CreateMember.as_view(),
                     name="create_member",
                 ),
+                path(
+                    "review/",
+                    views.dashboard.ReviewOrg.as_view(),
+                    {"drive": ""},
+                    name="review_org",
+                ),
+                path(
+                    "review/<slug:drive>/",
+                    views.dashboard.ReviewOrg.as_view(),
+                    name="review_org",
+                ),
+                path(
+                    "moderation/entries/",
+                    views.dashboard.ReviewQueue.as_view(),
+                    name="review_queue",
+                ),
+                path(
+                    "moderation/bulk/",
+                    views.dashboard.ReviewBulkAction.as_view(),
+                    name="review_bulk_action",
+                ),
+                path(
+                    "moderation/entries/<entry_ID>/",
+                    views.dashboard.ReviewAction.as_view(),
+                    name="review_action",
+                ),
+                path(
+                    "moderation/entries/<entry_ID>/geometry/",
+                    views.dashboard.ReviewGeometry.as_view(),
+                    name="review_geometry",
+                ),
                 path(
                     "drives/create/",
                     views.dashboard.CreateDrive.as_view(),
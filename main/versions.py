@@ -0,0 +1,115 @@
+#
+# Copyright (c) 2019- Representable Team (Theodor Marcu, Lauren Johnston, Somya Arora, Kyle Barnes, Preeti Iyer).
+#
+# This file is part of Representable
+# (see http://representable.org).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Per-scope version counters for the communities shown on maps.
+
+A scope is a state, an organization or a drive. Every write to a community
+bumps the versions of the scopes it belongs to (see signals.py), so caches of
+derived data only need to include the version in their keys.
+"""
+import threading
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import DataVersion
+
+# called with the set of bumped scopes after their versions changed
+_bump_listeners = []
+
+
+def state_scope(state_id):
+    return "state:%s" % state_id
+
+
+def org_scope(org_id):
+    return "org:%s" % org_id
+
+
+def drive_scope(drive_id):
+    return "drive:%s" % drive_id
+
+
+def entry_scopes(state_obj_id, organization_id, drive_id):
+    """
+    Returns the scopes a community with the given foreign keys belongs to.
+    """
+    scopes = set()
+    if state_obj_id is not None:
+        scopes.add(state_scope(state_obj_id))
+    if organization_id is not None:
+        scopes.add(org_scope(organization_id))
+    if drive_id is not None:
+        scopes.add(drive_scope(drive_id))
+    return scopes
+
+
+def get_version(scope):
+    return (
+        DataVersion.objects.filter(scope=scope)
+        .values_list("version", flat=True)
+        .first()
+        or 0
+    )
+
+
+def bump_versions(scopes):
+    """
+    Increments the versions of the given scopes, creating missing counters.
+    """
+    scopes = sorted(set(scopes))
+    if not scopes:
+        return
+    with transaction.atomic():
+        DataVersion.objects.bulk_create(
+            [DataVersion(scope=scope) for scope in scopes],
+            ignore_conflicts=True,
+        )
+        DataVersion.objects.filter(scope__in=scopes).update(
+            version=F("version") + 1
+        )
+    for listener in _bump_listeners:
+        listener(scopes)
+
+
+def on_bump(listener):
+    """
+    Registers a function to call with the list of scopes after every bump.
+    """
+    _bump_listeners.append(listener)
+    return listener
+
+
+_pending = threading.local()
+
+
+def schedule_bump(scopes):
+    """
+    Bumps the given scopes once the current transaction commits, once per
+    scope however many communities of the scope were written.
+    """
+    _pending.__dict__.setdefault("scopes", set()).update(scopes)
+    transaction.on_commit(_flush_pending)
+
+
+def _flush_pending():
+    scopes = _pending.__dict__.pop("scopes", None)
+    if scopes:
+        bump_versions(scopes)
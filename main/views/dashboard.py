@@ -17,7 +17,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.shortcuts import render, redirect
 from django.views.generic import (
     TemplateView,
@@ -28,6 +28,7 @@ from django.views.generic import (
     DeleteView,
 )
 from django.contrib import messages
+from django.db.models import Count, Exists, OuterRef, Q
 from django import forms
 from django.views import View
 from django.core.mail import send_mail
@@ -55,8 +56,12 @@ from ..models import (
     CommunityEntry,
     DriveToken,
     Address,
+    Report,
     User,
 )
+from ..display import MAP_ZOOM, defer_full_polygons, display_geojson
+from ..queries import review_entries
+from ..review import APPROVE, DELETE, MODERATION_ACTIONS, RESOLVE, moderate
 from django.shortcuts import get_object_or_404
 from django.views.generic.edit import FormView
 from django.urls import reverse, reverse_lazy
@@ -445,100 +450,219 @@ class AllowListDelete(LoginRequiredMixin, OrgAdminRequiredMixin, DeleteView):
 
 class ReviewOrg(LoginRequiredMixin, OrgAdminRequiredMixin, TemplateView):
     """
-    Page for organization to review submissions
+    Page for organization to review submissions. The submissions are loaded
+    page by page from ReviewQueue and moderated through ReviewAction.
     """
 
     template_name = "main/dashboard/partners/review.html"
-    form_class = DeletionForm
-    initial = {"key": "value"}
-
-    # https://www.agiliq.com/blog/2019/01/django-formview/
-    def get_initial(self):
-        initial = self.initial
-        if self.request.user.is_authenticated:
-            initial.update({"user": self.request.user})
-        return initial
 
     def get_context_data(self, **kwargs):
-        form = self.form_class(initial=self.get_initial(), label_suffix="")
+        context = super().get_context_data(**kwargs)
+        org = get_object_or_404(Organization, pk=self.kwargs["pk"])
+        url_kwargs = org.get_url_kwargs()
+        # the review page fills in the entry_ID of the per-entry urls
+        entry_kwargs = dict(url_kwargs, entry_ID="__entry__")
+        context["organization"] = org
+        context["state"] = org.states[0] if org.states else ""
+        context["drive"] = None
+        context["queue_url"] = reverse("main:review_queue", kwargs=url_kwargs)
+        context["bulk_url"] = reverse(
+            "main:review_bulk_action", kwargs=url_kwargs
+        )
+        context["action_url"] = reverse(
+            "main:review_action", kwargs=entry_kwargs
+        )
+        context["geometry_url"] = reverse(
+            "main:review_geometry", kwargs=entry_kwargs
+        )
+        if self.kwargs["drive"]:
+            drive = get_object_or_404(
+                Drive, slug=self.kwargs["drive"], organization=org
+            )
+            context["drive"] = drive.name
+            context["drive_slug"] = drive.slug
+        context["mapbox_key"] = os.environ.get("DISTR_MAPBOX_KEY")
+        context["mapbox_user_name"] = os.environ.get("MAPBOX_USER_NAME")
+        return context
 
-        # the polygon coordinates
-        entryPolyDict = {}
 
-        # approved list of communities
-        approvedList = []
+REVIEW_STATUSES = ("pending", "approved", "reported")
 
-        # list of addresses
-        streets = {}
-        cities = {}
 
-        if self.kwargs["drive"]:
-            query = CommunityEntry.objects.filter(
-                organization__pk=self.kwargs["pk"],
-                drive__slug=self.kwargs["drive"],
-            )
-        else:
-            query = CommunityEntry.objects.filter(
-                organization__pk=self.kwargs["pk"]
+def review_queryset(org_pk, drive_slug=""):
+    query = CommunityEntry.objects.filter(organization__pk=org_pk)
+    if drive_slug:
+        query = query.filter(drive__slug=drive_slug)
+    return query
+
+
+def filter_review_status(query, status):
+    if status == "pending":
+        return query.filter(admin_approved=False)
+    if status == "approved":
+        return query.filter(admin_approved=True)
+    if status == "reported":
+        return query.filter(
+            Exists(
+                Report.objects.filter(community=OuterRef("pk"), resolved=False)
             )
+        )
+    return query
 
-        for obj in query:
-            for a in Address.objects.filter(entry=obj):
-                streets[obj.entry_ID] = a.street
-                cities[obj.entry_ID] = (
-                    a.city + ", " + a.state + " " + a.zipcode
-                )
 
-            if not obj.census_blocks_polygon:
-                s = "".join(obj.user_polygon.geojson)
-            else:
-                s = "".join(obj.census_blocks_polygon.geojson)
-            struct = geojson.loads(s)
-            entryPolyDict[obj.entry_ID] = struct.coordinates
-            if obj.admin_approved:
-                # this is for coloring the map properly
-                approvedList.append(obj.entry_ID)
-        context = {
-            "streets": streets,
-            "cities": cities,
-            "form": form,
-            "entries": json.dumps(entryPolyDict),
-            "approved": json.dumps(approvedList),
-            "communities": query,
-            "mapbox_key": os.environ.get("DISTR_MAPBOX_KEY"),
-            "mapbox_user_name": os.environ.get("MAPBOX_USER_NAME"),
+def review_counts(query):
+    """
+    The number of submissions of each moderation status.
+    """
+    return query.aggregate(
+        pending=Count("pk", filter=Q(admin_approved=False), distinct=True),
+        approved=Count("pk", filter=Q(admin_approved=True), distinct=True),
+        reported=Count(
+            "pk", filter=Q(reports__resolved=False), distinct=True
+        ),
+    )
+
+
+def review_record(entry):
+    addresses = [
+        ", ".join(
+            part
+            for part in (a.street, a.city, ("%s %s" % (a.state, a.zipcode)))
+            if part.strip()
+        )
+        for a in entry.address_set.all()
+    ]
+    return {
+        "entry_ID": entry.entry_ID,
+        "entry_name": entry.entry_name,
+        "author": entry.user_name or entry.username,
+        "address": addresses[-1] if addresses else "",
+        "drive": entry.drive_name,
+        "created_at": entry.created_at,
+        "admin_approved": entry.admin_approved,
+        "private": entry.private,
+        "reports": entry.open_reports,
+        "components": entry.unit_components,
+        "holes": entry.unit_holes,
+        "cultural_interests": entry.cultural_interests,
+        "comm_activities": entry.comm_activities,
+        "economic_interests": entry.economic_interests,
+        "other_considerations": entry.other_considerations,
+    }
+
+
+class ReviewQueue(LoginRequiredMixin, OrgAdminRequiredMixin, View):
+    """
+    The submissions of an organization, newest first, as JSON pages of
+    {"results": [...], "next": id|None}. Query parameters:
+     - drive: drive slug
+     - status: pending, approved or reported
+     - after, limit: keyset pagination, pass the previous page's "next"
+    The first page also has the "counts" of each status.
+    """
+
+    default_limit = 25
+    max_limit = 100
+
+    def get(self, request, **kwargs):
+        status = request.GET.get("status", "")
+        try:
+            after = int(request.GET["after"]) if "after" in request.GET else 0
+            limit = min(
+                int(request.GET.get("limit", self.default_limit)),
+                self.max_limit,
+            )
+        except ValueError:
+            return JsonResponse({"error": "invalid page"}, status=400)
+        if (status and status not in REVIEW_STATUSES) or limit < 1:
+            return JsonResponse({"error": "invalid status"}, status=400)
+
+        query = review_queryset(kwargs["pk"], request.GET.get("drive", ""))
+        page = filter_review_status(query, status)
+        if after:
+            page = page.filter(id__lt=after)
+        # one extra row tells whether there is a next page
+        entries = list(review_entries(page).order_by("-id")[: limit + 1])
+        data = {
+            "results": [review_record(entry) for entry in entries[:limit]],
+            "next": entries[limit - 1].id if len(entries) > limit else None,
         }
-        org = Organization.objects.get(slug=self.kwargs["slug"])
-        context["organization"] = org
-        context["state"] = org.states[0]
-        if self.kwargs["drive"]:
-            context["drive"] = get_object_or_404(
-                Drive, slug=self.kwargs["drive"]
-            ).name
-        return context
+        if not after:
+            data["counts"] = review_counts(query)
+        return JsonResponse(data)
+
+
+class ReviewGeometry(LoginRequiredMixin, OrgAdminRequiredMixin, View):
+    """
+    The display geometry of one submission, fetched by the review page when
+    the submission is shown.
+    """
+
+    def get(self, request, entry_ID, **kwargs):
+        query = defer_full_polygons(review_queryset(kwargs["pk"]), MAP_ZOOM)
+        entry = get_object_or_404(query, entry_ID=entry_ID)
+        s = display_geojson(entry, MAP_ZOOM)
+        return JsonResponse(
+            {
+                "entry_ID": entry.entry_ID,
+                "geometry": json.loads(s) if s is not None else None,
+            }
+        )
 
-    def post(self, request, *args, **kwargs):
-        form = self.form_class(request.POST, label_suffix="")
 
-        if form.is_valid():
-            query = CommunityEntry.objects.filter(
-                entry_ID=request.POST.get("c_id")
+class ReviewAction(LoginRequiredMixin, OrgAdminRequiredMixin, View):
+    """
+    Approves, unapproves, deletes or resolves the reports of a submission
+    (POST action=approve|unapprove|delete|resolve). Returns what changed and
+    the new status counts, instead of the whole review page.
+    """
+
+    def post(self, request, entry_ID, **kwargs):
+        action = request.POST.get("action")
+        if action not in MODERATION_ACTIONS:
+            return JsonResponse({"error": "invalid action"}, status=400)
+        query = review_queryset(kwargs["pk"]).filter(entry_ID=entry_ID)
+        if not moderate(query, action):
+            raise Http404
+        data = {"entry_ID": entry_ID, "action": action}
+        if action == DELETE:
+            data["deleted"] = True
+        elif action == RESOLVE:
+            data["reports"] = 0
+        else:
+            data["admin_approved"] = action == APPROVE
+        data["counts"] = review_counts(
+            review_queryset(kwargs["pk"], request.POST.get("drive", ""))
+        )
+        return JsonResponse(data)
+
+
+class ReviewBulkAction(LoginRequiredMixin, OrgAdminRequiredMixin, View):
+    """
+    Applies a moderation action to many submissions at once: the entry_IDs
+    posted as "entries", or with all=1 every submission matching the drive
+    and status filters of the queue. Returns the number of submissions
+    moderated and the new status counts.
+    """
+
+    def post(self, request, **kwargs):
+        action = request.POST.get("action")
+        status = request.POST.get("status", "")
+        if action not in MODERATION_ACTIONS or (
+            status and status not in REVIEW_STATUSES
+        ):
+            return JsonResponse({"error": "invalid action"}, status=400)
+        query = review_queryset(kwargs["pk"], request.POST.get("drive", ""))
+        if request.POST.get("all"):
+            selected = filter_review_status(query, status)
+        else:
+            selected = query.filter(
+                entry_ID__in=request.POST.getlist("entries")
             )
-            entry = query[0]
-            if (
-                "Approve" in request.POST
-            ):  # TODO need someone to review security
-                entry.admin_approved = True
-                entry.save()
-            elif "Unapprove" in request.POST:
-                entry.admin_approved = False
-                entry.save()
-            elif "Delete" in request.POST:
-                entry.delete()
-        context = (
-            self.get_context_data()
-        )  # TODO: Is there a problem with this?
-        return render(request, self.template_name, context)
+        count = moderate(selected, action)
+        return JsonResponse(
+            {"action": action, "count": count, "counts": review_counts(query)}
+        )
 
 
 class DriveHome(LoginRequiredMixin, OrgAdminRequiredMixin, DetailView):
@@ -24,13 +24,16 @@ import zipfile
 from urllib.request import urlopen
 from django.contrib import messages
 from django.http import (
+    FileResponse,
     HttpResponse,
     HttpResponseNotFound,
     HttpResponseRedirect,
+    HttpResponseNotModified,
     JsonResponse,
     Http404,
 )
-from django.shortcuts import render, redirect
+from django.shortcuts import get_object_or_404, render, redirect
+from django.utils.cache import patch_cache_control
 from django.views.generic import (
     TemplateView,
     ListView,
@@ -39,6 +42,8 @@ from django.views.generic import (
     DetailView,
 )
 from django.views import View
+from django.db import transaction
+from django.db.models import Q
 from django.contrib.auth.mixins import (
     LoginRequiredMixin,
     UserPassesTestMixin,
@@ -50,6 +55,7 @@ from allauth.account.models import (
     EmailAddress,
     EmailConfirmationHMAC,
 )
+from django.core.files.storage import default_storage
 from django.core.mail import send_mail
 from django.core.mail import EmailMultiAlternatives
 from django.core.mail import EmailMessage
@@ -79,11 +85,59 @@ from ..models import (
     Signature,
     BlockGroup,
     CensusBlock,
+    ExportJob,
     Report,
 )
 from ..admin import (
     ReportAdmin,
 )
+from ..encoding import (
+    encode_entries,
+    encode_records,
+    page_encoding,
+    parse_encoding,
+)
+from ..topojson import build_topology, parse_quantization
+from ..pipeline import enqueue_submission
+from ..export_jobs import (
+    CONTENT_TYPES,
+    job_filename,
+    job_path,
+    job_status,
+    start_export,
+)
+from ..adjacency import analyze_units
+from ..exports import (
+    BULK_FORMATS,
+    PUBLIC,
+    TESTIMONY_COLUMNS,
+    block_equivalency,
+    bulk_export,
+    export_artifact,
+    export_response,
+    feature_collection,
+    iter_features,
+    readme_path,
+    state_map_feature,
+    zip_stream,
+)
+from ..population import sum_population
+from ..profiles import can_enter, drive_profile, state_profile
+from ..units import assemble_units, resolve_units, unit_year
+from ..snapshots import (
+    build_entry_record,
+    get_state_map_payload,
+    public_map_entries,
+)
+from ..display import (
+    DETAIL_ZOOM,
+    DERIVED_FIELDS,
+    MAP_ZOOM,
+    defer_full_polygons,
+    display_geojson,
+)
+from .. import tags, tiles
+from ..versions import drive_scope, get_version, org_scope, state_scope
 from django.utils.html import format_html
 from ..choices import STATES
 from django.views.generic.edit import FormView
@@ -115,7 +169,6 @@ import base64
 from django.template import loader
 import shapely.wkt
 import reverse_geocoder as rg
-from taggit.models import Tag
 from state_abbrev import us_state_abbrev
 from django.contrib.auth.models import Group
 from itertools import islice
@@ -139,7 +192,6 @@ from django.contrib.gis.geos import GEOSGeometry
 
 # ******************************************************************************#
 
-from googleapiclient import discovery
 
 def block_group_polygons(request, abbr):
     try:
@@ -390,20 +442,15 @@ class Review(LoginRequiredMixin, TemplateView):
         user = self.request.user
         approvedList = list()
         # in this case, just get the ones we made
-        query = CommunityEntry.objects.filter(user=user)
+        query = defer_full_polygons(
+            CommunityEntry.objects.filter(user=user), DETAIL_ZOOM
+        )
         comms = []
         # the polygon coordinates
         entryPolyDict = dict()
         for obj in query:
-            if (
-                obj.census_blocks_polygon == ""
-                or obj.census_blocks_polygon is None
-                and obj.user_polygon
-            ):
-                s = "".join(obj.user_polygon.geojson)
-            elif obj.census_blocks_polygon:
-                s = "".join(obj.census_blocks_polygon.geojson)
-            else:
+            s = display_geojson(obj, DETAIL_ZOOM)
+            if s is None:
                 continue
             comms.append(obj)
             struct = geojson.loads(s)
@@ -563,7 +610,10 @@ class Submission(View):
         m_uuid = str(self.kwargs["map_id"])
         if not m_uuid:
             raise Http404
-        query = CommunityEntry.objects.filter(entry_ID__startswith=m_uuid)
+        query = defer_full_polygons(
+            CommunityEntry.objects.filter(entry_ID__startswith=m_uuid),
+            DETAIL_ZOOM,
+        )
         if not query:
             raise Http404
 
@@ -588,15 +638,8 @@ class Submission(View):
 
         entryPolyDict = {}
 
-        if (
-            user_map.census_blocks_polygon == ""
-            or user_map.census_blocks_polygon is None
-            and user_map.user_polygon
-        ):
-            s = "".join(user_map.user_polygon.geojson)
-        elif user_map.census_blocks_polygon:
-            s = "".join(user_map.census_blocks_polygon.geojson)
-        else:
+        s = display_geojson(user_map, DETAIL_ZOOM)
+        if s is None:
             raise Http404
         map_poly = geojson.loads(s)
         entryPolyDict[m_uuid] = map_poly.coordinates
@@ -614,7 +657,10 @@ class Submission(View):
             "has_state": has_state,
             "state": state,
             "c": comm,
-            "entries": json.dumps(entryPolyDict),
+            "entries": json.dumps(
+                encode_entries(entryPolyDict, page_encoding())
+            ),
+            "geometry_encoding": page_encoding(),
             "mapbox_key": os.environ.get("DISTR_MAPBOX_KEY"),
             "mapbox_user_name": os.environ.get("MAPBOX_USER_NAME"),
             "map_id": m_uuid,
@@ -746,11 +792,11 @@ def make_geojson(request, entry):
     # iterate over block_groups or census_blocks in order to get array of IDs
     if user_map.block_groups.exists():
         gj["features"][0]["properties"]["block_group_ids"] = [
-            bg.census_id for bg in user_map.block_groups.all()
+            bg.census_id for bg in user_map.block_groups.only("census_id")
         ]
     elif user_map.census_blocks.exists():
         gj["features"][0]["properties"]["census_block_ids"] = [
-            block.census_id for block in user_map.census_blocks.all()
+            block.census_id for block in user_map.census_blocks.only("census_id")
         ]
     # include organization and drive submitted to, if so
     if user_map.organization:
@@ -777,59 +823,7 @@ def make_geojson(request, entry):
 
 # make geojson for state map pages
 def make_geojson_for_state_map_page(request, entry):
-    map_geojson = serialize(
-        "geojson",
-        [entry],
-        geometry_field="census_blocks_polygon",
-        fields=(
-            "entry_name",
-            "entry_ID",
-            "cultural_interests",
-            "economic_interests",
-            "comm_activities",
-            "other_considerations",
-            "custom_response",
-            "population",
-        ),
-    )
-    gj = geojson.loads(map_geojson)
-    gj = rewind(gj)
-    del gj["crs"]
-    user_map = entry
-    # iterate over block_groups or census_blocks in order to get array of IDs
-    if user_map.block_groups.exists():
-        gj["features"][0]["properties"]["block_group_ids"] = [
-            bg.census_id for bg in user_map.block_groups.all()
-        ]
-    elif user_map.census_blocks.exists():
-        gj["features"][0]["properties"]["census_block_ids"] = [
-            block.census_id for block in user_map.census_blocks.all()
-        ]
-    # include address if user is authenticated + either author or org admin
-    if request.user.is_authenticated:
-        is_org_leader = user_map.organization and (
-            request.user.is_org_admin(user_map.organization_id)
-        )
-        if is_org_leader or request.user == user_map.user:
-            gj["features"][0]["properties"]["author_name"] = user_map.user_name
-            for a in Address.objects.filter(entry=user_map):
-                addy = (
-                    a.street + " " + a.city + ", " + a.state + " " + a.zipcode
-                )
-                gj["features"][0]["properties"]["address"] = addy
-        else:
-            gj["features"][0]["properties"]["author_name"] = ""
-            gj["features"][0]["properties"]["address"] = ""
-    # include organization and drive submitted to, if so
-    if user_map.organization:
-        gj["features"][0]["properties"][
-            "organization"
-        ] = user_map.organization.name
-    if user_map.drive:
-        gj["features"][0]["properties"]["drive"] = user_map.drive.name
-
-    feature = gj["features"][0]
-    return feature
+    return state_map_feature(entry, request.user)
 
 
 # ******************************************************************************#
@@ -903,61 +897,18 @@ class Map(TemplateView):
         if not state:
             raise Http404
 
-        # the polygon coordinates
-        entryPolyDict = dict()
-        # the size of each polygon in number of block groups or census blocks
-        numBlock = dict()
-        numBG = dict()
         try:
             state_obj = State.objects.get(abbr=state.upper())
         except:
             raise Http404
-        query = (
-            state_obj.submissions.all()
-            .defer("census_blocks_polygon_array", "user_polygon")
-            .prefetch_related("organization", "drive")
-            .order_by("-created_at")
-        )
-        # state map page --> drives in the state, entries without a drive but with a state
-        drives = []
-        authenticated = self.request.user.is_authenticated
-        # get the polygon from db and pass it on to html
-        for obj in query:
-            if obj.private or (not obj.admin_approved):
-                continue
-            if (
-                obj.census_blocks_polygon == ""
-                or obj.census_blocks_polygon is None
-                and obj.user_polygon
-            ):
-                s = "".join(obj.user_polygon.geojson)
-            elif obj.census_blocks_polygon:
-                s = "".join(obj.census_blocks_polygon.geojson)
-            else:
-                continue
-            drives.append(obj.drive)
-
-            # add all the coordinates in the array
-            # at this point all the elements of the array are coordinates of the polygons
-            struct = geojson.loads(s)
-            entryPolyDict[obj.entry_ID] = struct.coordinates
-
-            numBG[obj.entry_ID] = len(obj.block_groups.all())
-            numBlock[obj.entry_ID] = len(obj.census_blocks.all())
-
-            export_name = state_obj.name.replace(" ", "_") + "_communities"
-
-        comms_counter = query.filter(admin_approved=True, private=False).count()
 
+        # the communities themselves are fetched from MapData
         context = {
             "state": state,
             "state_name": state_obj.name,
-            "communities": query,
-            "comms_counter": comms_counter,
-            "drives": drives,
-            "entries": json.dumps(entryPolyDict),
-            "numBlock": numBlock,
-            "numBG": numBG,
+            "map_data_url": reverse("main:map_data", kwargs={"state": state}),
+            "geometry_encoding": page_encoding(),
+            "tiles_url": "/tiles/communities/{z}/{x}/{y}.mvt?state=" + state,
             "mapbox_key": os.environ.get("DISTR_MAPBOX_KEY"),
             "mapbox_user_name": os.environ.get("MAPBOX_USER_NAME"),
         }
@@ -984,8 +935,232 @@ class Map(TemplateView):
                 return redirect("/map/" + self.kwargs["state"])
 
         context["multi_export_link"] = f"/multiexport/{state}"
+        # the exports of the largest states are built in the background
+        if state_obj.submissions.count() > settings.EXPORT_JOB_THRESHOLD:
+            context["export_job_link"] = f"/exportjobs/{state}"
         return render(request, self.template_name, context)
 
+
+class MapData(View):
+    """
+    The public communities of a state map, served from the state's snapshot.
+    Query parameters:
+     - encoding: compact coordinate encoding, e.g. polyline6
+     - format=topojson: the communities as a TopoJSON topology, quantized
+       with ?quantization= (default: settings.TOPOJSON_QUANTIZATION)
+    """
+
+    def get(self, request, state, **kwargs):
+        try:
+            state_obj = State.objects.get(abbr=state.upper())
+        except State.DoesNotExist:
+            raise Http404
+        encoding = request.GET.get("encoding", "")
+        quantization = None
+        try:
+            if request.GET.get("format") == "topojson":
+                quantization = parse_quantization(
+                    request.GET.get("quantization")
+                )
+                encoding = ""
+                variant = "topojson%d" % quantization
+            else:
+                parse_encoding(encoding)
+                variant = encoding
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        version, payload = get_state_map_payload(
+            state_obj, encoding, quantization
+        )
+        etag = '"%s-%d%s"' % (state_obj.abbr, version, variant)
+        if etag in request.META.get("HTTP_IF_NONE_MATCH", ""):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(payload, content_type="application/json")
+        response["ETag"] = etag
+        patch_cache_control(response, public=True, max_age=60)
+        return response
+
+
+class CommunityTiles(View):
+    """
+    Vector tiles of the communities of one state (?state=<abbr>),
+    organization (?org=<slug>) or drive (?drive=<slug>).
+    """
+
+    def get(self, request, z, x, y, **kwargs):
+        if not tiles.is_valid_tile(z, x, y):
+            raise Http404
+
+        audience = tiles.PUBLIC
+        if "state" in request.GET:
+            state_obj = get_object_or_404(
+                State, abbr=request.GET["state"].upper()
+            )
+            scope = state_scope(state_obj.id)
+            filters = {"state": state_obj}
+            org_id = None
+        elif "org" in request.GET:
+            org = get_object_or_404(Organization, slug=request.GET["org"])
+            scope = org_scope(org.id)
+            filters = {"organization": org}
+            org_id = org.id
+        elif "drive" in request.GET:
+            drive = get_object_or_404(Drive, slug=request.GET["drive"])
+            scope = drive_scope(drive.id)
+            filters = {"drive": drive}
+            org_id = drive.organization_id
+        else:
+            raise Http404
+
+        if (
+            org_id is not None
+            and request.user.is_authenticated
+            and request.user.is_org_admin(org_id)
+        ):
+            audience = tiles.ADMIN
+
+        version = get_version(scope)
+        etag = '"%s-%s-%d"' % (scope, audience, version)
+        if etag in request.META.get("HTTP_IF_NONE_MATCH", ""):
+            response = HttpResponseNotModified()
+        else:
+            tile = tiles.get_tile(
+                scope,
+                version,
+                audience,
+                tiles.scope_entries(audience=audience, **filters),
+                z,
+                x,
+                y,
+            )
+            response = HttpResponse(
+                tile, content_type="application/vnd.mapbox-vector-tile"
+            )
+        response["ETag"] = etag
+        if audience == tiles.PUBLIC:
+            patch_cache_control(response, public=True, max_age=60)
+        else:
+            patch_cache_control(response, private=True, max_age=0)
+        return response
+
+
+class CommunityBounds(View):
+    """
+    The public communities intersecting a bounding box, for maps that load
+    communities as the user pans. Query parameters:
+     - bbox: west,south,east,north in degrees (required)
+     - state, org, drive: state abbreviation, organization or drive slug
+     - tag: tag name
+     - zoom: picks the display polygons (default: the map pages' zoom)
+     - encoding: compact coordinate encoding, e.g. polyline6
+     - after, limit: keyset pagination, pass the previous page's "next"
+    """
+
+    default_limit = 100
+    max_limit = 500
+
+    def get(self, request, **kwargs):
+        try:
+            west, south, east, north = [
+                float(c) for c in request.GET["bbox"].split(",")
+            ]
+            zoom = int(request.GET.get("zoom", MAP_ZOOM))
+            after = int(request.GET.get("after", 0))
+            limit = min(
+                int(request.GET.get("limit", self.default_limit)),
+                self.max_limit,
+            )
+        except (KeyError, ValueError):
+            return JsonResponse(
+                {"error": "bbox=west,south,east,north is required"},
+                status=400,
+            )
+        if not (west < east and south < north and limit > 0):
+            return JsonResponse({"error": "invalid bbox"}, status=400)
+        encoding = request.GET.get("encoding", "")
+        try:
+            parse_encoding(encoding)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        query = CommunityEntry.objects.filter(
+            planar_polygon__intersects=Polygon.from_bbox(
+                (west, south, east, north)
+            ),
+            id__gt=after,
+        )
+        if "state" in request.GET:
+            query = query.filter(state_obj__abbr=request.GET["state"].upper())
+        if "org" in request.GET:
+            query = query.filter(organization__slug=request.GET["org"])
+        if "drive" in request.GET:
+            query = query.filter(drive__slug=request.GET["drive"])
+        if "tag" in request.GET:
+            query = query.filter(tags__name=request.GET["tag"])
+
+        # one extra row tells whether there is a next page
+        entries = list(
+            public_map_entries(query, zoom).order_by("id")[: limit + 1]
+        )
+        results = []
+        for entry in entries[:limit]:
+            record = build_entry_record(entry)
+            if record is not None:
+                record["entry_ID"] = entry.entry_ID
+                results.append(record)
+        encode_records(results, encoding)
+        return JsonResponse(
+            {
+                "results": results,
+                "next": entries[limit - 1].id if len(entries) > limit else None,
+            }
+        )
+
+
+class UnitPopulation(View):
+    """
+    The total population of a set of block groups or census blocks of a
+    state, for the entry page. POST parameters:
+     - units: comma-separated census ids, all block groups or all blocks
+    Returns the population and the number of units whose population is
+    unknown.
+    """
+
+    max_units = 10002
+
+    def post(self, request, abbr, **kwargs):
+        units = [c for c in request.POST.get("units", "").split(",") if c]
+        if len(units) > self.max_units:
+            return JsonResponse({"error": "too many units"}, status=400)
+        if len({len(c) for c in units}) > 1:
+            return JsonResponse(
+                {"error": "units must be all block groups or all blocks"},
+                status=400,
+            )
+        model = CensusBlock if units and len(units[0]) == 15 else BlockGroup
+        population, missing = sum_population(model, units, unit_year(abbr))
+        return JsonResponse({"population": population, "missing": missing})
+
+
+class TagSearch(View):
+    """
+    Tag suggestions for the entry page typeahead. GET parameters:
+     - q: the beginning of the tag name
+     - limit: how many tags to return (default 10, at most 50)
+    Returns the matching tags, most used first.
+    """
+
+    def get(self, request, **kwargs):
+        try:
+            limit = int(request.GET.get("limit", 10))
+        except ValueError:
+            return JsonResponse({"error": "invalid limit"}, status=400)
+        return JsonResponse(
+            {"results": tags.search_tags(request.GET.get("q", ""), limit)}
+        )
+
+
 # ******************************************************************************#
 
 
@@ -1007,50 +1182,6 @@ def s3_geojson_export(s3response, query, request):
     return gj
 
 
-def make_geojson_for_s3(entry):
-    map_geojson = serialize(
-        "geojson",
-        [entry],
-        geometry_field="census_blocks_polygon",
-        fields=(
-            "entry_name",
-            "entry_ID",
-            "cultural_interests",
-            "economic_interests",
-            "comm_activities",
-            "other_considerations",
-            "custom_response",
-            "population",
-        ),
-    )
-    gj = geojson.loads(map_geojson)
-    gj = rewind(gj)
-    del gj["crs"]
-    user_map = entry
-    # # iterate over block_groups or census_blocks in order to get array of IDs
-    # if user_map.block_groups.exists():
-    #     gj["features"][0]["properties"]["block_group_ids"] = [bg.census_id for bg in user_map.block_groups.all()]
-    # elif user_map.census_blocks.exists():
-    #     gj["features"][0]["properties"]["census_block_ids"] = [block.census_id for block in user_map.census_blocks.all()]
-    # # include organization and drive submitted to, if so
-    if user_map.organization:
-        gj["features"][0]["properties"][
-            "organization"
-        ] = user_map.organization.name
-    else:
-        gj["features"][0]["properties"]["organization"] = ""
-    if user_map.drive:
-        gj["features"][0]["properties"]["drive"] = user_map.drive.name
-    else:
-        gj["features"][0]["properties"]["drive"] = ""
-    if user_map.state:
-        gj["features"][0]["properties"]["state"] = user_map.state
-    else:
-        gj["features"][0]["properties"]["state"] = ""
-    feature = gj["features"][0]
-    return feature
-
-
 class EntryView(LoginRequiredMixin, View):
     """
     EntryView displays the form and map selection screen.
@@ -1093,17 +1224,10 @@ class EntryView(LoginRequiredMixin, View):
         if kwargs["token"]:
             has_token = True
 
-        # all tags already in db for tagging typeahead
-        # also the top 15 tags as options to select
-        all_tags = Tag.objects.all()
-        tags_arr_unsort = []
-        for i, c in enumerate(all_tags):
-            tags_arr_unsort.append({"value": c.id, "text": c.name})
-        tags_arr = sorted(tags_arr_unsort, key=lambda k: k['text'].lower())
-        top_tags_query = CommunityEntry.tags.most_common()[:15]
-        top_tags = dict()
-        for i, c in enumerate(top_tags_query):
-            top_tags[c.id] = c.name
+        # the most used tags as options to select, the others are
+        # searched by the typeahead and the "more tags" modal
+        top_tags = tags.top_tags(15)
+        modal_tags = tags.top_tags(tags.MAX_RESULTS)
 
         address_required = True
         has_drive = False
@@ -1123,41 +1247,34 @@ class EntryView(LoginRequiredMixin, View):
         if kwargs["drive"]:
             has_drive = True
             drive_slug = self.kwargs["drive"]
-            try:
-                drive = Drive.objects.get(slug=drive_slug)
-            except:
+            drive = drive_profile(drive_slug)
+            if drive is None:
                 raise Http404
-            if abbr.upper() != drive.state:
+            if abbr.upper() != drive["state"]:
                 return redirect(
-                    "/entry/drive/" + drive.slug + "/" + drive.state.lower()
+                    "/entry/drive/"
+                    + drive["slug"]
+                    + "/"
+                    + drive["state"].lower()
                 )
-
-            drive_name = drive.name
-            drive_id = drive.id
-            drive_custom_question = drive.custom_question
-            drive_custom_question_example = drive.custom_question_example
-            drive_draw_layer = drive.draw_layer
-            drive_flytox = drive.flytox
-            drive_flytoy = drive.flytoy
-            organization = drive.organization
-            organization_name = organization.name
-            organization_id = organization.id
-            org_admin = self.request.user.is_org_admin(drive.organization.id)
-            on_allowlist = False
-            allowlist_q = AllowList.objects.filter(
-                organization=drive.organization.id,
-                email=self.request.user.email,
-            )
-            if allowlist_q:
-                on_allowlist = True
-            if drive.private and not (org_admin or on_allowlist):
+            if not can_enter(self.request.user, drive):
                 # if someone somehow gets the URL for a private drive,
                 # redirect them if they're not an org admin or on the allowlist
                 return redirect(reverse_lazy("main:entry"))
-            address_required = drive.require_user_addresses
-            drive_units = drive.units
-            coi_title = drive.opt_coi_def_title
-            coi_def = drive.opt_coi_def_info
+
+            drive_name = drive["name"]
+            drive_id = drive["id"]
+            drive_custom_question = drive["custom_question"]
+            drive_custom_question_example = drive["custom_question_example"]
+            drive_draw_layer = drive["draw_layer"]
+            drive_flytox = drive["flytox"]
+            drive_flytoy = drive["flytoy"]
+            organization_name = drive["organization_name"]
+            organization_id = drive["organization_id"]
+            address_required = drive["require_user_addresses"]
+            drive_units = drive["units"]
+            coi_title = drive["opt_coi_def_title"]
+            coi_def = drive["opt_coi_def_info"]
 
         context = {
             "comm_form": comm_form,
@@ -1167,6 +1284,12 @@ class EntryView(LoginRequiredMixin, View):
             "recaptcha_public": settings.RECAPTCHA_PUBLIC,
             "check_captcha": settings.CHECK_CAPTCHA_SUBMIT,
             "census_key": os.environ.get("CENSUS_API_KEY"),
+            "submit_unit_ids": getattr(settings, "SUBMIT_UNIT_IDS", False),
+            "population_url": reverse(
+                "main:unit_population", kwargs={"abbr": abbr}
+            )
+            if abbr
+            else "",
             "has_token": has_token,
             "has_drive": has_drive,
             "organization_name": organization_name,
@@ -1184,75 +1307,103 @@ class EntryView(LoginRequiredMixin, View):
             "drive_units": drive_units,
             "coi_title": coi_title,
             "coi_def": coi_def,
-            "state_obj": State.objects.get(abbr=abbr.upper()),
+            "state_obj": state_profile(abbr),
             "page_type": "entry",  # For the base template to check and remove footer
-            "tags": tags_arr,
             "top_tags": top_tags,
+            "modal_tags": modal_tags,
+            "tag_search_url": reverse("main:tag_search"),
         }
         return render(request, self.template_name, context)
 
-    def post(self, request, *args, **kwargs):
-        # for creation of BlockGroup and CensusBlock objects
-        STATES_USING_OLD_UNITS = ["il", "ok"]
+    def save_entry(self, entryForm, comm_form, addr_form):
+        """
+        Saves a new community, its address and its audit signature.
+        """
+        entryForm.save()
+        comm_form.save_m2m()
+
+        finalres = dict(
+            [
+                (field.name, getattr(entryForm, field.name))
+                for field in entryForm._meta.fields
+                if field.name not in DERIVED_FIELDS
+            ]
+        )
+        finalres["census_blocks_polygon"] = shapely.wkt.dumps(shapely.wkt.loads(str(entryForm.census_blocks_polygon)[10:]), rounding_precision=10)
+        finalres["user"] = entryForm.user.email
+        if entryForm.organization:
+            finalres["organization"] = entryForm.organization.name
+        if entryForm.drive:
+            finalres["drive"] = entryForm.drive.name
+        finalres["state_obj"] = finalres["state"]
+        del finalres["admin_approved"]
+
+        string_to_hash = str(finalres)
+
+        addres = dict()
+        if addr_form.is_valid():
+            addrForm = addr_form.save(commit=False)
+            addrForm.entry = entryForm
+            addrForm.save()
+
+            addres = dict(
+                [
+                    (field.name, getattr(addrForm, field.name))
+                    for field in addrForm._meta.fields
+                ]
+            )
+            del addres["id"]
+            finalres.update(addres)
+            string_to_hash = str(finalres)
 
+        digest = hmac.new(
+            bytes(os.environ.get("AUDIT_SECRET"), encoding="utf8"),
+            msg=bytes(string_to_hash, encoding="utf8"),
+            digestmod=hashlib.sha256,
+        ).digest()
+        signature = base64.b64encode(digest).decode()
+        sign_obj = Signature(entry=entryForm, hash=signature)
+        sign_obj.save()
+
+    def post(self, request, *args, **kwargs):
         comm_form = self.community_form_class(request.POST, label_suffix="")
         addr_form = self.address_form_class(request.POST, label_suffix="")
         # parse block groups and add to field
         comm_form.data._mutable = True
         block_groups = comm_form.data["block_groups"].split(",")
         census_blocks = comm_form.data["census_blocks"].split(",")
-        # get the year of census units being used -- use for get_or_create function
-        state = self.kwargs["abbr"].lower()
-        year = 2020
-        if state in STATES_USING_OLD_UNITS:
-            year = 2010
+        # get the year of census units being used -- use for resolve_units
+        year = unit_year(self.kwargs["abbr"])
         if len(census_blocks[0]) > 0:
-            comm_form.data["census_blocks"] = [
-                CensusBlock.objects.get_or_create(census_id=block, year=year)[0].id
-                for block in census_blocks
-            ]
+            unit_model, unit_ids = CensusBlock, census_blocks
+            comm_form.data["census_blocks"] = resolve_units(
+                CensusBlock, census_blocks, year
+            )
         else:
-            comm_form.data["block_groups"] = [
-                BlockGroup.objects.get_or_create(census_id=bg, year=year)[0].id
-                for bg in block_groups
-            ]
-
-        def flagText(text):
-            API_KEY = os.environ.get("PERSPECTIVE_API_KEY")
-
-            client = discovery.build(
-                "commentanalyzer",
-                "v1alpha1",
-                developerKey=API_KEY,
-                discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
-                static_discovery=False,
+            unit_model, unit_ids = BlockGroup, block_groups
+            comm_form.data["block_groups"] = resolve_units(
+                BlockGroup, block_groups, year
             )
-
-            # API uses many different metrics to get toxicity. these were the best i found, and i closely
-            # experimented with good thresholds for tolerance. changing these values changes the entire filter
-            # note that IDENTITY_ATTACK is quite low, leading to some false-positives. however, any higher
-            # value for that leads to some false-negatives, especially if people try to game the system with
-            # special characters
-            attributeThresholds = [
-                ("TOXICITY", 0.75),
-                ("IDENTITY_ATTACK", 0.5),
-                ("INSULT", 0.5),
-                ("PROFANITY", 0.75),
-                ("THREAT", 0.9),
-            ]
-
-            analyze_request = {
-                'comment': {'text': text},
-                'languages': ['en'],
-                'requestedAttributes': {'TOXICITY': {}, 'IDENTITY_ATTACK': {}, 'INSULT': {}, 'PROFANITY': {}, 'THREAT': {}},
-            }
-            response = client.comments().analyze(body=analyze_request).execute()
-            for (attribute, threshold) in attributeThresholds :
-                if response["attributeScores"][attribute]["summaryScore"]["value"] >= threshold :
-                    return True
-            return False
+        # the population sent by the page is only kept if some of the units
+        # have no loaded population
+        population, missing = sum_population(unit_model, unit_ids, year)
+        if any(unit_ids) and not missing:
+            comm_form.data["population"] = population
+        # with SUBMIT_UNIT_IDS, the page only sends the ids of the units and
+        # the polygon is assembled from their stored geometries
+        missing_geometry = False
+        if not comm_form.data.get("census_blocks_polygon") and any(unit_ids):
+            polygon = assemble_units(unit_model, unit_ids, year)
+            if polygon is None:
+                missing_geometry = True
+            else:
+                comm_form.data["census_blocks_polygon"] = polygon.ewkt
 
         comm_form.data._mutable = False
+        if missing_geometry and comm_form.is_valid():
+            comm_form.add_error(
+                "census_blocks_polygon", "Census blocks polygon missing."
+            )
         if comm_form.is_valid():
             recaptcha_response = request.POST.get("g-recaptcha-response")
             url = "https://www.google.com/recaptcha/api/siteverify"
@@ -1284,11 +1435,10 @@ class EntryView(LoginRequiredMixin, View):
                 return render(request, self.template_name, context)
 
             entryForm = comm_form.save(commit=False)
-            s3 = boto3.resource(
-                "s3",
-                aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-                aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
-            )
+            # pieces and enclaves are flagged for the reviewers
+            shape = analyze_units(unit_model, unit_ids, year)
+            if shape is not None:
+                entryForm.unit_components, entryForm.unit_holes = shape
             if self.kwargs["drive"]:
                 drive = Drive.objects.get(slug=self.kwargs["drive"])
                 folder_name = self.kwargs["drive"]
@@ -1304,17 +1454,9 @@ class EntryView(LoginRequiredMixin, View):
             entryForm.state_obj = State.objects.get(
                 abbr=self.kwargs["abbr"].upper()
             )
-            if (
-                flagText(comm_form.data["entry_name"])
-                or flagText(comm_form.data["user_name"])
-                or flagText(comm_form.data["cultural_interests"] + " ")
-                or flagText(comm_form.data["economic_interests"] + " ")
-                or flagText(comm_form.data["comm_activities"] + " ")
-                or flagText(comm_form.data["other_considerations"] + " ")
-            ):
-                entryForm.admin_approved = False
-            else:
-                entryForm.admin_approved = True
+            # the texts are checked by the moderate_entry task, which
+            # approves the community if they pass (see pipeline.py)
+            entryForm.admin_approved = False
             if entryForm.organization:
                 if (
                     self.request.user.is_org_admin(entryForm.organization.id)
@@ -1330,97 +1472,31 @@ class EntryView(LoginRequiredMixin, View):
                     if allowlist_entry:
                         # approve this entry
                         entryForm.admin_approved = True
-            gj = make_geojson_for_s3(entryForm)
-
-            s3.Bucket(os.environ.get("AWS_STORAGE_BUCKET_NAME")).put_object(
-                Body=str(gj),
-                Key=f"{folder_name}/{comm_form.data['entry_ID']}.geojson",
-                ServerSideEncryption="AES256",
-                StorageClass="STANDARD_IA",
-            )
 
-            entryForm.save()
-            comm_form.save_m2m()
+            with transaction.atomic():
+                self.save_entry(entryForm, comm_form, addr_form)
 
-            finalres = dict(
-                [
-                    (field.name, getattr(entryForm, field.name))
-                    for field in entryForm._meta.fields
-                ]
-            )
-            finalres["census_blocks_polygon"] = shapely.wkt.dumps(shapely.wkt.loads(str(entryForm.census_blocks_polygon)[10:]), rounding_precision=10)
-            finalres["user"] = entryForm.user.email
-            if entryForm.organization:
-                finalres["organization"] = entryForm.organization.name
-            if entryForm.drive:
-                finalres["drive"] = entryForm.drive.name
-            finalres["state_obj"] = finalres["state"]
-            del finalres["admin_approved"]
-
-            string_to_hash = str(finalres)
-            print("finalres: ")
-            print(finalres)
-
-            if (
-                flagText(comm_form.data["entry_name"])
-                or flagText(comm_form.data["user_name"])
-                or flagText(comm_form.data["cultural_interests"] + " ")
-                or flagText(comm_form.data["economic_interests"] + " ")
-                or flagText(comm_form.data["comm_activities"] + " ")
-                or flagText(comm_form.data["other_considerations"] + " ")
-            ):
-                link = reverse(
-                    "admin:main_communityentry_change",
-                    args=[finalres["entry_ID"]],
-                )  # model name has to be lowercase
-                # ltc = format_html('<a href="{}">{}</a>', link, comm_form.data["entry_name"])
-                Report.objects.create(
-                    community_id=finalres["id"],
-                    email="AUTOMATIC PROFANITY CHECKER",
-                )
-                print(finalres["entry_ID"] + " failed!")
-
-            addres = dict()
-            if addr_form.is_valid():
-                addrForm = addr_form.save(commit=False)
-                addrForm.entry = entryForm
-                addrForm.save()
-
-                addres = dict(
-                    [
-                        (field.name, getattr(addrForm, field.name))
-                        for field in addrForm._meta.fields
-                    ]
-                )
-                del addres["id"]
-                finalres.update(addres)
-                print("polygon: " + finalres["census_blocks_polygon"])
-                string_to_hash = str(finalres)
-                print("string_to_hash: " + string_to_hash)
-
-            digest = hmac.new(
-                bytes(os.environ.get("AUDIT_SECRET"), encoding="utf8"),
-                msg=bytes(string_to_hash, encoding="utf8"),
-                digestmod=hashlib.sha256,
-            ).digest()
-            signature = base64.b64encode(digest).decode()
-            sign_obj = Signature(entry=entryForm, hash=signature)
-            sign_obj.save()
-
-            m_uuid = str(entryForm.entry_ID)
-            if not entryForm.drive:
-                self.success_url = reverse_lazy(
-                    "main:submission_thanks",
-                    kwargs={"map_id": m_uuid, "abbr": folder_name},
-                )
-            else:
-                self.success_url = reverse_lazy(
-                    "main:submission_thanks",
-                    kwargs={
-                        "map_id": m_uuid,
-                        "slug": entryForm.organization.slug,
-                        "drive": entryForm.drive.slug,
-                    },
+                m_uuid = str(entryForm.entry_ID)
+                if not entryForm.drive:
+                    self.success_url = reverse_lazy(
+                        "main:submission_thanks",
+                        kwargs={"map_id": m_uuid, "abbr": folder_name},
+                    )
+                else:
+                    self.success_url = reverse_lazy(
+                        "main:submission_thanks",
+                        kwargs={
+                            "map_id": m_uuid,
+                            "slug": entryForm.organization.slug,
+                            "drive": entryForm.drive.slug,
+                        },
+                    )
+                # the S3 archive, moderation and email run after the commit
+                enqueue_submission(
+                    entryForm,
+                    folder_name,
+                    approve=not entryForm.admin_approved,
+                    path=str(self.success_url),
                 )
             return HttpResponseRedirect(self.success_url)
         context = {
@@ -1438,29 +1514,30 @@ class EntryView(LoginRequiredMixin, View):
 class MultiExportView(TemplateView):
     template = "main/export.html"
 
+    def get(self, request, *args, **kwargs):
+        # the whole state export, which clients can revalidate by ETag
+        return self.export(request, {"all"}, **kwargs)
+
     def post(self, request, *args, **kwargs):
+        return self.export(
+            request, set(json.loads(request.POST["cois"])), **kwargs
+        )
+
+    def export(self, request, cois, **kwargs):
         if not self.request.user.is_authenticated:
             return HttpResponseRedirect(
                 "%s?next=%s" % (settings.LOGIN_URL, request.path)
             )
         state = self.kwargs["abbr"]
-        cois = set(json.loads(request.POST["cois"]))
         state_obj = State.objects.get(abbr=state.upper())
 
+        query = state_obj.submissions.defer(
+            "census_blocks_polygon_array", "user_polygon"
+        ).select_related("organization", "drive")
         if "all" not in cois:
-            query = (
-                state_obj.submissions.filter(entry_ID__in=cois)
-                .defer("census_blocks_polygon_array", "user_polygon")
-                .prefetch_related("organization", "drive")
-            )
-        else:
-            query = (
-                state_obj.submissions.all()
-                .defer("census_blocks_polygon_array", "user_polygon")
-                .prefetch_related("organization", "drive")
-            )
+            query = query.filter(entry_ID__in=cois)
 
-        if not query:
+        if not query.exists():
             # TODO: if the query is empty, return something more appropriate
             # than an empty geojson? - jf
 
@@ -1468,59 +1545,135 @@ class MultiExportView(TemplateView):
                 geojson.dumps({}), content_type="application/json"
             )
 
-        all_gj = []
-        for entry in query:
-            gj = make_geojson_for_state_map_page(request, entry)
-            all_gj.append(gj)
+        def make_feature(entry):
+            return make_geojson_for_state_map_page(request, entry)
 
-        final = geojson.FeatureCollection(all_gj)
         export_name = state_obj.name.replace(" ", "_") + "_communities"
+        export_type = kwargs["type"]
+
+        if export_type == "geo":
+            content_type = "application/json"
+
+            def chunks():
+                # the features are written as they are made
+                return feature_collection(iter_features(query, make_feature))
+
+        elif export_type == "topo":
+            # shared census unit boundaries are stored once
+            try:
+                quantization = parse_quantization(
+                    request.GET.get("quantization")
+                )
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=400)
+            export_type = "topo-%d" % quantization
+            content_type = "application/json"
+
+            def chunks():
+                # the topology needs every feature at once
+                all_gj = list(iter_features(query, make_feature))
+                topology = build_topology(all_gj, quantization)
+                return [json.dumps(topology).encode()]
+
+        elif export_type == "zip":
+            content_type = "application/zip"
+
+            def chunks():
+                return zip_stream(
+                    [
+                        (
+                            "%s.geojson" % export_name,
+                            feature_collection(
+                                iter_features(query, make_feature)
+                            ),
+                        ),
+                        (
+                            "README_geojson.txt",
+                            readme_path("README_geojson.txt"),
+                        ),
+                    ]
+                )
+
+        elif export_type in BULK_FORMATS:
+            # GeoParquet or FlatGeobuf, for GIS tools
+            _, extension, content_type = BULK_FORMATS[export_type]
+
+            def chunks():
+                return bulk_export(export_type, query, viewer=request.user)
 
-        if kwargs["type"] == "geo":
-            print("********", "geo", "********")
-            response = HttpResponse(
-                geojson.dumps(final), content_type="application/json"
-            )
-            # create a zip file that includes geojson + readme explaining the file format and including questions from survey page
-            # with zipfile.ZipFile(response, "w") as z:
-            #     with z.open("%s.geojson" % export_name, "w") as c:
-            #         c.write(geojson.dumps(final).encode("utf-8"))
-            #     z.write(STATIC_ROOT + '/main/readme/README_geojson.txt', arcname="README_geojson.txt")
-            # response['Content-Disposition'] = 'attachment; filename=%s.zip' % export_name
         else:
-            print('********', 'csv', '********')
-            dictform = json.loads(geojson.dumps(final))
-            df = pd.DataFrame()
-            properties = ["entry_name", "author_name", "address", "cultural_interests", "economic_interests", "comm_activities", "other_considerations", "custom_response"]
-            for i, entry in enumerate(dictform["features"]):
-                row_dict = dict()
-                # TODO: get population for each individual block group / block
-                if 'block_group_ids' in entry['properties']:
-                    row_dict['BLOCKID'] = entry['properties']['block_group_ids']
-                elif 'census_block_ids' in entry['properties']:
-                    row_dict['BLOCKID'] = entry['properties']['census_block_ids']
-                else:
-                    break
-                row_dict['DISTRICT'] = [i + 1] * len(row_dict['BLOCKID'])
-                for property in properties:
-                    row_dict[property] = [entry['properties'][property]] * len(row_dict['BLOCKID'])
-
-                # include organization and drive submitted to, if so
-                org = ''
-                drive = ''
-                if 'organization' in entry['properties']:
-                    org = entry['properties']['organization']
-                if 'drive' in entry['properties']:
-                    drive = entry['properties']['drive']
-                row_dict['organization'] = [org] * len(row_dict['BLOCKID'])
-                row_dict['drive'] = [drive] * len(row_dict['BLOCKID'])
-
-                df = df.append(pd.DataFrame(row_dict))
-
-            response = HttpResponse(df.to_csv(index=False), content_type="text/csv")
-            # response = HttpResponse(content_type='application/zip')
-            # with zipfile.ZipFile(response, "w") as z:
-            #     z.writestr('%s.csv' % export_name, comm_csv)
-            #     z.write(STATIC_ROOT + '/main/readme/README_csv.txt', arcname="README_csv.txt")
-            # response['Content-Disposition'] = 'attachment; filename=%s.zip' % export_name
+            # TODO: get population for each individual block group / block
+            export_type = "csv"
+            content_type = "text/csv"
+
+            def chunks():
+                return block_equivalency(
+                    query, list(TESTIMONY_COLUMNS), viewer=request.user
+                )
+
+        # whole state exports are the same for every viewer who sees the
+        # authors and addresses of none of the communities
+        artifact = None
+        if "all" in cois and not query.filter(
+            Q(user=request.user)
+            | Q(organization__in=request.user.get_organizations())
+        ).exists():
+            artifact = export_artifact(
+                state_scope(state_obj.id), export_type, PUBLIC
+            )
+        response = export_response(request, artifact, chunks, content_type)
+        if export_type == "zip":
+            response["Content-Disposition"] = (
+                "attachment; filename=%s.zip" % export_name
+            )
+        elif export_type in BULK_FORMATS:
+            response["Content-Disposition"] = "attachment; filename=%s.%s" % (
+                export_name,
+                extension,
+            )
         return response
+
+
+class ExportJobStart(LoginRequiredMixin, View):
+    """
+    Starts the background export of communities of a state (see
+    export_jobs.py), for exports too large for MultiExportView.
+    """
+
+    def post(self, request, abbr, **kwargs):
+        if kwargs["type"] not in CONTENT_TYPES:
+            raise Http404
+        state_obj = get_object_or_404(State, abbr=abbr.upper())
+        cois = set(json.loads(request.POST["cois"]))
+        query = state_obj.submissions.all()
+        if "all" not in cois:
+            query = query.filter(entry_ID__in=cois)
+        job = start_export(
+            request.user,
+            query,
+            kwargs["type"],
+            state_obj.name.replace(" ", "_") + "_communities",
+        )
+        return JsonResponse(job_status(job), status=202)
+
+
+class ExportJobStatus(LoginRequiredMixin, View):
+    def get(self, request, pk, **kwargs):
+        job = get_object_or_404(ExportJob, pk=pk, user=request.user)
+        return JsonResponse(job_status(job))
+
+
+class ExportJobDownload(LoginRequiredMixin, View):
+    def get(self, request, pk, **kwargs):
+        job = get_object_or_404(
+            ExportJob, pk=pk, user=request.user, status=ExportJob.DONE
+        )
+        # written by a worker to the storage shared with the web processes
+        if not default_storage.exists(job_path(job)):
+            raise Http404
+        return FileResponse(
+            default_storage.open(job_path(job), "rb"),
+            as_attachment=True,
+            filename=job_filename(job),
+            content_type=CONTENT_TYPES[job.format],
+        )
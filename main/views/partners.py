@@ -20,9 +20,6 @@ from django.views.generic import (
 
 # import boto3
 # import botocore
-import pandas
-import zipfile
-from representable.settings.base import STATIC_ROOT
 from django.contrib.gis import geos
 from django.contrib.gis.geos import GEOSGeometry, MultiPolygon, Polygon
 
@@ -33,11 +30,34 @@ import geojson
 from django.shortcuts import get_object_or_404
 from geojson_rewind import rewind
 from django.core.serializers import serialize
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.http import (
+    HttpResponse,
+    HttpResponseRedirect,
+    Http404,
+    JsonResponse,
+)
 from django.shortcuts import render
 from django.urls import reverse_lazy
 
 from .main import make_geojson
+from .. import tiles
+from ..encoding import page_encoding
+from ..exports import (
+    ADMIN,
+    BULK_FORMATS,
+    PUBLIC,
+    block_equivalency,
+    bulk_export,
+    export_artifact,
+    export_response,
+    feature_collection,
+    iter_features,
+    readme_path,
+    zip_stream,
+)
+from ..partner_maps import get_partner_map_payload
+from ..topojson import build_topology, parse_quantization
+from ..versions import drive_scope, org_scope
 
 
 class IndexView(ListView):
@@ -64,12 +84,6 @@ class PartnerMap(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        # the polygon coordinates
-        entryPolyDict = dict()
-        # the size of each polygon in number of block groups or census blocks
-        numBlock = dict()
-        numBG = dict()
-
         # get the org to which this map belongs
         try:
             org = Organization.objects.get(slug=self.kwargs["slug"])
@@ -84,70 +98,29 @@ class PartnerMap(TemplateView):
         if user.is_authenticated:
             is_admin = user.is_org_admin(org.id)
 
-        # get the polygon from db and pass it on to html
         if self.kwargs["drive"]:
             try:
                 drive = Drive.objects.get(slug=self.kwargs["drive"])
             except:
                 raise Http404
-            query = drive.submissions.all().defer(
-                "census_blocks_polygon_array", "user_polygon",
-            ).prefetch_related("organization").order_by("-created_at")
-
         else:
             drive = None
-            query = org.submissions.all().defer(
-                "census_blocks_polygon_array", "user_polygon"
-            ).prefetch_related("drive").order_by("-created_at")
-
-        # address information if admin/user drew the comms
-        streets = {}
-        cities = {}
-        for obj in query:
-            if not is_admin and not obj.admin_approved:
-                continue
-            if not obj.census_blocks_polygon and obj.user_polygon:
-                s = "".join(obj.user_polygon.geojson)
-            elif obj.census_blocks_polygon:
-                s = "".join(obj.census_blocks_polygon.geojson)
-            else:
-                continue
-            if is_admin:
-                if not obj.user_name:
-                    obj.user_name = obj.user.username
-            else:
-                if obj.user_name:
-                    obj.user_name = ""
-
-            struct = geojson.loads(s)
-            entryPolyDict[obj.entry_ID] = struct.coordinates
-
-            numBG[obj.entry_ID] = len(obj.block_groups.all())
-            numBlock[obj.entry_ID] = len(obj.census_blocks.all())
-
-            # if is_admin:
-            #     for a in Address.objects.filter(entry=obj):
-            #         streets[obj.entry_ID] = a.street
-            #         cities[obj.entry_ID] = (
-            #             a.city + ", " + a.state + " " + a.zipcode
-            #         )
-
-        if (self.request.user.is_authenticated and self.request.user.is_org_admin(org.id)):
-            comms_counter = query.count()
-            print(comms_counter)
-        else:
-            comms_counter = query.filter(admin_approved=True).count()
-            print("not admin or authenticated")
-            print(comms_counter)
+        # the communities, their coordinates and their size in block groups
+        # or census blocks, cached per map and audience
+        payload = get_partner_map_payload(
+            org, drive, tiles.ADMIN if is_admin else tiles.PUBLIC
+        )
 
         context = {
-            "streets": streets,
-            "cities": cities,
-            "communities": query,
-            "comms_counter": comms_counter,
-            "entries": json.dumps(entryPolyDict),
-            "numBlock": numBlock,
-            "numBG": numBG,
+            # address information if admin/user drew the comms
+            "streets": {},
+            "cities": {},
+            "communities": payload["communities"],
+            "comms_counter": len(payload["communities"]),
+            "entries": payload["entries"],
+            "geometry_encoding": page_encoding(),
+            "numBlock": payload["numBlock"],
+            "numBG": payload["numBG"],
             "mapbox_key": os.environ.get("DISTR_MAPBOX_KEY"),
             "mapbox_user_name": os.environ.get("MAPBOX_USER_NAME"),
         }
@@ -168,17 +141,23 @@ class PartnerMap(TemplateView):
             context["multi_export_link"] = (
                 "/multiexport/org/" + self.kwargs["slug"]
             )
+            context["tiles_url"] = (
+                "/tiles/communities/{z}/{x}/{y}.mvt?org=" + self.kwargs["slug"]
+            )
 
-        if self.kwargs["drive"]:
-            map_drive = get_object_or_404(Drive, slug=self.kwargs["drive"])
-            context["drive"] = map_drive.name
-            context["state"] = map_drive.state.lower()
+        if drive is not None:
+            context["drive"] = drive.name
+            context["state"] = drive.state.lower()
             context["multi_export_link"] = (
                 "/multiexport/drive/" + self.kwargs["drive"]
             )
             context["drive_slug"] = self.kwargs["drive"]
+            context["tiles_url"] = (
+                "/tiles/communities/{z}/{x}/{y}.mvt?drive="
+                + self.kwargs["drive"]
+            )
         if self.request.user.is_authenticated:
-            context["is_org_admin"] = self.request.user.is_org_admin(org.id)
+            context["is_org_admin"] = is_admin
         return context
 
 
@@ -289,8 +268,11 @@ class MultiExportView(TemplateView):
             query = CommunityEntry.objects.filter(
                 organization__slug=org, admin_approved=True
             )
+        query = query.filter(organization__isnull=False).select_related(
+            "organization", "drive"
+        )
 
-        if not query:
+        if not query.exists():
             # TODO: if the query is empty, return something more appropriate
             # than an empty geojson? - jf
 
@@ -298,51 +280,100 @@ class MultiExportView(TemplateView):
                 geojson.dumps({}), content_type="application/json"
             )
 
-        all_gj = []
-        for entry in query:
-            if not entry.organization:
-                continue
-            gj = make_geojson(request, entry)
-            all_gj.append(gj)
+        def make_feature(entry):
+            return make_geojson(request, entry)
 
-        final = geojson.FeatureCollection(all_gj)
         # setting name of exported file
         if drive:
             drive_obj = Drive.objects.get(slug=drive)
             export_name = drive_obj.name.replace(" ", "_") + "_communities"
+            scope = drive_scope(drive_obj.id)
+            org_id = drive_obj.organization_id
         else:
             org_obj = Organization.objects.get(slug=org)
             export_name = org_obj.name.replace(" ", "_") + "_communities"
+            scope = org_scope(org_obj.id)
+            org_id = org_obj.id
+
+        export_type = kwargs["type"]
+        if export_type == "topo":
+            # shared census unit boundaries are stored once
+            try:
+                quantization = parse_quantization(
+                    request.GET.get("quantization")
+                )
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=400)
+            export_type = "topo-%d" % quantization
+
+            def members():
+                # the topology needs every feature at once
+                topology = build_topology(
+                    list(iter_features(query, make_feature)), quantization
+                )
+                return [
+                    (
+                        "%s.topojson" % export_name,
+                        [json.dumps(topology).encode()],
+                    ),
+                    ("README_geojson.txt", readme_path("README_geojson.txt")),
+                ]
+
+        elif export_type == "geo":
+            # a zip file that includes the features + a readme explaining
+            # the file format, written as the features are made
+            def members():
+                features = iter_features(query, make_feature)
+                return [
+                    (
+                        "%s.geojson" % export_name,
+                        feature_collection(features),
+                    ),
+                    ("README_geojson.txt", readme_path("README_geojson.txt")),
+                ]
+
+        elif export_type in BULK_FORMATS:
+            # GeoParquet or FlatGeobuf, for GIS tools, without a zip file
+            members = None
 
-        if(kwargs['type'] == 'geo'):
-            print('********', 'geo', '********')
-            # create a zip file that includes geojson + readme explaining the file format and including questions from survey page
-            response = HttpResponse(content_type='application/zip')
-            with zipfile.ZipFile(response, "w") as z:
-                with z.open("%s.geojson" % export_name, "w") as c:
-                    c.write(geojson.dumps(final).encode("utf-8"))
-                z.write(STATIC_ROOT + '/main/readme/README_geojson.txt', arcname="README_geojson.txt")
-            response['Content-Disposition'] = 'attachment; filename=%s.zip' % export_name
         else:
-            print('********', 'csv', '********')
-            dictform = json.loads(geojson.dumps(final))
-            df = pandas.DataFrame()
-            for i, entry in enumerate(dictform["features"]):
-                row_dict = dict()
-                if 'block_group_ids' in entry['properties']:
-                    row_dict['BLOCKID'] = entry['properties']['block_group_ids']
-                elif 'census_block_ids' in entry['properties']:
-                    row_dict['BLOCKID'] = entry['properties']['census_block_ids']
-                else:
-                    break
-                row_dict['DISTRICT'] = [i + 1] * len(row_dict['BLOCKID'])
-                df = df.append(pandas.DataFrame(row_dict))
-            comm_csv = df.to_csv(index=False)
-            response = HttpResponse(content_type='application/zip')
-            with zipfile.ZipFile(response, "w") as z:
-                z.writestr('%s.csv' % export_name, comm_csv)
-                z.write(STATIC_ROOT + '/main/readme/README_csv.txt', arcname="README_csv.txt")
-            response['Content-Disposition'] = 'attachment; filename=%s.zip' % export_name
+            export_type = "csv"
+
+            def members():
+                return [
+                    ("%s.csv" % export_name, block_equivalency(query)),
+                    ("README_csv.txt", readme_path("README_csv.txt")),
+                ]
+
+        # the admins of the organization see the authors and addresses of
+        # every community, other viewers only those of their own
+        audience = PUBLIC
+        if request.user.is_authenticated:
+            if request.user.is_org_admin(org_id):
+                audience = ADMIN
+            elif query.filter(user=request.user).exists():
+                audience = None
+        artifact = audience and export_artifact(scope, export_type, audience)
+        if members is None:
+            _, extension, content_type = BULK_FORMATS[export_type]
+            response = export_response(
+                request,
+                artifact,
+                lambda: bulk_export(export_type, query, viewer=request.user),
+                content_type,
+            )
+        else:
+            extension = "zip"
+            response = export_response(
+                request,
+                artifact,
+                lambda: zip_stream(members()),
+                "application/zip",
+            )
+        response["Content-Disposition"] = "attachment; filename=%s.%s" % (
+            export_name,
+            extension,
+        )
 
         return response
 
@@ -296,3 +296,67 @@ MEDIA_ROOT= os.path.join(BASE_DIR, 'media')
 MEDIA_URL= "/media/"
 
 MAX_UPLOAD_SIZE = "500000"
+
+# Rendered community vector tiles, keyed by scope version (see main/tiles.py)
+TILE_CACHE_DIR = os.environ.get(
+    "TILE_CACHE_DIR", os.path.join(BASE_DIR, "tile_cache")
+)
+
+# Exports of whole states, organizations and drives, keyed by scope version
+# (see main/exports.py)
+EXPORT_CACHE_DIR = os.environ.get(
+    "EXPORT_CACHE_DIR", os.path.join(BASE_DIR, "export_cache")
+)
+
+# Coordinate encoding of the communities embedded in map pages, "" for plain
+# GeoJSON coordinates (see main/encoding.py)
+MAP_GEOMETRY_ENCODING = os.environ.get("MAP_GEOMETRY_ENCODING", "polyline6")
+
+# Default quantization of the TopoJSON map data and exports, 0 for none
+# (see main/topojson.py)
+TOPOJSON_QUANTIZATION = int(os.environ.get("TOPOJSON_QUANTIZATION", 100000))
+
+# Census id -> pk catalogs of (state, year) kept in memory by each process
+# (see main/units.py)
+CENSUS_UNIT_CATALOG_SIZE = int(os.environ.get("CENSUS_UNIT_CATALOG_SIZE", 4))
+
+# Scores the texts of submitted communities (see main/moderation.py)
+MODERATION_BACKEND = os.environ.get(
+    "MODERATION_BACKEND", "main.moderation.TriageBackend"
+)
+
+# The local moderation classifier saved by train_moderation_model, and the
+# probability under which TriageBackend does not ask the Perspective API
+MODERATION_MODEL_PATH = os.environ.get(
+    "MODERATION_MODEL_PATH", os.path.join(BASE_DIR, "moderation_model.npz")
+)
+MODERATION_CLEAN_BELOW = float(os.environ.get("MODERATION_CLEAN_BELOW", 0.05))
+
+# Background tasks are retried after TASK_RETRY_DELAY seconds, doubled after
+# each failure up to TASK_MAX_RETRY_DELAY (see main/tasks.py)
+TASK_RETRY_DELAY = int(os.environ.get("TASK_RETRY_DELAY", 30))
+TASK_MAX_RETRY_DELAY = int(os.environ.get("TASK_MAX_RETRY_DELAY", 3600))
+
+# Whether the entry page only submits the ids of the selected units, and the
+# polygon is assembled from the unit geometries loaded by load_census_units
+# (see main/units.py)
+SUBMIT_UNIT_IDS = os.environ.get("SUBMIT_UNIT_IDS", "") == "true"
+
+# Unit population tables of (unit type, state, year) kept in memory by each
+# process (see main/population.py)
+POPULATION_TABLE_SIZE = int(os.environ.get("POPULATION_TABLE_SIZE", 8))
+
+# Unit adjacency graphs of (unit type, state, year) kept in memory by each
+# process (see main/adjacency.py)
+UNIT_GRAPH_CACHE_SIZE = int(os.environ.get("UNIT_GRAPH_CACHE_SIZE", 4))
+
+# Background exports (see main/export_jobs.py): the folder of their files
+# in the default file storage, shared by the workers and the web processes,
+# how many days their files are kept, how many communities each task
+# writes, how many jobs run at a time, and the size of the admin exports
+# that are run in the background
+EXPORT_JOB_FOLDER = os.environ.get("EXPORT_JOB_FOLDER", "export_jobs")
+EXPORT_JOB_EXPIRY_DAYS = int(os.environ.get("EXPORT_JOB_EXPIRY_DAYS", 7))
+EXPORT_JOB_CHUNK_SIZE = int(os.environ.get("EXPORT_JOB_CHUNK_SIZE", 500))
+EXPORT_JOB_CONCURRENCY = int(os.environ.get("EXPORT_JOB_CONCURRENCY", 2))
+EXPORT_JOB_THRESHOLD = int(os.environ.get("EXPORT_JOB_THRESHOLD", 1000))